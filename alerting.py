@@ -0,0 +1,381 @@
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+
+UP = "UP"
+DOWN = "DOWN"
+DEGRADED = "DEGRADED"
+
+
+class CheckState:
+    """
+    State machine of a single check. A result is observed as UP, DOWN or DEGRADED (up, but slower than the
+    service's degraded_ms), and the state only moves once N of the last M observations agree, so a single
+    lost packet does not raise an alert. Flapping is detected from the share of changing observations in a
+    longer window, with separate start and stop thresholds so it does not flap itself.
+    """
+    def __init__(self, confirm=2, window=3, flap_window=20, flap_start=0.5, flap_stop=0.25):
+        """
+        :param confirm: observations (N) that have to agree before the state changes
+        :param window: most recent observations (M) the confirmation looks at
+        :param flap_window: observations used for flap detection
+        :param flap_start: share of changing observations at which the check is flapping
+        :param flap_stop: share of changing observations under which it stops flapping
+        """
+        self.confirm = confirm
+        self.observations = collections.deque(maxlen=window)
+        self.history = collections.deque(maxlen=flap_window)
+        self.flap_start = flap_start
+        self.flap_stop = flap_stop
+        self.state = None
+        self.reported = None
+        self.flapping = False
+
+    @staticmethod
+    def observe(result, params):
+        """
+        Classify a single result
+        :param result: result record returned by probe_service
+        :param params: parameters of the service
+        :return: UP, DOWN or DEGRADED
+        """
+        if not result['status']:
+            return DOWN
+        if 'degraded_ms' in params and result['latency_ms'] > params['degraded_ms']:
+            return DEGRADED
+        return UP
+
+    def update(self, observation):
+        """
+        Feed an observation
+        :param observation: UP, DOWN or DEGRADED
+        :return: list of events, each 'state' or 'flap_start' / 'flap_stop'
+        """
+        events = []
+
+        # Flap detection looks at how often consecutive observations differ, once there are enough of them
+        self.history.append(observation)
+        history = list(self.history)
+        changes = sum(1 for previous, current in zip(history, history[1:]) if previous != current)
+        if len(history) >= self.history.maxlen // 2:
+            share = changes / (len(history) - 1)
+            if not self.flapping and share >= self.flap_start:
+                self.flapping = True
+                events.append('flap_start')
+            elif self.flapping and share < self.flap_stop:
+                self.flapping = False
+                events.append('flap_stop')
+
+        # N of M confirmation
+        self.observations.append(observation)
+        if observation != self.state and self.observations.count(observation) >= self.confirm:
+            self.state = observation
+            events.append('state')
+
+        return events
+
+
+class StateTracker:
+    """
+    Sink that runs a state machine per check (and per vantage point for distributed results) and hands
+    state changes and flapping to the alert dispatcher. Only changes from the state that was last
+    alerted are reported, starting from UP.
+    """
+    def __init__(self, dispatcher, get_server_dict, confirm=2, window=3):
+        """
+        :param dispatcher: AlertDispatcher receiving the alerts
+        :param get_server_dict: returns the current server dict, for per-service params such as degraded_ms
+        :param confirm: observations that have to agree before the state changes
+        :param window: most recent observations the confirmation looks at
+        """
+        if not 0 < confirm <= window:
+            raise ValueError(f"Cannot confirm {confirm} of the last {window} results")
+        self.dispatcher = dispatcher
+        self.get_server_dict = get_server_dict
+        self.confirm = confirm
+        self.window = window
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def emit(self, result):
+        """
+        Update the state of the result's check and alert on changes
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        # Nothing to report behind a failed parent, which alerts for the whole subtree. The result is not
+        # observed either, so a check still failing once its parent recovers is confirmed and alerted then.
+        if 'suppressed_by' in result:
+            return
+        key = (result['server'], result['service'], result.get('vantage'))
+        params = self.get_server_dict().get(result['server'], {}).get(result['service'], {})
+        observation = CheckState.observe(result, params)
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = CheckState(self.confirm, self.window)
+
+            for event in state.update(observation):
+                # Flapping checks were reported as such, and a check returning to the state that was
+                # reported last (UP on startup) has nothing new to say
+                if event == 'state' and (state.flapping or state.state == (state.reported or UP)):
+                    continue
+
+                alert = {
+                    'timestamp': result['timestamp'],
+                    'server': result['server'],
+                    'service': result['service'],
+                    'event': event,
+                    'state': state.state,
+                    'previous': state.reported,
+                    'detail': result['detail']
+                }
+                if 'vantage' in result:
+                    alert['vantage'] = result['vantage']
+                if event != 'flap_start':
+                    state.reported = state.state
+                self.dispatcher.submit(alert)
+
+    def reopen(self):
+        """
+        Reopen the alert channels, e.g. after log rotation
+        :return: None
+        """
+        self.dispatcher.reopen()
+
+    def close(self):
+        """
+        Deliver pending alerts and stop the dispatcher
+        :return: None
+        """
+        self.dispatcher.close()
+
+
+def format_alert(alert):
+    """
+    Format an alert as a single line of text
+    :param alert: alert record
+    :return: formatted string
+    """
+    target = f"{alert['service']} {alert['server']}"
+    if 'vantage' in alert:
+        target += f" from {alert['vantage']}"
+    if alert['event'] == 'flap_start':
+        return f"[{alert['timestamp']}] {target} is FLAPPING, alerts suppressed until it settles"
+    if alert['event'] == 'flap_stop':
+        return f"[{alert['timestamp']}] {target} stopped flapping and is {alert['state']}"
+    detail = alert['detail'].replace("\n", " | ")
+    return f"[{alert['timestamp']}] {target} is {alert['state']} (was {alert['previous'] or 'unknown'}) - {detail}"
+
+
+class WebhookChannel:
+    """
+    Posts each batch of alerts as a json document {"alerts": [...]} to a url
+    """
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, alerts):
+        """
+        :param alerts: list of alert records
+        :return: None
+        """
+        request = urllib.request.Request(self.url, data=json.dumps({'alerts': alerts}).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def reopen(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileChannel:
+    """
+    Appends alerts to a file as json lines
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", buffering=1)
+
+    def deliver(self, alerts):
+        """
+        :param alerts: list of alert records
+        :return: None
+        """
+        self.file.write("".join(json.dumps(alert) + "\n" for alert in alerts))
+
+    def reopen(self):
+        self.file.close()
+        self.file = open(self.path, "a", buffering=1)
+
+    def close(self):
+        self.file.close()
+
+
+class SyslogChannel:
+    """
+    Sends alerts to syslog, DOWN as errors and everything else as warnings
+    """
+    def __init__(self, address=None):
+        """
+        :param address: (host, port) of a syslog server, defaults to the local /dev/log or localhost:514
+        """
+        if address is None:
+            address = "/dev/log" if os.path.exists("/dev/log") else ("localhost", 514)
+        self.handler = logging.handlers.SysLogHandler(address)
+        self.handler.setFormatter(logging.Formatter("netcam: %(message)s"))
+
+    def deliver(self, alerts):
+        """
+        :param alerts: list of alert records
+        :return: None
+        """
+        for alert in alerts:
+            level = logging.ERROR if alert['state'] == DOWN and alert['event'] == 'state' else logging.WARNING
+            self.handler.emit(logging.makeLogRecord({'msg': format_alert(alert), 'levelno': level,
+                                                     'levelname': logging.getLevelName(level)}))
+
+    def reopen(self):
+        pass
+
+    def close(self):
+        self.handler.close()
+
+
+class AlertDispatcher:
+    """
+    Delivers alerts to the channels in the background. Every channel has its own queue and thread, so a slow
+    webhook neither delays the checks nor the other channels. An alert repeating the previous alert of the same
+    check within the dedup window (e.g. the same outage seen from several vantage points) is dropped, and
+    alerts arriving close together are delivered as one batch.
+    """
+    def __init__(self, channels, batch_interval=2, dedup_window=300, max_queue=1000):
+        """
+        :param channels: alert channels such as WebhookChannel, FileChannel or SyslogChannel
+        :param batch_interval: seconds to collect alerts for after the first one before delivering
+        :param dedup_window: seconds during which a repeat of a check's previous alert is dropped
+        :param max_queue: alerts queued per channel before new ones are dropped
+        """
+        self.channels = channels
+        self.batch_interval = batch_interval
+        self.dedup_window = dedup_window
+        self.queues = [queue.Queue(max_queue) for channel in channels]
+        self.sent = {}
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.failed = 0
+        self.threads = [threading.Thread(target=self.run, args=(channel, alerts), name="alert-channel", daemon=True)
+                        for channel, alerts in zip(channels, self.queues)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, alert):
+        """
+        Queue an alert without blocking
+        :param alert: alert record
+        :return: None
+        """
+        key = (alert['server'], alert['service'])
+        now = time.monotonic()
+        with self.lock:
+            previous = self.sent.get(key)
+            if previous and previous[:2] == (alert['event'], alert['state']) and now - previous[2] < self.dedup_window:
+                return
+            self.sent[key] = (alert['event'], alert['state'], now)
+
+        for alerts in self.queues:
+            try:
+                alerts.put_nowait(alert)
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+
+    def run(self, channel, alerts):
+        """
+        Deliver batches to one channel until a None sentinel is received
+        :param channel: alert channel
+        :param alerts: queue of the channel
+        :return: None
+        """
+        stopping = False
+        while not stopping:
+            batch = [alerts.get()]
+            deadline = time.monotonic() + self.batch_interval
+            while batch[-1] is not None and time.monotonic() < deadline:
+                try:
+                    batch.append(alerts.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            if not batch:
+                continue
+
+            try:
+                channel.deliver(batch)
+            except Exception as e:
+                # A broken channel must not stop alerting on the others
+                with self.lock:
+                    self.failed += len(batch)
+                print(f"Failed to deliver {len(batch)} alerts with {type(channel).__name__}: {e}", file=sys.stderr)
+
+    def reopen(self):
+        """
+        Reopen every channel
+        :return: None
+        """
+        for channel in self.channels:
+            channel.reopen()
+
+    def close(self, timeout=10):
+        """
+        Deliver what is queued, then stop every channel, waiting at most timeout for each. A channel stuck
+        delivering (e.g. a webhook that does not answer) is left behind rather than holding up the shutdown.
+        :param timeout: seconds to wait for each channel
+        :return: None
+        """
+        for thread, alerts in zip(self.threads, self.queues):
+            if thread.is_alive():
+                try:
+                    alerts.put(None, timeout=timeout)
+                except queue.Full:
+                    pass
+        for thread, channel, alerts in zip(self.threads, self.channels, self.queues):
+            thread.join(timeout)
+            if thread.is_alive():
+                print(f"{type(channel).__name__} did not finish within {timeout} s, "
+                      f"{alerts.qsize()} alerts not delivered", file=sys.stderr)
+            channel.close()
+
+
+def create_channel(spec):
+    """
+    Create an alert channel from a command line spec: "webhook:<url>", "file:<path>", "syslog" or
+    "syslog:<host>:<port>"
+    :param spec: channel specification string
+    :return: alert channel
+    """
+    kind, _, target = spec.partition(":")
+    if kind == "webhook" and target:
+        return WebhookChannel(target)
+    if kind == "file" and target:
+        return FileChannel(target)
+    if kind == "syslog":
+        if not target:
+            return SyslogChannel()
+        host, _, port = target.rpartition(":")
+        return SyslogChannel((host, int(port)))
+
+    raise ValueError(f"Invalid alert channel: {spec} (expected webhook:<url>, file:<path> or syslog[:<host>:<port>])")
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Run from the project root so the flat modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import network_tests
+from fakes import EchoServer, FakeHTTPServer, TCPListener, UDPListener, make_certificate
+from fault_proxy import Fault, TCPFaultProxy, UDPFaultProxy
+
+# Conditions every probe is run under
+FAULTS = {
+    'clean': {},
+    'delay 100ms': {'delay': 0.1},
+    'jitter 0-200ms': {'jitter': 0.2},
+    'loss 30%': {'loss': 0.3},
+    'bandwidth 4 KiB/s': {'bandwidth': 4096},
+    'reset': {'reset': 1.0},
+    'refused': {'refuse': True},
+    'blackhole': {'blackhole': True}
+}
+
+# Status each probe should report under a fault, where it is not up. A TCP port check only completes the
+# handshake, which the proxy's kernel answers before a reset after accepting, so only a refused handshake or
+# a blackhole takes it down. A UDP port is up while it answers or stays silent, so delays, loss and even a
+# blackhole look like an open port, and only the ICMP port unreachable of a refused port takes it down.
+EXPECTED_DOWN = {
+    ('check_tcp_port', 'refused'),
+    ('check_tcp_port', 'blackhole'),
+    ('check_udp_port', 'refused'),
+    ('check_server_https', 'reset'),
+    ('check_server_https', 'refused'),
+    ('check_server_https', 'blackhole'),
+    ('local_tcp_echo', 'reset'),
+    ('local_tcp_echo', 'refused'),
+    ('local_tcp_echo', 'blackhole')
+}
+
+
+def start_targets(directory):
+    """
+    Start the stand-ins the probes reach through the proxy
+    :param directory: directory for the HTTPS certificate
+    :return: dictionary of probe name to (stand-in, proxy class)
+    """
+    certificate = make_certificate(directory)
+    os.environ['REQUESTS_CA_BUNDLE'] = certificate[0]
+    return {
+        'check_tcp_port': (TCPListener("127.0.0.1").start(), TCPFaultProxy),
+        'check_udp_port': (UDPListener().start(), UDPFaultProxy),
+        'check_server_https': (FakeHTTPServer("127.0.0.1", 0, certificate=certificate).start(), TCPFaultProxy),
+        'local_tcp_echo': (EchoServer().start(), TCPFaultProxy)
+    }
+
+
+def probe(name, address):
+    """
+    Run one probe against the proxy
+    :param name: probe to run
+    :param address: (host, port) of the proxy
+    :return: True if the probe reported the target as up
+    """
+    host, port = address
+    if name == 'check_tcp_port':
+        return network_tests.check_tcp_port(host, port)[0]
+    if name == 'check_udp_port':
+        return network_tests.check_udp_port(host, port, 1)[0]
+    if name == 'check_server_https':
+        return network_tests.check_server_https(f"https://{host}:{port}/", 3)[0]
+    return network_tests.local_tcp_echo(host, port, verbose=False)[0]
+
+
+def run_scenario(name, target, proxy_class, settings, repeat, seed):
+    """
+    Run a probe repeatedly through a proxy imposing a fault
+    :param name: probe to run
+    :param target: stand-in the proxy forwards to
+    :param proxy_class: TCPFaultProxy or UDPFaultProxy
+    :param settings: keyword arguments of the Fault
+    :param repeat: probes to run
+    :param seed: seed of the fault
+    :return: dictionary with the statuses and latencies seen
+    """
+    proxy = proxy_class(target.address, Fault(seed=seed, **settings)).start()
+    statuses, timings = [], []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            statuses.append(bool(probe(name, proxy.address)))
+            timings.append(time.perf_counter() - start)
+    finally:
+        proxy.stop()
+    return {
+        'up': sum(statuses),
+        'down': len(statuses) - sum(statuses),
+        'mean_ms': round(statistics.mean(timings) * 1000, 1),
+        'max_ms': round(max(timings) * 1000, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check how the probes behave behind a fault-injecting proxy")
+    parser.add_argument("--repeat", type=int, default=3, help="Probes per probe and fault (default 3)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of loss, jitter and resets (default 1)")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    report, mismatches = {}, 0
+    with tempfile.TemporaryDirectory() as directory:
+        targets = start_targets(directory)
+        try:
+            for name, (target, proxy_class) in targets.items():
+                report[name] = {}
+                for fault, settings in FAULTS.items():
+                    try:
+                        result = run_scenario(name, target, proxy_class, settings, args.repeat, args.seed)
+                    except ImportError as e:
+                        report[name] = {'skipped': f"missing dependency: {e.name}"}
+                        print(f"{name:<20} skipped, missing dependency: {e.name}")
+                        break
+
+                    # Random faults only have to hit some of the probes, the others must be consistent
+                    expected = "down" if (name, fault) in EXPECTED_DOWN else "up"
+                    result['expected'] = expected
+                    result['ok'] = result[expected] == args.repeat
+                    mismatches += not result['ok']
+                    report[name][fault] = result
+                    print(f"{name:<20} {fault:<18} {result['up']} up {result['down']} down "
+                          f"(expected {expected}) mean {result['mean_ms']:>8.1f} ms max {result['max_ms']:>8.1f} ms"
+                          f"{'' if result['ok'] else '  MISMATCH'}")
+        finally:
+            for target, proxy_class in targets.values():
+                target.stop()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
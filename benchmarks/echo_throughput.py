@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Run from the project root so the flat modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from echo_server import ECHO_MODES
+from fakes import EchoServer
+
+# Port of the servers under test, away from the default so a running echo server does not get in the way
+BENCHMARK_PORT = 12346
+
+# Clock ticks per second of the cpu times in /proc
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def cpu_seconds(pid):
+    """
+    User and system cpu time a process used so far
+    :param pid: process id
+    :return: seconds, or None where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # The command name may contain spaces, the fields after it do not
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def echo_connection(address, payload, size, received):
+    """
+    Stream bytes through the echo server on one connection, sending and receiving at the same time
+    :param address: (host, port) of the echo server
+    :param payload: chunk sent repeatedly
+    :param size: bytes to send
+    :param received: list the number of bytes echoed back is appended to
+    :return: None
+    """
+    with socket.create_connection(address) as sock:
+        def send():
+            sent = 0
+            view = memoryview(payload)
+            while sent < size:
+                sock.sendall(view[:min(len(payload), size - sent)])
+                sent += min(len(payload), size - sent)
+            # The server closes the connection once everything was echoed and it sees the end of the stream
+            sock.shutdown(socket.SHUT_WR)
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+
+        buffer = bytearray(65536)
+        total = 0
+        while total < size:
+            count = sock.recv_into(buffer)
+            if not count:
+                break
+            total += count
+        sender.join()
+        received.append(total)
+
+
+def measure(mode, connections, size, chunk):
+    """
+    Run concurrent connections through an echo server
+    :param mode: echo path of the server
+    :param connections: concurrent connections
+    :param size: bytes sent on every connection
+    :param chunk: bytes per send
+    :return: dictionary with throughput and server cpu time
+    """
+    # Letters only, the text echo path decodes every chunk
+    payload = (b"abcdefghijklmnopqrstuvwxyz" * (chunk // 26 + 1))[:chunk]
+    server = EchoServer(mode, BENCHMARK_PORT).start()
+    try:
+        cpu_before = cpu_seconds(server.process.pid)
+        received = []
+        clients = [threading.Thread(target=echo_connection, args=(server.address, payload, size, received))
+                   for _ in range(connections)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+        cpu_after = cpu_seconds(server.process.pid)
+    finally:
+        server.stop()
+
+    echoed = sum(received)
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        'connections': connections,
+        'echoed_mb': round(echoed / 2 ** 20, 1),
+        'complete': echoed == connections * size,
+        'seconds': round(elapsed, 3),
+        'mb_per_second': round(echoed / 2 ** 20 / elapsed, 1),
+        'server_cpu_seconds': round(cpu, 3) if cpu is not None else None,
+        'cpu_ms_per_connection': round(cpu * 1000 / connections, 1) if cpu is not None else None,
+        'cpu_ms_per_mb': round(cpu * 1000 / (echoed / 2 ** 20), 2) if cpu is not None and echoed else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the throughput and cpu cost of the echo server's echo paths")
+    parser.add_argument("--modes", default=",".join(mode for mode in ("text", "bytes", "splice") if mode in ECHO_MODES),
+                        help="Echo paths to compare (default every one this system supports)")
+    parser.add_argument("--connections", type=int, default=4, help="Concurrent connections (default 4)")
+    parser.add_argument("--mb", type=float, default=16, help="Megabytes sent on every connection (default 16)")
+    parser.add_argument("--chunk", type=int, default=65536, help="Bytes per send (default 65536)")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    report = {}
+    for mode in (mode for mode in args.modes.split(",") if mode):
+        result = report[mode] = measure(mode, args.connections, int(args.mb * 2 ** 20), args.chunk)
+        cpu = (f"server cpu {result['cpu_ms_per_connection']:>8.1f} ms/connection {result['cpu_ms_per_mb']:>6.2f} ms/MB"
+               if result['server_cpu_seconds'] is not None else "server cpu n/a")
+        print(f"{mode:<7} {result['mb_per_second']:>9.1f} MB/s  {cpu}"
+              f"{'' if result['complete'] else '  INCOMPLETE'}")
+
+    # Relative to the text echo path every other path replaces
+    baseline = report.get("text")
+    if baseline and baseline['mb_per_second']:
+        for mode, result in report.items():
+            if mode != "text":
+                print(f"{mode} vs text: {result['mb_per_second'] / baseline['mb_per_second']:.1f}x throughput")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+import http.server
+import os
+import random
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+# Seconds between 1900 (NTP epoch) and 1970 (unix epoch)
+NTP_EPOCH_OFFSET = 2208988800
+
+# Record types the stub DNS server answers, with the address it answers with
+DNS_ANSWERS = {
+    1: socket.inet_pton(socket.AF_INET, "127.0.0.1"),  # A
+    28: socket.inet_pton(socket.AF_INET6, "::1")  # AAAA
+}
+
+
+class Impairment:
+    """
+    Injected latency and loss shared by the stand-in servers. A lost request is never answered (datagrams)
+    or has its connection closed without a response (streams).
+    """
+    def __init__(self, latency=0.0, loss=0.0, seed=None):
+        """
+        :param latency: seconds added before every response
+        :param loss: probability of a request going unanswered, between 0 and 1
+        :param seed: seed of the loss generator, for reproducible runs
+        """
+        self.latency = latency
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def lost(self):
+        """
+        Decide the fate of a request, sleeping the injected latency if it is answered
+        :return: True if the request should go unanswered
+        """
+        with self.lock:
+            lost = self.random.random() < self.loss
+        if not lost and self.latency:
+            time.sleep(self.latency)
+        return lost
+
+
+class FakeHTTPServer:
+    """
+    HTTP server answering every GET with 200 and a short body, or HTTPS when given a certificate
+    """
+    def __init__(self, host="127.0.0.1", port=0, impairment=None, certificate=None):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param impairment: Impairment applied to every request
+        :param certificate: tuple of (certificate file, key file) to serve HTTPS
+        """
+        impairment = impairment or Impairment()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if impairment.lost():
+                    self.close_connection = True
+                    return
+                body = b"ok\n"
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.scheme = "http"
+        if certificate:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*certificate)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            self.scheme = "https"
+        self.address = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, name=f"fake-{self.scheme}", daemon=True)
+
+    def url(self, host=None):
+        """
+        :param host: address to put in the url, defaults to the listening address
+        :return: url of the server
+        """
+        return f"{self.scheme}://{host or self.address[0]}:{self.address[1]}/"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DatagramServer:
+    """
+    Base of the UDP stand-ins: answers every datagram with the reply built by respond, unless it is lost
+    """
+    name = "udp"
+
+    def __init__(self, host="127.0.0.1", port=0, impairment=None):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param impairment: Impairment applied to every request
+        """
+        self.impairment = impairment or Impairment()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.serve, name=f"fake-{self.name}", daemon=True)
+
+    def serve(self):
+        while True:
+            try:
+                request, client = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            # Answer off the receive loop so that injected latency does not serialize requests
+            threading.Thread(target=self.answer, args=(request, client), daemon=True).start()
+
+    def answer(self, request, client):
+        if self.impairment.lost():
+            return
+        reply = self.respond(request)
+        if reply:
+            try:
+                self.sock.sendto(reply, client)
+            except OSError:
+                pass
+
+    def respond(self, request):
+        """
+        :param request: received datagram
+        :return: reply datagram, or None to stay silent
+        """
+        return None
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.sock.close()
+
+
+class UDPListener(DatagramServer):
+    """
+    Silent UDP port: receives datagrams and never answers, which check_udp_port reports as open
+    """
+    name = "udp"
+
+
+class FakeNTPServer(DatagramServer):
+    """
+    Stratum 1 NTP responder reporting the local clock
+    """
+    name = "ntp"
+
+    def respond(self, request):
+        if len(request) < 48:
+            return None
+        now = time.time() + NTP_EPOCH_OFFSET
+        timestamp = struct.pack("!II", int(now), int((now % 1) * 2 ** 32))
+        version = (request[0] >> 3) & 0x7
+        header = struct.pack("!BBbbII4s", (version << 3) | 4, 1, 6, -20, 0, 0, b"LOCL")
+        # Reference, originate (the client's transmit time), receive and transmit timestamps
+        return header + timestamp + request[40:48] + timestamp + timestamp
+
+
+class FakeDNSServer(DatagramServer):
+    """
+    Stub DNS server answering A and AAAA questions for any name with the loopback address,
+    and every other record type with an empty answer
+    """
+    name = "dns"
+
+    def respond(self, request):
+        if len(request) < 12:
+            return None
+        query_id, flags, questions = struct.unpack("!HHH", request[:6])
+
+        # Walk the labels of the question name to find its type
+        offset = 12
+        while offset < len(request) and request[offset]:
+            offset += request[offset] + 1
+        question_end = offset + 5
+        if questions != 1 or question_end > len(request):
+            return None
+        record_type = struct.unpack("!H", request[offset + 1:offset + 3])[0]
+
+        rdata = DNS_ANSWERS.get(record_type)
+        answer = b""
+        if rdata:
+            # Name as a pointer to the question, type, class IN, ttl 60, then the address
+            answer = struct.pack("!HHHIH", 0xC00C, record_type, 1, 60, len(rdata)) + rdata
+        reply_flags = 0x8180 | (flags & 0x0100)
+        return (struct.pack("!HHHHHH", query_id, reply_flags, 1, 1 if rdata else 0, 0, 0)
+                + request[12:question_end] + answer)
+
+
+class TCPListener:
+    """
+    TCP port accepting connections and closing them straight away. The kernel completes the handshake,
+    so injected latency and loss only apply to anything sent after the connection is accepted.
+    """
+    def __init__(self, host="0.0.0.0", port=0):
+        """
+        :param host: address to listen on, the default accepts on every loopback address, an IPv6 address listens
+                     over IPv6
+        :param port: port to listen on, 0 picks a free one
+        """
+        self.sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(1024)
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.serve, name="fake-tcp", daemon=True)
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            connection.close()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.sock.close()
+
+
+class EchoServer:
+    """
+    The project's echo_server.py run as a subprocess, listening on 127.0.0.1:12345 by default
+    """
+    address = ("127.0.0.1", 12345)
+
+    def __init__(self, mode="text", port=12345):
+        """
+        :param mode: echo path of the server, see echo_server.ECHO_MODES
+        :param port: port to listen on
+        """
+        self.mode = mode
+        self.address = ("127.0.0.1", port)
+        self.process = None
+
+    def start(self):
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "echo_server.py")
+        self.process = subprocess.Popen([sys.executable, script, "--mode", self.mode, "--port", str(self.address[1])],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Wait until it accepts connections
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(self.address, timeout=0.2) as probe:
+                    probe.sendall(b"Goodbye")
+                return self
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("echo_server.py did not start listening")
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def make_certificate(directory, host="127.0.0.1"):
+    """
+    Create a self-signed certificate for the HTTPS stand-in with the openssl command line tool
+    :param directory: directory to write cert.pem and key.pem to
+    :param host: address the certificate is valid for
+    :return: tuple of (certificate file, key file)
+    """
+    certificate, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-keyout", key, "-out", certificate, "-subj", f"/CN={host}",
+                    "-addext", f"subjectAltName=IP:{host},DNS:localhost"],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certificate, key
@@ -0,0 +1,325 @@
+import argparse
+import heapq
+import random
+import socket
+import struct
+import threading
+import time
+
+
+class Fault:
+    """
+    Conditions a proxy imposes on the traffic of one target
+    """
+    def __init__(self, delay=0.0, jitter=0.0, loss=0.0, bandwidth=0, reset=0.0, blackhole=False, refuse=False,
+                 seed=None):
+        """
+        :param delay: seconds added to every chunk or datagram, in each direction
+        :param jitter: up to this many extra seconds, drawn per chunk or datagram
+        :param loss: probability of losing a datagram, or for TCP of a chunk needing a retransmission
+        :param bandwidth: bytes per second in each direction, 0 for unlimited
+        :param reset: probability of a TCP connection being reset as soon as it is accepted
+        :param blackhole: drop everything: TCP connection attempts time out and datagrams vanish
+        :param refuse: act as a closed port: TCP connection attempts are reset during the handshake and
+        datagrams are answered with ICMP port unreachable
+        :param seed: seed for loss, jitter and resets, for reproducible runs
+        """
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.bandwidth = bandwidth
+        self.reset = reset
+        self.blackhole = blackhole
+        self.refuse = refuse
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def chance(self, probability):
+        """
+        :param probability: probability of the event
+        :return: True if the event happens this time
+        """
+        with self.lock:
+            return self.random.random() < probability
+
+    def latency(self):
+        """
+        Delay of the next chunk or datagram
+        :return: seconds
+        """
+        with self.lock:
+            return self.delay + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def __repr__(self):
+        settings = {name: value for name, value in vars(self).items() if name not in ('random', 'lock') and value}
+        return "Fault(" + ", ".join(f"{name}={value}" for name, value in settings.items()) + ")"
+
+
+# Extra delay of a lost TCP chunk, the minimum retransmission timeout of Linux
+TCP_RETRANSMIT_DELAY = 0.2
+
+
+class Pacer:
+    """
+    Schedules the chunks of one direction of a connection: every chunk is due its fault latency after it arrived,
+    never before the previous one (a stream cannot reorder), and no faster than the bandwidth allows
+    """
+    def __init__(self, fault):
+        self.fault = fault
+        self.last_due = 0.0
+
+    def due(self, arrived, size):
+        """
+        :param arrived: monotonic time the chunk arrived
+        :param size: bytes in the chunk
+        :return: monotonic time the chunk may be sent
+        """
+        due = arrived + self.fault.latency()
+        if self.fault.loss and self.fault.chance(self.fault.loss):
+            due += TCP_RETRANSMIT_DELAY
+        due = max(due, self.last_due)
+        if self.fault.bandwidth:
+            due = max(due, self.last_due) + size / self.fault.bandwidth
+        self.last_due = due
+        return due
+
+
+class TCPFaultProxy:
+    """
+    Forwards TCP connections from a local port to a target, imposing a Fault. Blackholing fills the listen queue
+    and never accepts, so the kernel drops further connection attempts and they time out like an unreachable host.
+    Refusing closes the listener, so the kernel resets connection attempts like for a closed port.
+    """
+    def __init__(self, target, fault=None, listen=("127.0.0.1", 0)):
+        """
+        :param target: (host, port) to forward to
+        :param fault: Fault to impose, defaults to none
+        :param listen: (host, port) to listen on, port 0 picks a free one
+        """
+        self.target = target
+        self.fault = fault or Fault()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(listen)
+        self.sock.listen(0 if self.fault.blackhole else 128)
+        self.address = self.sock.getsockname()
+        self.filler = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.serve, name="fault-proxy-tcp", daemon=True)
+
+    def start(self):
+        if self.fault.refuse:
+            # Nothing listens on the port any more
+            self.sock.close()
+        elif self.fault.blackhole:
+            # One queued connection fills a zero backlog, after which the kernel drops new SYNs
+            self.filler = socket.create_connection(self.address)
+        else:
+            self.thread.start()
+        return self
+
+    def serve(self):
+        while not self.stopped.is_set():
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def handle(self, client):
+        """
+        Reset or forward one connection
+        :param client: accepted client socket
+        :return: None
+        """
+        if self.fault.chance(self.fault.reset):
+            # Closing with a zero linger time sends a RST instead of a FIN
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            client.close()
+            return
+        try:
+            upstream = socket.create_connection(self.target, timeout=5)
+        except OSError:
+            client.close()
+            return
+        upstream.settimeout(None)
+        for source, destination in ((client, upstream), (upstream, client)):
+            threading.Thread(target=self.pump, args=(source, destination), daemon=True).start()
+
+    def pump(self, source, destination):
+        """
+        Copy one direction of a connection, delaying and pacing every chunk
+        :param source: socket to read from
+        :param destination: socket to write to
+        :return: None
+        """
+        pacer = Pacer(self.fault)
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                wait = pacer.due(time.monotonic(), len(data)) - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                destination.sendall(data)
+            destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            # Either side went away, take the other one down too
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        finally:
+            source.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.sock.close()
+        if self.filler:
+            self.filler.close()
+
+
+class UDPFaultProxy:
+    """
+    Forwards datagrams from a local port to a target and the replies back, imposing a Fault. Every client
+    address gets its own upstream socket, so replies find their way back like through a NAT. Refusing closes
+    the port, so the kernel answers datagrams with ICMP port unreachable.
+    """
+    def __init__(self, target, fault=None, listen=("127.0.0.1", 0)):
+        """
+        :param target: (host, port) to forward to
+        :param fault: Fault to impose, defaults to none
+        :param listen: (host, port) to listen on, port 0 picks a free one
+        """
+        self.target = target
+        self.fault = fault or Fault()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(listen)
+        self.address = self.sock.getsockname()
+        self.upstreams = {}
+        self.queue = []
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.last_due = {}
+        self.threads = [threading.Thread(target=self.serve, name="fault-proxy-udp", daemon=True),
+                        threading.Thread(target=self.deliver, name="fault-proxy-udp-send", daemon=True)]
+
+    def start(self):
+        if self.fault.refuse:
+            # Nothing is bound to the port any more
+            self.sock.close()
+            return self
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def schedule(self, sock, data, destination):
+        """
+        Queue a datagram for sending once its fault latency passed, unless it is lost
+        :param sock: socket to send from
+        :param data: datagram
+        :param destination: address to send to
+        :return: None
+        """
+        if self.fault.blackhole or self.fault.chance(self.fault.loss):
+            return
+        due = time.monotonic() + self.fault.latency()
+        if self.fault.bandwidth:
+            due = max(due, self.last_due.get(sock, 0.0)) + len(data) / self.fault.bandwidth
+            self.last_due[sock] = due
+        with self.condition:
+            heapq.heappush(self.queue, (due, id(data), sock, data, destination))
+            self.condition.notify()
+
+    def deliver(self):
+        while not self.stopped.is_set():
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else 0.5)
+                    if self.stopped.is_set():
+                        return
+                due, _, sock, data, destination = heapq.heappop(self.queue)
+            try:
+                sock.sendto(data, destination)
+            except OSError:
+                pass
+
+    def serve(self):
+        while not self.stopped.is_set():
+            try:
+                data, client = self.sock.recvfrom(65536)
+            except OSError:
+                return
+            upstream = self.upstreams.get(client)
+            if upstream is None:
+                upstream = self.upstreams[client] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                upstream.connect(self.target)
+                threading.Thread(target=self.relay, args=(upstream, client), daemon=True).start()
+            self.schedule(upstream, data, self.target)
+
+    def relay(self, upstream, client):
+        """
+        Pass the replies of the target back to a client
+        :param upstream: socket connected to the target for this client
+        :param client: address of the client
+        :return: None
+        """
+        while not self.stopped.is_set():
+            try:
+                data = upstream.recv(65536)
+            except ConnectionRefusedError:
+                # The target port is closed, there is no way to pass the ICMP error on unprivileged
+                continue
+            except OSError:
+                return
+            self.schedule(self.sock, data, client)
+
+    def stop(self):
+        self.stopped.set()
+        self.sock.close()
+        for upstream in self.upstreams.values():
+            upstream.close()
+        with self.condition:
+            self.condition.notify()
+
+
+def parse_address(text):
+    """
+    :param text: host:port
+    :return: (host, port)
+    """
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forward a local port to a target while injecting network faults")
+    parser.add_argument("target", type=parse_address, help="Target to forward to (host:port)")
+    parser.add_argument("--listen", type=parse_address, default=("127.0.0.1", 0),
+                        help="Address to listen on (host:port, default a free loopback port)")
+    parser.add_argument("--udp", action="store_true", help="Forward datagrams instead of TCP connections")
+    parser.add_argument("--delay-ms", type=float, default=0, help="Delay added in each direction")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Up to this much extra delay per chunk")
+    parser.add_argument("--loss", type=float, default=0, help="Share of datagrams lost, or TCP chunks retransmitted")
+    parser.add_argument("--bandwidth", type=int, default=0, help="Bytes per second in each direction (0 unlimited)")
+    parser.add_argument("--reset", type=float, default=0, help="Share of TCP connections reset when accepted")
+    parser.add_argument("--blackhole", action="store_true", help="Drop everything")
+    parser.add_argument("--refuse", action="store_true",
+                        help="Act as a closed port: reset connection attempts, answer datagrams with port unreachable")
+    args = parser.parse_args()
+
+    fault = Fault(args.delay_ms / 1000, args.jitter_ms / 1000, args.loss, args.bandwidth, args.reset, args.blackhole,
+                  args.refuse)
+    proxy = (UDPFaultProxy if args.udp else TCPFaultProxy)(args.target, fault, args.listen).start()
+    print(f"Forwarding {'udp' if args.udp else 'tcp'} {proxy.address[0]}:{proxy.address[1]} to "
+          f"{args.target[0]}:{args.target[1]} with {fault}, CTRL + C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        proxy.stop()
+
+
+if __name__ == '__main__':
+    main()
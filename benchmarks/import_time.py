@@ -0,0 +1,64 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Run from the project root so the flat modules can be imported
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules loaded on startup by the different entry points
+MODULES = ['network_tests', 'service_checks', 'netcam', 'network_monitor']
+
+# Protocol libraries that should only be loaded on first use
+PROTOCOL_LIBRARIES = ['requests', 'dns.resolver', 'ntplib', 'lorem', 'prompt_toolkit']
+
+
+def import_time(module):
+    """
+    Measure the cold import time of a module in a fresh interpreter with python -X importtime
+    :param module: name of the module to import
+    :return: tuple of (cumulative import time in ms, list of protocol libraries that were loaded)
+    """
+    code = f"import sys, {module}; print(','.join(m for m in {PROTOCOL_LIBRARIES!r} if m in sys.modules))"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                               cwd=PROJECT_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    cumulative_us = 0
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:") and line.rstrip().endswith(f"| {module}"):
+            cumulative_us = int(line.split("|")[1])
+
+    loaded = [name for name in completed.stdout.strip().split(",") if name]
+    return cumulative_us / 1000, loaded
+
+
+def main():
+    """
+    Print the median cold import time of every entry point module
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Measure cold import time of NetCam modules")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("modules", nargs="*", default=MODULES, help="Modules to measure")
+    args = parser.parse_args()
+
+    print(f"{'Module':<18} {'Median (ms)':>12}   Protocol libraries loaded")
+    for module in args.modules:
+        try:
+            samples = []
+            for _ in range(args.runs):
+                elapsed, loaded = import_time(module)
+                samples.append(elapsed)
+        except RuntimeError as e:
+            print(f"{module:<18} {'error':>12}   {e}")
+            continue
+
+        median = sorted(samples)[len(samples) // 2]
+        print(f"{module:<18} {median:>12.2f}   {', '.join(loaded) if loaded else '-'}")
+
+
+if __name__ == '__main__':
+    main()
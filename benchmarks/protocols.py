@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Run from the project root so the flat modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import network_tests
+from dashboard import DashboardState
+from monitor_engine import MonitorEngine
+from fakes import (EchoServer, FakeDNSServer, FakeHTTPServer, FakeNTPServer, Impairment, TCPListener, UDPListener,
+                   make_certificate)
+
+# Address of the DNS and NTP stand-ins, which have to listen on the standard ports the probes use
+SERVICE_HOST = "127.0.0.2"
+
+
+class CountingSink:
+    """
+    Counts results and sums their latency instead of writing them anywhere
+    """
+    def __init__(self):
+        self.count = 0
+        self.latency_ms = 0.0
+        self.lock = threading.Lock()
+
+    def emit(self, result):
+        """
+        Count a single check result
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        with self.lock:
+            self.count += 1
+            self.latency_ms += result['latency_ms']
+
+    def reopen(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def rss_kb():
+    """
+    Resident memory of this process
+    :return: kilobytes, or None where /proc is not available
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def start_fakes(directory, impairment):
+    """
+    Start a stand-in server for every protocol. Stand-ins that cannot start, e.g. NTP and DNS without
+    permission to bind their standard ports, are left out.
+    :param directory: directory for the HTTPS certificate
+    :param impairment: Impairment applied by the HTTP, HTTPS, DNS and NTP stand-ins
+    :return: dictionary of name to started stand-in, and dictionary of name to the error that kept one from starting
+    """
+    certificate = make_certificate(directory)
+    # requests and the TLS probe verify against this bundle, so HTTPS probes succeed against the self-signed stand-in
+    os.environ['REQUESTS_CA_BUNDLE'] = certificate[0]
+    os.environ['SSL_CERT_FILE'] = certificate[0]
+
+    factories = {
+        'http': lambda: FakeHTTPServer("0.0.0.0", 0, impairment),
+        'https': lambda: FakeHTTPServer("127.0.0.1", 0, impairment, certificate),
+        'dns': lambda: FakeDNSServer(SERVICE_HOST, 53, impairment),
+        'ntp': lambda: FakeNTPServer(SERVICE_HOST, 123, impairment),
+        'tcp': lambda: TCPListener(),
+        'tcp6': lambda: TCPListener("::1"),
+        'udp': lambda: UDPListener(),
+        'echo': lambda: EchoServer()
+    }
+    fakes, errors = {}, {}
+    for name, factory in factories.items():
+        try:
+            fakes[name] = factory().start()
+        except (OSError, RuntimeError) as e:
+            errors[name] = str(e)
+    return fakes, errors
+
+
+def probe_calls(fakes):
+    """
+    Call of every probe in network_tests against its stand-in
+    :param fakes: started stand-ins
+    :return: dictionary of probe name to a function running one probe, returning (ok, ...)
+    """
+    calls = {
+        'ping': lambda: (network_tests.ping("127.0.0.1", 64, 1)[1] is not None,),
+        'ping_ipv6': lambda: (network_tests.ping("::1", 64, 1)[1] is not None,),
+        'traceroute': lambda: (bool(network_tests.traceroute_hops("127.0.0.1", 3, 1)),)
+    }
+    if 'http' in fakes:
+        calls['check_server_http'] = lambda: network_tests.check_server_http(fakes['http'].url("127.0.0.1"))
+    if 'https' in fakes:
+        calls['check_server_https'] = lambda: network_tests.check_server_https(fakes['https'].url(), 5)
+        # The throwaway certificate is only valid for a day, so only fail on expired certificates
+        calls['check_tls_full'] = lambda: network_tests.check_tls("127.0.0.1", fakes['https'].address[1], 5, 0, False)
+        calls['check_tls_resumed'] = lambda: network_tests.check_tls("127.0.0.1", fakes['https'].address[1], 5, 0)
+    if 'ntp' in fakes:
+        calls['check_ntp_server'] = lambda: network_tests.check_ntp_server(SERVICE_HOST)
+    if 'dns' in fakes:
+        calls['check_dns_server_status'] = lambda: network_tests.check_dns_server_status(SERVICE_HOST, "bench.test", "A")
+    if 'tcp' in fakes:
+        calls['check_tcp_port'] = lambda: network_tests.check_tcp_port("127.0.0.1", fakes['tcp'].address[1])
+    if 'tcp6' in fakes:
+        calls['check_tcp_port_ipv6'] = lambda: network_tests.check_tcp_port("::1", fakes['tcp6'].address[1])
+    if 'udp' in fakes:
+        calls['check_udp_port'] = lambda: network_tests.check_udp_port("127.0.0.1", fakes['udp'].address[1], 0.2)
+    if 'echo' in fakes:
+        calls['local_tcp_echo'] = lambda: network_tests.local_tcp_echo(*EchoServer.address, verbose=False)
+    return calls
+
+
+def measure_probe(call, probes):
+    """
+    Run a probe repeatedly, one at a time
+    :param call: function running one probe
+    :param probes: number of timed probes
+    :return: dictionary with latency percentiles, probes per second, success share and allocation peak
+    """
+    try:
+        call()
+    except ImportError as e:
+        return {'skipped': f"missing dependency: {e.name}"}
+    except PermissionError as e:
+        return {'skipped': f"not permitted: {e}"}
+
+    timings, succeeded = [], 0
+    for _ in range(probes):
+        start = time.perf_counter()
+        result = call()
+        timings.append(time.perf_counter() - start)
+        succeeded += bool(result[0])
+
+    # Allocation peak of a single probe, measured separately since tracing slows the probe down
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'probes': probes,
+        'success': round(succeeded / probes, 3),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95)] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'probes_per_second': round(probes / sum(timings), 1),
+        'alloc_peak_kb': round(peak / 1024, 1)
+    }
+
+
+def target_address(index):
+    """
+    Distinct loopback address of a target, so that equal probes of different targets are not coalesced
+    :param index: number of the target
+    :return: ip address
+    """
+    return f"127.1.{index // 250}.{index % 250 + 1}"
+
+
+def measure_monitor(fakes, targets, duration, interval):
+    """
+    Run the monitor-all engine and dashboard state against a number of targets
+    :param fakes: started stand-ins
+    :param targets: number of targets
+    :param duration: seconds to run
+    :param interval: check interval of every service
+    :return: dictionary with check throughput, latency and memory
+    """
+    server_dict = {}
+    for index in range(targets):
+        address = target_address(index)
+        services = {'TCP': {'port': fakes['tcp'].address[1], 'interval': interval}}
+        if 'http' in fakes:
+            services['HTTP'] = {'url': fakes['http'].url(address), 'interval': interval}
+        server_dict[address] = services
+
+    counter = CountingSink()
+    memory_before = rss_kb()
+    engine = MonitorEngine(server_dict, [DashboardState(), counter])
+    engine.start()
+    time.sleep(duration)
+    checks = engine.check_count
+    threads = threading.active_count()
+    memory_during = rss_kb()
+    engine.stop(timeout=10)
+
+    return {
+        'targets': targets,
+        'checks': checks,
+        'results': counter.count,
+        'checks_per_second': round(counter.count / duration, 1),
+        'expected_per_second': round(checks / interval, 1),
+        'mean_latency_ms': round(counter.latency_ms / counter.count, 3) if counter.count else None,
+        'threads': threads,
+        'rss_growth_kb': memory_during - memory_before if memory_before is not None else None
+    }
+
+
+def compare(report, baseline):
+    """
+    Print the change of the main metrics against an earlier report
+    :param report: report of this run
+    :param baseline: report of an earlier run
+    :return: None
+    """
+    print("\nChange against baseline:")
+    for name, current in report['probes'].items():
+        previous = baseline.get('probes', {}).get(name)
+        if previous and 'p50_ms' in previous and 'p50_ms' in current:
+            print(f"  {name:<24} p50 {previous['p50_ms']:>9.3f} -> {current['p50_ms']:>9.3f} ms "
+                  f"({(current['p50_ms'] / previous['p50_ms'] - 1) * 100 if previous['p50_ms'] else 0:+.1f}%)")
+    for targets, current in report['monitor'].items():
+        previous = baseline.get('monitor', {}).get(targets)
+        if previous and previous['checks_per_second']:
+            print(f"  monitor {targets:>5} targets   {previous['checks_per_second']:>9.1f} -> "
+                  f"{current['checks_per_second']:>9.1f} checks/s "
+                  f"({(current['checks_per_second'] / previous['checks_per_second'] - 1) * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every probe and monitor-all against local stand-in servers")
+    parser.add_argument("--probes", type=int, default=50, help="Timed probes per protocol (default 50)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency injected by the stand-ins (default 0)")
+    parser.add_argument("--loss", type=float, default=0, help="Share of requests the stand-ins ignore (default 0)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the injected loss (default 1)")
+    parser.add_argument("--targets", default="10,100,1000", help="Target counts for monitor-all (default 10,100,1000)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run monitor-all per target count")
+    parser.add_argument("--interval", type=float, default=1, help="Check interval for monitor-all (default 1)")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    parser.add_argument("--baseline", help="Earlier json results to compare against")
+    args = parser.parse_args()
+
+    impairment = Impairment(args.latency_ms / 1000, args.loss, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        fakes, errors = start_fakes(directory, impairment)
+        for name, error in errors.items():
+            print(f"{name} stand-in not started: {error}", file=sys.stderr)
+
+        report = {
+            'config': {'probes': args.probes, 'latency_ms': args.latency_ms, 'loss': args.loss, 'seed': args.seed,
+                       'duration': args.duration, 'interval': args.interval, 'python': sys.version.split()[0]},
+            'probes': {},
+            'monitor': {}
+        }
+        try:
+            for name, call in probe_calls(fakes).items():
+                result = report['probes'][name] = measure_probe(call, args.probes)
+                if 'skipped' in result:
+                    print(f"{name:<24} skipped, {result['skipped']}")
+                else:
+                    print(f"{name:<24} p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  "
+                          f"{result['probes_per_second']:>8.1f} probes/s  success {result['success']:.0%}  "
+                          f"alloc {result['alloc_peak_kb']:.1f} KiB")
+
+            if 'tcp' in fakes:
+                for targets in (int(count) for count in args.targets.split(",") if count):
+                    result = report['monitor'][str(targets)] = measure_monitor(fakes, targets, args.duration,
+                                                                               args.interval)
+                    print(f"monitor-all {targets:>5} targets: {result['checks_per_second']:>8.1f} checks/s "
+                          f"(expected {result['expected_per_second']}), mean latency {result['mean_latency_ms']} ms, "
+                          f"{result['threads']} threads, rss +{result['rss_growth_kb']} KiB")
+        finally:
+            for fake in fakes.values():
+                fake.stop()
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            compare(report, json.load(file))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Run from the project root so the flat modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharding import Supervisor
+
+
+class CountingSink:
+    """
+    Counts results instead of writing them anywhere
+    """
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def emit(self, result):
+        """
+        Count a single check result
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        with self.lock:
+            self.count += 1
+
+    def reopen(self):
+        """
+        Nothing to reopen
+        :return: None
+        """
+        pass
+
+    def close(self):
+        """
+        Nothing to close
+        :return: None
+        """
+        pass
+
+
+def start_listener(port):
+    """
+    Local stand-in target: accept TCP connections on every loopback address and close them straight away
+    :param port: port to listen on
+    :return: listening socket
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("0.0.0.0", port))
+    listener.listen(1024)
+
+    def accept_loop():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            connection.close()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener
+
+
+def build_server_dict(targets, port, interval):
+    """
+    One TCP check per target, each on its own loopback address so they are distinct servers
+    :param targets: number of targets
+    :param port: port of the stand-in listener
+    :param interval: seconds between checks of each target
+    :return: dictionary with server and service information
+    """
+    return {f"127.0.{number // 250}.{number % 250 + 1}": {"TCP": {"port": port, "interval": interval}}
+            for number in range(targets)}
+
+
+def measure(workers, server_dict, duration):
+    """
+    Run a supervisor with the given number of workers and measure its throughput
+    :param workers: worker processes
+    :param server_dict: dictionary with server and service information
+    :param duration: seconds to measure for after warm up
+    :return: dictionary of measurements
+    """
+    sink = CountingSink()
+    supervisor = Supervisor(server_dict, [sink], workers)
+    supervisor.start()
+
+    # Warm up so process start up is not measured
+    time.sleep(1)
+    start_count, start_time, start_cpu = sink.count, time.perf_counter(), time.process_time()
+    time.sleep(duration)
+    end_count, end_time, end_cpu = sink.count, time.perf_counter(), time.process_time()
+    supervisor.stop(timeout=5)
+
+    # Only the parent's CPU is measured: the cost of collecting results from the workers
+    elapsed = end_time - start_time
+    return {
+        'workers': workers,
+        'checks_per_sec': round((end_count - start_count) / elapsed, 1),
+        'parent_cpu_percent': round((end_cpu - start_cpu) / elapsed * 100, 1)
+    }
+
+
+def main():
+    """
+    Measure monitoring throughput from 1 to N worker processes against a local stand-in target
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Scaling benchmark of sharded monitoring")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count(), help="Largest worker count to measure")
+    parser.add_argument("--targets", type=int, default=200, help="Number of TCP targets")
+    parser.add_argument("--interval", type=float, default=0, help="Check interval, 0 checks as fast as possible")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds to measure each worker count")
+    parser.add_argument("--port", type=int, default=18080, help="Port of the stand-in listener")
+    parser.add_argument("--output", help="Write results as json to this file")
+    args = parser.parse_args()
+
+    listener = start_listener(args.port)
+    server_dict = build_server_dict(args.targets, args.port, args.interval)
+
+    results = []
+    print(f"{'Workers':>7} {'Checks/sec':>12} {'Parent CPU %':>13}")
+    workers = 1
+    while workers <= args.max_workers:
+        result = measure(workers, server_dict, args.duration)
+        results.append(result)
+        print(f"{result['workers']:>7} {result['checks_per_sec']:>12} {result['parent_cpu_percent']:>13}")
+        workers *= 2
+    listener.close()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({'targets': args.targets, 'interval': args.interval, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
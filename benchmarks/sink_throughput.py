@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Run from the project root so the flat modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sinks import AsyncFileSink, FileSink
+
+
+def make_result(index):
+    """
+    Synthetic result record shaped like the output of probe_service
+    :param index: number of the record
+    :return: result record
+    """
+    return {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'server': f"10.0.{index % 256}.{index % 250 + 1}",
+        'service': "TCP",
+        'status': index % 10 != 0,
+        'latency_ms': round(index % 97 * 0.37, 2),
+        'detail': f"Port 443 on 10.0.{index % 256}.{index % 250 + 1} is open."
+    }
+
+
+def measure(sink, threads, records):
+    """
+    Emit records from several threads, like checks finishing at the same time
+    :param sink: sink under test
+    :param threads: number of emitting threads
+    :param records: records emitted per thread
+    :return: dictionary with emit latency percentiles and throughput
+    """
+    results = [make_result(index) for index in range(records)]
+    latencies = [[] for _ in range(threads)]
+
+    def emitter(timings):
+        for result in results:
+            start = time.perf_counter()
+            sink.emit(result)
+            timings.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=emitter, args=(timings,)) for timings in latencies]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    emitted = time.perf_counter() - start
+
+    # Everything is on disk once close returns
+    sink.close()
+    written = time.perf_counter() - start
+
+    timings = sorted(timing for thread_timings in latencies for timing in thread_timings)
+    total = threads * records
+    return {
+        'records': total,
+        'emit_p50_us': round(timings[len(timings) // 2] * 1e6, 2),
+        'emit_p99_us': round(timings[int(len(timings) * 0.99)] * 1e6, 2),
+        'emit_max_us': round(timings[-1] * 1e6, 2),
+        'emit_seconds': round(emitted, 3),
+        'written_seconds': round(written, 3),
+        'records_per_second': round(total / written),
+        'dropped': getattr(sink, 'dropped', 0)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the write throughput and emit latency of the file sinks")
+    parser.add_argument("--threads", type=int, default=8, help="Emitting threads, like concurrent checks (default 8)")
+    parser.add_argument("--records", type=int, default=20000, help="Records emitted per thread (default 20000)")
+    parser.add_argument("--format", choices=["text", "jsonl"], default="jsonl", help="File format (default jsonl)")
+    parser.add_argument("--max-mb", type=float, default=0, help="Rotate async files at this size (default off)")
+    parser.add_argument("--gzip", action="store_true", help="Compress rotated async files")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        sinks = {
+            'file': lambda: FileSink(os.path.join(directory, "file.log"), args.format),
+            'async': lambda: AsyncFileSink(os.path.join(directory, "async.log"), args.format,
+                                           max_bytes=int(args.max_mb * 1024 * 1024), compress=args.gzip,
+                                           queue_size=args.threads * args.records)
+        }
+        for name, create in sinks.items():
+            report[name] = measure(create(), args.threads, args.records)
+            print(f"{name:>6}: {report[name]['records_per_second']:>9} records/s, emit p50 "
+                  f"{report[name]['emit_p50_us']:.1f} us, p99 {report[name]['emit_p99_us']:.1f} us, "
+                  f"max {report[name]['emit_max_us']:.1f} us, dropped {report[name]['dropped']}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
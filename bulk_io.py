@@ -0,0 +1,223 @@
+import csv
+import json
+import os
+from config_schema import SERVICE_SCHEMAS, get_services, parse_tags, validate_depends_on, validate_service, validate_tags
+
+# The NTP server parameter would clash with the server column, so csv renames it
+CSV_ALIASES = {'server': 'ntp_server'}
+
+# Every parameter name of every service, used as the csv columns
+CSV_FIELDS = ['server', 'service', 'tags', 'depends_on'] + sorted({CSV_ALIASES.get(name, name)
+                                                           for schema in SERVICE_SCHEMAS.values() for name in schema})
+
+FORMATS = ['csv', 'jsonl', 'yaml']
+
+
+class MergeReport:
+    """
+    Counts of what a bulk import did to the config, plus the rows that were rejected
+    """
+    def __init__(self, max_errors=50):
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def reject(self, location, messages):
+        """
+        Record a rejected row
+        :param location: where the row came from, e.g. "line 12"
+        :param messages: validation errors of the row
+        :return: None
+        """
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(f"{location}: {'; '.join(messages)}")
+
+    def summary(self):
+        """
+        Human readable summary of the import
+        :return: str
+        """
+        lines = [f"Added: {self.added}, Updated: {self.updated}, Unchanged: {self.unchanged}, Rejected: {self.rejected}"]
+        lines += self.errors
+        if self.rejected > len(self.errors):
+            lines.append(f"... and {self.rejected - len(self.errors)} more rejected rows")
+        return "\n".join(lines)
+
+
+def detect_format(path, fmt=None):
+    """
+    Pick the file format from an explicit choice or the file extension
+    :param path: path of the file
+    :param fmt: explicit format, or None to use the extension
+    :return: one of FORMATS
+    """
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('yml', 'yaml'):
+        return 'yaml'
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise ValueError(f"Cannot tell the format of {path}, use one of: {', '.join(FORMATS)}")
+
+
+def import_yaml():
+    """
+    Import PyYAML, which is optional since only yaml import/export needs it
+    :return: yaml module
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("YAML support requires PyYAML (pip install pyyaml)")
+    return yaml
+
+
+def read_records(file, fmt):
+    """
+    Lazily read one record per service from an open file, so large files never need to fit in memory.
+    Records are dicts with a server, a service, that service's params and optionally the server's tags and
+    the servers it depends on. csv rows hold the params as columns, tags as "key=value,key=value" and
+    dependencies as "parent;parent", jsonl lines and yaml documents hold them as nested dicts and lists.
+    :param file: open text file
+    :param fmt: one of FORMATS
+    :return: generator of (location, record or None, error message or None)
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        columns = {column: name for name, column in CSV_ALIASES.items()}
+        for row in reader:
+            # Empty cells mean "use the default"
+            params = {columns.get(column, column): value for column, value in row.items()
+                      if column not in (None, 'server', 'service', 'tags', 'depends_on') and value not in (None, '')}
+            record = {'server': row.get('server'), 'service': row.get('service'), 'params': params}
+            if row.get('depends_on'):
+                record['depends_on'] = [parent.strip() for parent in row['depends_on'].split(';') if parent.strip()]
+            try:
+                if row.get('tags'):
+                    record['tags'] = parse_tags(row['tags'])
+            except ValueError as e:
+                yield f"line {reader.line_num}", None, str(e)
+                continue
+            yield f"line {reader.line_num}", record, None
+
+    elif fmt == 'jsonl':
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield f"line {number}", json.loads(line), None
+            except ValueError as e:
+                yield f"line {number}", None, f"invalid json: {e}"
+
+    elif fmt == 'yaml':
+        yaml = import_yaml()
+        for number, document in enumerate(yaml.safe_load_all(file), 1):
+            # A document may hold a single record or a list of them
+            for record in document if isinstance(document, list) else [document]:
+                if record is not None:
+                    yield f"document {number}", record, None
+
+    else:
+        raise ValueError(f"Unknown format {fmt}")
+
+
+def import_servers(path, server_dict, fmt=None, max_errors=50):
+    """
+    Validate and merge servers from a csv, jsonl or yaml file into the server dict
+    :param path: file to import
+    :param server_dict: dictionary with server and service information, updated in place
+    :param fmt: file format, or None to use the extension
+    :param max_errors: number of rejected rows to list in the report
+    :return: MergeReport
+    """
+    fmt = detect_format(path, fmt)
+    report = MergeReport(max_errors)
+
+    with open(path, "r", newline="") as file:
+        for location, record, error in read_records(file, fmt):
+            if error:
+                report.reject(location, [error])
+                continue
+            if not isinstance(record, dict) or not record.get('server') or not record.get('service') \
+                    or not isinstance(record.get('params', {}), dict):
+                report.reject(location, ["record needs a server, a service and a params dict"])
+                continue
+
+            server = str(record['server'])
+            service = str(record['service']).upper()
+            params, errors = validate_service(server, service, record.get('params', {}), coerce=(fmt == 'csv'))
+            if 'tags' in record:
+                errors += validate_tags(record['tags'])
+            if 'depends_on' in record:
+                errors += validate_depends_on(server, record['depends_on'])
+            if errors:
+                report.reject(location, errors)
+                continue
+
+            # Merge into the config
+            services = server_dict.setdefault(server, {})
+            metadata_changed = any(key in record and services.get(key) != record[key] for key in ('tags', 'depends_on'))
+            if service not in services:
+                report.added += 1
+            elif services[service] != params or metadata_changed:
+                report.updated += 1
+            else:
+                report.unchanged += 1
+            services[service] = params
+            for key in ('tags', 'depends_on'):
+                if key in record:
+                    services[key] = record[key]
+
+    return report
+
+
+def export_servers(server_dict, file, fmt):
+    """
+    Write every service of every server to an open file, one record per service
+    :param server_dict: dictionary with server and service information
+    :param file: open text file
+    :param fmt: one of FORMATS
+    :return: number of records written
+    """
+    def records():
+        # One record per service, carrying the server's tags and dependencies if it has any
+        for server in server_dict:
+            metadata = {key: server_dict[server][key] for key in ('tags', 'depends_on') if server_dict[server].get(key)}
+            for service, params in get_services(server_dict[server]).items():
+                yield {'server': server, 'service': service, 'params': params, **metadata}
+
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in records():
+            row = {'server': record['server'], 'service': record['service'],
+                   'tags': ','.join(f"{key}={value}" for key, value in record.get('tags', {}).items()),
+                   'depends_on': ';'.join(record.get('depends_on', []))}
+            for name, value in record['params'].items():
+                row[CSV_ALIASES.get(name, name)] = ';'.join(value) if isinstance(value, list) else value
+            writer.writerow(row)
+            count += 1
+
+    elif fmt == 'jsonl':
+        for record in records():
+            file.write(json.dumps(record) + "\n")
+            count += 1
+
+    elif fmt == 'yaml':
+        yaml = import_yaml()
+        for record in records():
+            file.write("---\n" + yaml.safe_dump(record, sort_keys=False))
+            count += 1
+
+    else:
+        raise ValueError(f"Unknown format {fmt}")
+
+    return count
@@ -0,0 +1,176 @@
+import copy
+import threading
+import time
+from urllib.parse import urlsplit
+from service_checks import probe_service
+
+# Ports a url uses when it does not name one
+DEFAULT_URL_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """
+    Normalize a url so that spellings of the same address compare equal
+    :param url: url to normalize
+    :return: normalized url
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = f":{parts.port}" if parts.port and parts.port != DEFAULT_URL_PORTS.get(scheme) else ""
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{scheme}://{host}{port}{parts.path or '/'}{query}"
+
+
+def probe_key(server, service, params):
+    """
+    Key of the probe a check runs: two checks with the same key send the same packets and get the same answer,
+    e.g. DNS entries of different servers querying the same dns_server
+    :param server: server the service belongs to
+    :param service: protocol of the service
+    :param params: parameters of the service
+    :return: hashable key
+    """
+    if service == "DNS":
+        record_types = tuple(sorted(record.upper() for record in params['record_types']))
+        return service, params['dns_server'].lower(), params['query'].lower().rstrip('.'), record_types
+    if service == "HTTP":
+        return service, normalize_url(params['url'])
+    if service == "HTTPS":
+        return service, normalize_url(params['url']), params['timeout']
+    if service == "TLS":
+        return service, server.lower(), params['port'], params['timeout'], params['expiry_days'], params['resume']
+    if service == "ICMP":
+        return (service, server.lower(), params['ttl'], params['timeout'], params['sequence_number'],
+                params['max_hops'], params['pings_per_hop'])
+    if service == "UDP":
+        return service, server.lower(), params['port'], params['timeout']
+    if service in ("TCP", "LOCAL TCP"):
+        return service, server.lower(), params['port']
+    return service, server.lower()
+
+
+class ProbeCoalescer:
+    """
+    Runs equivalent probes once and shares the result. A check reuses the result of an equivalent probe
+    that finished since its own previous result (within one interval for its first result), and a check
+    whose probe is already running waits for it rather than sending a second one. Counts how many probes
+    were saved.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.running = {}
+        self.last_seen = {}
+        self.subscribers = {}
+        self.keys = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def probe(self, server, service, params):
+        """
+        Get a result for a check, probing only if no equivalent result is fresh enough
+        :param server: server the service belongs to
+        :param service: protocol of the service
+        :param params: parameters of the service
+        :return: result record for this check
+        """
+        key = probe_key(server, service, params)
+        check = (server, service)
+        with self.lock:
+            # A retuned check stops sharing the results of its previous probe
+            if self.keys.get(check, key) != key:
+                self.unsubscribe(check)
+            self.keys[check] = key
+            self.subscribers.setdefault(key, set()).add(check)
+            now = time.monotonic()
+            since = self.last_seen.get(check, now - params['interval'])
+            latest = self.latest.get(key)
+            if latest and latest[0] > since:
+                return self.share(check, latest[1], now)
+
+            # Single flight: the first caller probes, the others wait for its result
+            done = self.running.get(key)
+            leader = done is None
+            if leader:
+                done = self.running[key] = threading.Event()
+
+        if not leader:
+            done.wait()
+            with self.lock:
+                latest = self.latest.get(key)
+                if latest and latest[0] > since:
+                    return self.share(check, latest[1], time.monotonic())
+            # The leader failed, probe alone
+            return probe_service(server, service, params)
+
+        result = None
+        try:
+            result = probe_service(server, service, params)
+        finally:
+            with self.lock:
+                if result is not None:
+                    now = time.monotonic()
+                    # Keep a copy, the caller may add fields such as suppressed_by to the result it gets, or
+                    # change nested ones such as hops
+                    self.latest[key] = now, copy.deepcopy(result)
+                    self.last_seen[check] = now
+                    self.executed += 1
+                del self.running[key]
+            done.set()
+        return result
+
+    def share(self, check, result, now):
+        """
+        Hand a result probed for another check to this one. Caller must hold the lock.
+        :param check: tuple of (server, service) receiving the result
+        :param result: result record of the equivalent probe
+        :param now: current monotonic time
+        :return: copy of the result for this check
+        """
+        self.last_seen[check] = now
+        self.coalesced += 1
+        return dict(copy.deepcopy(result), server=check[0], service=check[1])
+
+    def forget(self, server, service):
+        """
+        Stop sharing results with a check that was removed
+        :param server: server of the check
+        :param service: protocol of the check
+        :return: None
+        """
+        with self.lock:
+            self.last_seen.pop((server, service), None)
+            self.unsubscribe((server, service))
+            self.keys.pop((server, service), None)
+
+    def unsubscribe(self, check):
+        """
+        Stop sharing the results of a check's current probe, forgetting the probe once no check shares it.
+        Caller must hold the lock.
+        :param check: tuple of (server, service)
+        :return: None
+        """
+        key = self.keys.get(check)
+        subscribers = self.subscribers.get(key)
+        if subscribers is None:
+            return
+        subscribers.discard(check)
+        if not subscribers:
+            del self.subscribers[key]
+            self.latest.pop(key, None)
+
+    def stats(self):
+        """
+        Probe statistics
+        :return: dictionary with executed and coalesced probe counts, the share of probes saved,
+        and the number of probe keys shared by more than one check
+        """
+        with self.lock:
+            total = self.executed + self.coalesced
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'saved': self.coalesced / total if total else 0.0,
+                'shared_keys': sum(1 for subscribers in self.subscribers.values() if len(subscribers) > 1)
+            }
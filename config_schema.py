@@ -0,0 +1,230 @@
+# Parameters accepted by each service: name -> (type, default). A default of REQUIRED means the
+# parameter must be given, SERVER means it defaults to the name of the server the service belongs to,
+# OPTIONAL means it is left out when not given.
+REQUIRED = object()
+SERVER = object()
+OPTIONAL = object()
+
+SERVICE_SCHEMAS = {
+    'ICMP': {
+        'host': (str, SERVER),
+        'ttl': (int, 64),
+        'timeout': (int, 1),
+        'sequence_number': (int, 1),
+        'max_hops': (int, 30),
+        'pings_per_hop': (int, 1),
+        'verbose': (bool, False),
+        'interval': (int, REQUIRED)
+    },
+    'HTTP': {
+        'url': (str, REQUIRED),
+        'interval': (int, REQUIRED)
+    },
+    'HTTPS': {
+        'url': (str, REQUIRED),
+        'timeout': (int, 5),
+        'interval': (int, REQUIRED)
+    },
+    'TLS': {
+        'port': (int, 443),
+        'timeout': (int, 5),
+        'expiry_days': (int, 7),
+        'resume': (bool, True),
+        'interval': (int, REQUIRED)
+    },
+    'NTP': {
+        'server': (str, SERVER),
+        'interval': (int, REQUIRED)
+    },
+    'DNS': {
+        'dns_server': (str, REQUIRED),
+        'query': (str, REQUIRED),
+        'record_types': (list, REQUIRED),
+        'interval': (int, REQUIRED)
+    },
+    'TCP': {
+        'port': (int, REQUIRED),
+        'interval': (int, REQUIRED)
+    },
+    'UDP': {
+        'port': (int, REQUIRED),
+        'timeout': (int, 3),
+        'interval': (int, REQUIRED)
+    },
+    'LOCAL TCP': {
+        'port': (int, REQUIRED),
+        'interval': (int, REQUIRED)
+    }
+}
+
+# Scheduling parameters accepted by every service: adaptive checks back off toward max_interval
+# while healthy and re-probe at min_interval when the state changes
+SCHEDULE_PARAMS = {
+    'adaptive': (bool, OPTIONAL),
+    'min_interval': (int, OPTIONAL),
+    'max_interval': (int, OPTIONAL)
+}
+
+# Alerting parameters accepted by every service: results slower than degraded_ms count as DEGRADED
+ALERT_PARAMS = {
+    'degraded_ms': (int, OPTIONAL)
+}
+
+for schema in SERVICE_SCHEMAS.values():
+    schema.update(SCHEDULE_PARAMS)
+    schema.update(ALERT_PARAMS)
+
+
+def coerce_value(value, value_type):
+    """
+    Convert a value read from text (e.g. a csv cell) to the type a parameter expects
+    :param value: string value
+    :param value_type: expected type
+    :return: converted value
+    """
+    if value_type is bool:
+        if value.strip().lower() in ('true', 'yes', '1'):
+            return True
+        if value.strip().lower() in ('false', 'no', '0'):
+            return False
+        raise ValueError(f"expected true or false, got {value!r}")
+    if value_type is list:
+        return [item.strip() for item in value.split(';') if item.strip()]
+    return value_type(value)
+
+
+def validate_service(server, service, params, coerce=False):
+    """
+    Validate the parameters of a service block and fill in defaults
+    :param server: server the service belongs to
+    :param service: protocol of the service
+    :param params: parameters of the service
+    :param coerce: convert string values to the expected types (for csv input)
+    :return: tuple of (normalized params, list of error messages)
+    """
+    if service not in SERVICE_SCHEMAS:
+        return params, [f"unknown service {service!r}"]
+
+    schema = SERVICE_SCHEMAS[service]
+    normalized, errors = {}, []
+
+    # Unknown keys are usually typos of a real parameter
+    for name in params:
+        if name not in schema:
+            errors.append(f"{service}: unknown parameter {name!r}")
+
+    for name, (value_type, default) in schema.items():
+        value = params.get(name)
+
+        # Missing parameters get their defaults
+        if value is None or value == "":
+            if default is REQUIRED:
+                errors.append(f"{service}: missing required parameter {name!r}")
+            elif default is not OPTIONAL:
+                normalized[name] = server if default is SERVER else default
+            continue
+
+        if coerce and isinstance(value, str) and value_type is not str:
+            try:
+                value = coerce_value(value, value_type)
+            except ValueError as e:
+                errors.append(f"{service}: invalid {name!r}: {e}")
+                continue
+
+        # bool is a subclass of int, so check it explicitly
+        if not isinstance(value, value_type) or (value_type is int and isinstance(value, bool)):
+            errors.append(f"{service}: {name!r} must be {value_type.__name__}, got {type(value).__name__}")
+            continue
+
+        normalized[name] = value
+
+    # Range checks
+    if 'interval' in normalized and normalized['interval'] <= 0:
+        errors.append(f"{service}: 'interval' must be positive")
+    for name in ('min_interval', 'max_interval', 'degraded_ms'):
+        if name in normalized and normalized[name] <= 0:
+            errors.append(f"{service}: {name!r} must be positive")
+    if 'interval' in normalized:
+        if normalized.get('min_interval', normalized['interval']) > normalized['interval']:
+            errors.append(f"{service}: 'min_interval' must not be greater than 'interval'")
+        if normalized.get('max_interval', normalized['interval']) < normalized['interval']:
+            errors.append(f"{service}: 'max_interval' must not be less than 'interval'")
+    if 'expiry_days' in normalized and normalized['expiry_days'] < 0:
+        errors.append(f"{service}: 'expiry_days' must not be negative")
+    if 'port' in normalized and not 0 < normalized['port'] < 65536:
+        errors.append(f"{service}: 'port' must be between 1 and 65535")
+    if 'record_types' in normalized and not all(isinstance(record, str) for record in normalized['record_types']):
+        errors.append(f"{service}: 'record_types' must be a list of strings")
+
+    return normalized, errors
+
+
+def apply_defaults(server_dict):
+    """
+    Fill in the defaults of the parameters services leave out, as validate_service does on import, so that
+    configs edited by hand run with the same params
+    :param server_dict: dictionary with server and service information, updated in place
+    :return: the server dict
+    """
+    for server, server_config in server_dict.items():
+        for service, params in get_services(server_config).items():
+            for name, (value_type, default) in SERVICE_SCHEMAS.get(service, {}).items():
+                if default is not REQUIRED and default is not OPTIONAL and params.get(name) in (None, ""):
+                    params[name] = server if default is SERVER else default
+    return server_dict
+
+
+# Server level keys that hold metadata rather than a service
+METADATA_KEYS = ('tags', 'depends_on')
+
+
+def get_services(server_config):
+    """
+    Get the services of a server, leaving out metadata such as tags
+    :param server_config: dictionary of a server's services and metadata
+    :return: dictionary of service to params
+    """
+    return {service: params for service, params in server_config.items() if service not in METADATA_KEYS}
+
+
+def parse_tags(text):
+    """
+    Parse tags written as comma separated key=value pairs, e.g. "env=prod,team=network"
+    :param text: tags text
+    :return: dictionary of tag name to value
+    """
+    tags = {}
+    for pair in text.split(','):
+        if not pair.strip():
+            continue
+        key, separator, value = pair.partition('=')
+        if not separator or not key.strip() or not value.strip():
+            raise ValueError(f"invalid tag {pair.strip()!r}, expected key=value")
+        tags[key.strip()] = value.strip()
+    return tags
+
+
+def validate_tags(tags):
+    """
+    Check that tags are a flat dictionary of strings
+    :param tags: tags of a server
+    :return: list of error messages
+    """
+    if not isinstance(tags, dict):
+        return [f"tags must be a dict, got {type(tags).__name__}"]
+    return [f"tag {key!r} must have a string value" for key, value in tags.items()
+            if not isinstance(key, str) or not isinstance(value, str)]
+
+
+def validate_depends_on(server, depends_on):
+    """
+    Check that the parents of a server are a list of other server names
+    :param server: server the dependencies belong to
+    :param depends_on: list of parent servers
+    :return: list of error messages
+    """
+    if not isinstance(depends_on, list) or not all(isinstance(parent, str) for parent in depends_on):
+        return ["depends_on must be a list of server names"]
+    if server in depends_on:
+        return [f"{server} cannot depend on itself"]
+    return []
@@ -0,0 +1,315 @@
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+# flock is POSIX only, Windows falls back to msvcrt byte range locks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def file_signature(path):
+    """
+    :param path: path of a file
+    :return: tuple of modification time and size, or None if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+class ConfigStore:
+    """
+    Crash-safe and process-safe storage of the server dict.
+
+    The config lives in a json snapshot plus an append-only journal of per-server changes next to it
+    (server_dict.json.journal). Each edit appends and fsyncs one journal line instead of rewriting the
+    whole file, and the journal is folded back into the snapshot once it grows to about half the size of
+    the snapshot, so rewrite cost stays proportional to the number of edits. Snapshots are written to a
+    temp file, fsynced and renamed into place, so a crash leaves either the old or the new file, never a
+    truncated one. A journal starts with the SHA-256 of the snapshot it applies to, so a journal left behind
+    by a crash between writing a new snapshot and removing the old journal is recognized and ignored (this
+    also discards journal entries that were not yet compacted when the snapshot is edited by hand). Every
+    read and write holds a lock on server_dict.json.lock so several instances can share the same config. Readers that follow the config can replay only the journal entries appended
+    since their last read (read_journal), so applying an edit costs the same however big the config is.
+    """
+    def __init__(self, path="server_dict.json", min_compact_bytes=64 * 1024):
+        """
+        :param path: path to the json snapshot
+        :param min_compact_bytes: journal size below which it is never compacted
+        """
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.lock_path = path + ".lock"
+        self.min_compact_bytes = min_compact_bytes
+        # Bytes of the journal replayed by the last read, entries after this offset are newer
+        self.journal_offset = 0
+        # (snapshot signature, SHA-256 of the snapshot) so that appends do not re-read an unchanged snapshot
+        self.digest = None
+
+    @contextmanager
+    def locked(self, exclusive=True):
+        """
+        Hold the config lock for the duration of the with block
+        :param exclusive: True for writers, False for readers
+        :return: None
+        """
+        with open(self.lock_path, "a+") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def signature(self):
+        """
+        Modification times and sizes of the snapshot and journal, used to detect changes
+        :return: tuple
+        """
+        return file_signature(self.path), file_signature(self.journal_path)
+
+    def load(self):
+        """
+        Load the snapshot and replay the journal on top of it
+        :return: dictionary with server and service information
+        """
+        with self.locked(exclusive=False):
+            return self.read()
+
+    def read(self):
+        """
+        Read the snapshot and journal. Caller must hold the lock.
+        :return: dictionary with server and service information
+        """
+        try:
+            with open(self.path, "rb") as file:
+                contents = file.read()
+            server_dict = json.loads(contents) if contents.strip() else {}
+        except FileNotFoundError:
+            contents = b""
+            server_dict = {}
+        digest = hashlib.sha256(contents).hexdigest()
+
+        self.journal_offset = 0
+        try:
+            with open(self.journal_path, "rb") as journal:
+                for number, line in enumerate(journal):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append can only tear the last line, which was never acknowledged
+                        break
+                    if number == 0 and entry != {'op': 'base', 'snapshot': digest}:
+                        # Journal of an earlier snapshot, everything in it is already folded in or replaced
+                        break
+                    if entry['op'] == 'set':
+                        server_dict[entry['server']] = entry['services']
+                    elif entry['op'] == 'delete':
+                        server_dict.pop(entry['server'], None)
+                    if line.endswith(b"\n"):
+                        self.journal_offset += len(line)
+        except FileNotFoundError:
+            pass
+
+        return server_dict
+
+    def read_journal(self, offset):
+        """
+        Read the journal entries appended since an earlier read
+        :param offset: journal offset up to which entries were already read, e.g. journal_offset after load
+        :return: tuple of (list of journal entries, offset after the last complete entry, snapshot signature).
+        The entries only apply on top of the snapshot they were read with, if its signature changed since the
+        earlier read the snapshot was rewritten and has to be loaded again.
+        """
+        with self.locked(exclusive=False):
+            snapshot = file_signature(self.path)
+            try:
+                with open(self.journal_path, "rb") as journal:
+                    journal.seek(offset)
+                    contents = journal.read()
+            except FileNotFoundError:
+                return [], offset, snapshot
+
+        # A line torn by a crash mid-append is not read until it is complete
+        contents = contents[:contents.rfind(b"\n") + 1]
+        entries = [json.loads(line) for line in contents.splitlines() if line.strip()]
+        return [entry for entry in entries if entry['op'] != 'base'], offset + len(contents), snapshot
+
+    def save(self, server_dict):
+        """
+        Atomically replace the whole config with the given server dict
+        :param server_dict: dictionary with server and service information
+        :return: None
+        """
+        with self.locked():
+            self.write_snapshot(server_dict)
+
+    def update(self, update_fn):
+        """
+        Read, change and write back the whole config under one exclusive lock, so that edits made by other
+        instances in the meantime are not lost
+        :param update_fn: function changing the server dict in place, returns True if the change should be saved
+        :return: value returned by update_fn
+        """
+        with self.locked():
+            server_dict = self.read()
+            changed = update_fn(server_dict)
+            if changed:
+                self.write_snapshot(server_dict)
+            return changed
+
+    def set_server(self, server, services):
+        """
+        Add or replace a single server's services
+        :param server: server to add or replace
+        :param services: dictionary of the server's services and their params
+        :return: None
+        """
+        self.append({'op': 'set', 'server': server, 'services': services})
+
+    def delete_server(self, server):
+        """
+        Delete a single server
+        :param server: server to delete
+        :return: None
+        """
+        self.append({'op': 'delete', 'server': server})
+
+    def append(self, entry):
+        """
+        Durably append one change to the journal, compacting it into the snapshot when it grows too big
+        :param entry: journal entry
+        :return: None
+        """
+        with self.locked():
+            # Start a new journal when there is none or the one there belongs to an earlier snapshot
+            base = {'op': 'base', 'snapshot': self.snapshot_digest()}
+            fresh = self.journal_base() != base
+            if not fresh:
+                self.repair_journal()
+            with open(self.journal_path, "w" if fresh else "a") as journal:
+                if fresh:
+                    journal.write(json.dumps(base) + "\n")
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+            # Compact once the journal is about half the size of the snapshot
+            journal_size = os.path.getsize(self.journal_path)
+            snapshot_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if journal_size >= max(self.min_compact_bytes, snapshot_size // 2):
+                self.write_snapshot(self.read())
+
+    def journal_base(self):
+        """
+        Read the first journal entry, which names the snapshot the journal applies to. Caller must hold the lock.
+        :return: first entry, or None if there is no journal or it is empty
+        """
+        try:
+            with open(self.journal_path, "rb") as journal:
+                line = journal.readline()
+        except FileNotFoundError:
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def snapshot_digest(self):
+        """
+        SHA-256 of the snapshot, only read again when the file changed. Caller must hold the lock.
+        :return: hex digest, of empty contents if there is no snapshot
+        """
+        signature = file_signature(self.path)
+        if self.digest is None or self.digest[0] != signature:
+            try:
+                with open(self.path, "rb") as file:
+                    contents = file.read()
+            except FileNotFoundError:
+                contents = b""
+            self.digest = signature, hashlib.sha256(contents).hexdigest()
+        return self.digest[1]
+
+    def repair_journal(self):
+        """
+        Cut off a line torn by a crash mid-append so that new entries are not written after it. Only the last
+        byte is read unless the journal is torn. Caller must hold the lock.
+        :return: None
+        """
+        try:
+            with open(self.journal_path, "rb+") as journal:
+                position = journal.seek(0, os.SEEK_END)
+                if not position:
+                    return
+                journal.seek(position - 1)
+                if journal.read(1) == b"\n":
+                    return
+
+                # Torn, walk back to the end of the last complete line
+                while position:
+                    start = max(0, position - 4096)
+                    journal.seek(start)
+                    newline = journal.read(position - start).rfind(b"\n")
+                    if newline >= 0:
+                        journal.truncate(start + newline + 1)
+                        return
+                    position = start
+                journal.truncate(0)
+        except FileNotFoundError:
+            pass
+
+    def compact(self):
+        """
+        Fold the journal into the snapshot
+        :return: None
+        """
+        with self.locked():
+            self.write_snapshot(self.read())
+
+    def write_snapshot(self, server_dict):
+        """
+        Write the snapshot through a temp file and rename, then remove the journal. Caller must hold the lock.
+        A crash between the two steps leaves the old journal, which no longer matches the snapshot and is ignored.
+        :param server_dict: dictionary with server and service information
+        :return: None
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(json.dumps(server_dict))
+                file.flush()
+                os.fsync(file.fileno())
+
+            # mkstemp creates the file owner-only, keep the permissions of the file being replaced
+            if os.path.exists(self.path):
+                os.chmod(temp_path, os.stat(self.path).st_mode & 0o777)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        # Make the rename itself durable (not supported on Windows)
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
@@ -0,0 +1,234 @@
+import bisect
+import collections
+import threading
+
+# prompt_toolkit is imported inside run_dashboard so that importing this module stays cheap
+
+# Bars of the latency sparkline, lowest to highest
+SPARK_BARS = "▁▂▃▄▅▆▇█"
+
+
+class CheckRow:
+    """
+    Latest state of one check as shown on the dashboard
+    """
+    def __init__(self, server, service, history=20):
+        """
+        :param server: server of the check
+        :param service: protocol of the check
+        :param history: results kept for the sparkline and loss
+        """
+        self.server = server
+        self.service = service
+        self.status = None
+        self.latency_ms = None
+        self.timestamp = ""
+        self.latencies = collections.deque(maxlen=history)
+        self.outcomes = collections.deque(maxlen=history)
+        self.version = 0
+
+    def sparkline(self):
+        """
+        Latency sparkline of the recent results, failed checks shown as a gap
+        :return: str
+        """
+        # Copy first, the engine may append while the dashboard draws
+        latencies = list(self.latencies)
+        values = [latency for latency in latencies if latency is not None]
+        if not values:
+            return ""
+        low, high = min(values), max(values)
+        scale = (len(SPARK_BARS) - 1) / (high - low) if high > low else 0
+        return "".join(SPARK_BARS[int((latency - low) * scale)] if latency is not None else " "
+                       for latency in latencies)
+
+    def loss(self):
+        """
+        Share of failed checks among the recent results
+        :return: float between 0 and 1
+        """
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class DashboardState:
+    """
+    Sink keeping an in-memory snapshot of every check for the dashboard. Updating it is cheap, so the
+    checks never wait on rendering; the dashboard reads it at its own frame rate.
+    """
+    def __init__(self, history=20):
+        """
+        :param history: results kept per check for the sparkline and loss
+        """
+        self.history = history
+        self.rows = {}
+        self.order = []
+        self.lock = threading.Lock()
+        self.version = 0
+
+    def emit(self, result):
+        """
+        Update the row of the result's check
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        key = (result['server'], result['service'])
+        with self.lock:
+            row = self.rows.get(key) or self.add_row(key)
+            row.status = result['status']
+            row.latency_ms = result['latency_ms']
+            row.timestamp = result['timestamp']
+            row.latencies.append(result['latency_ms'] if result['status'] else None)
+            row.outcomes.append(result['status'])
+            row.version += 1
+            self.version += 1
+
+    def add_check(self, server, service):
+        """
+        Show a check before its first result arrives
+        :param server: server of the check
+        :param service: protocol of the check
+        :return: None
+        """
+        with self.lock:
+            if (server, service) not in self.rows:
+                self.add_row((server, service))
+                self.version += 1
+
+    def add_row(self, key):
+        """
+        Create the row of a check, keeping the display order sorted. Caller must hold the lock.
+        :param key: tuple of (server, service)
+        :return: CheckRow
+        """
+        row = self.rows[key] = CheckRow(*key, self.history)
+        bisect.insort(self.order, key)
+        return row
+
+    def snapshot(self):
+        """
+        Rows in display order with the state version they reflect
+        :return: tuple of (version, list of CheckRow)
+        """
+        with self.lock:
+            return self.version, [self.rows[key] for key in self.order]
+
+    def reopen(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def format_row(row, server_width):
+    """
+    Format the cells of a row as prompt_toolkit style fragments
+    :param row: CheckRow to format
+    :param server_width: width of the server column
+    :return: list of (style, text) fragments
+    """
+    if row.status is None:
+        status, style = "PENDING", "class:pending"
+    else:
+        status, style = ("UP", "class:up") if row.status else ("DOWN", "class:down")
+    latency = f"{row.latency_ms:>9.2f}" if row.latency_ms is not None else f"{'-':>9}"
+    return [
+        ("", f"{row.server[:server_width]:<{server_width}} {row.service:<9} "),
+        (style, f"{status:<7}"),
+        ("", f" {latency} ms  {row.sparkline():<20}  {row.loss():>4.0%}  {row.timestamp}\n")
+    ]
+
+
+def run_dashboard(state, title="NetCam", fps=4):
+    """
+    Show a full-screen table of every check until q, enter or CTRL + C is pressed. The screen is redrawn at
+    most fps times per second and only when a result arrived, rows are only reformatted when their check
+    changed, and only the rows that fit on screen are drawn, so rendering cost does not grow with the check rate.
+    :param state: DashboardState fed by the engine
+    :param title: title shown in the header
+    :param fps: maximum frames per second
+    :return: None
+    """
+    from prompt_toolkit.application import Application
+    from prompt_toolkit.key_binding import KeyBindings
+    from prompt_toolkit.layout import HSplit, Layout, Window
+    from prompt_toolkit.layout.controls import FormattedTextControl
+    from prompt_toolkit.styles import Style
+
+    cache = {}
+    view = {'offset': 0, 'drawn': -1}
+
+    def body_height():
+        return max(1, app.output.get_size().rows - 3)
+
+    def header():
+        version, rows = state.snapshot()
+        down = sum(1 for row in rows if row.status is False)
+        up = sum(1 for row in rows if row.status)
+        return [("class:title", f" {title} "),
+                ("", f"  {len(rows)} checks  "),
+                ("class:up", f"{up} up"), ("", "  "),
+                ("class:down", f"{down} down"),
+                ("", f"  rows {view['offset'] + 1}-{min(len(rows), view['offset'] + body_height())}\n"),
+                ("class:heading", f"{'Server':<{server_width(rows)}} {'Service':<9} {'Status':<7} {'Latency':>12}  "
+                                  f"{'Recent':<20}  {'Loss':>4}  Last check")]
+
+    def server_width(rows):
+        return min(40, max([len("Server")] + [len(row.server) for row in rows]))
+
+    def body():
+        version, rows = state.snapshot()
+        view['drawn'] = version
+        width = server_width(rows)
+        view['offset'] = max(0, min(view['offset'], len(rows) - body_height()))
+
+        # Only visible rows are formatted, and only when their check changed
+        fragments = []
+        for row in rows[view['offset']:view['offset'] + body_height()]:
+            key = (row.server, row.service)
+            cached = cache.get(key)
+            if cached is None or cached[0] != (row.version, width):
+                cached = cache[key] = ((row.version, width), format_row(row, width))
+            fragments.extend(cached[1])
+        return fragments
+
+    bindings = KeyBindings()
+
+    @bindings.add("q")
+    @bindings.add("enter")
+    @bindings.add("c-c")
+    def _(event):
+        event.app.exit()
+
+    def scroll(amount):
+        view['offset'] = max(0, view['offset'] + amount)
+        app.invalidate()
+
+    bindings.add("down")(lambda event: scroll(1))
+    bindings.add("up")(lambda event: scroll(-1))
+    bindings.add("pagedown")(lambda event: scroll(body_height()))
+    bindings.add("pageup")(lambda event: scroll(-body_height()))
+
+    style = Style.from_dict({'title': 'reverse bold', 'heading': 'underline', 'up': 'ansigreen',
+                             'down': 'ansired bold', 'pending': 'ansiyellow', 'footer': 'reverse'})
+    layout = Layout(HSplit([
+        Window(FormattedTextControl(header), height=2),
+        Window(FormattedTextControl(body)),
+        Window(FormattedTextControl([("class:footer", " q/enter: quit   up/down/pgup/pgdn: scroll ")]), height=1)
+    ]))
+    app = Application(layout=layout, key_bindings=bindings, style=style, full_screen=True)
+
+    # Redraw at a capped frame rate, and only when results arrived since the last frame
+    stop = threading.Event()
+
+    def refresh():
+        while not stop.wait(1 / fps):
+            if state.version != view['drawn']:
+                app.invalidate()
+
+    refresher = threading.Thread(target=refresh, name="dashboard-refresh", daemon=True)
+    refresher.start()
+    try:
+        app.run()
+    finally:
+        stop.set()
+        refresher.join()
@@ -0,0 +1,57 @@
+from config_schema import get_services
+from network_tests import resolve_addresses, traceroute_hops
+
+
+def resolve_servers(server_dict):
+    """
+    Map the address of every configured server back to its name
+    :param server_dict: dictionary with server and service information
+    :return: dictionary of ip address to server name
+    """
+    addresses = {}
+    for server in server_dict:
+        try:
+            # A dual-stack server can show up on a path under any of its IPv4 and IPv6 addresses
+            for family, address in resolve_addresses(server):
+                addresses.setdefault(address[0], server)
+        except OSError:
+            # Unresolvable servers cannot show up on a path
+            continue
+    return addresses
+
+
+def infer_parent(server, addresses, max_hops=30):
+    """
+    Find the nearest configured server on the path to a server
+    :param server: server to trace
+    :param addresses: dictionary of ip address to configured server name
+    :param max_hops: maximum number of hops to trace
+    :return: name of the parent server, or None if no configured server is on the path
+    """
+    hops = traceroute_hops(server, max_hops)
+
+    # Walk back from the target towards the monitoring host, the target itself maps to its own name
+    for ttl, address, ping_times in reversed(hops):
+        parent = addresses.get(address)
+        if parent and parent != server:
+            return parent
+    return None
+
+
+def infer_dependencies(server_dict, max_hops=30):
+    """
+    Propose depends_on entries from traceroute paths: each server depends on the nearest configured
+    server its traffic passes through. Runs one trace at a time, since routers rate limit the ICMP
+    errors a trace depends on.
+    :param server_dict: dictionary with server and service information
+    :param max_hops: maximum number of hops to trace per server
+    :return: dictionary of server to its inferred parent, for servers that have one
+    """
+    addresses = resolve_servers(server_dict)
+    parents = {}
+    for server in server_dict:
+        if get_services(server_dict[server]):
+            parent = infer_parent(server, addresses, max_hops)
+            if parent:
+                parents[server] = parent
+    return parents
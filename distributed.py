@@ -0,0 +1,476 @@
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from config_schema import get_services
+from monitor_engine import MonitorEngine
+from server_selector import select_server_dict
+from sharding import HashRing
+
+# Frames are a 4 byte big-endian length followed by zlib compressed json. MAX_FRAME_SIZE limits a frame
+# both before and after decompression, so a small frame cannot expand into an arbitrarily large message.
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Address the coordinator listens on when none is given. Agents are not authenticated, so only listen on
+# other addresses on a trusted network.
+DEFAULT_HOST = "127.0.0.1"
+
+# Order of the fields when results are packed into lists to keep batches small. Optional fields such as
+# suppressed_by or hops follow in a dict when a result has any.
+RESULT_FIELDS = ['timestamp', 'server', 'service', 'status', 'latency_ms', 'detail']
+
+
+def send_message(sock, message, lock):
+    """
+    Send one compressed message
+    :param sock: connected socket
+    :param message: json serializable message
+    :param lock: lock serializing writers of the socket
+    :return: None
+    """
+    payload = zlib.compress(json.dumps(message, separators=(',', ':')).encode())
+    with lock:
+        sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(sock, size):
+    """
+    Read exactly size bytes from a socket
+    :param sock: connected socket
+    :param size: number of bytes
+    :return: bytes
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed")
+        received += count
+    return bytes(buffer)
+
+
+def recv_message(sock):
+    """
+    Receive one compressed message
+    :param sock: connected socket
+    :return: decoded message
+    """
+    (size,) = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Frame of {size} bytes is too large")
+    decompressor = zlib.decompressobj()
+    payload = decompressor.decompress(recv_exactly(sock, size), MAX_FRAME_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ConnectionError(f"Frame decompresses to more than {MAX_FRAME_SIZE} bytes")
+    return json.loads(payload)
+
+
+def parse_address(text):
+    """
+    Parse host:port
+    :param text: address text, the host defaults to DEFAULT_HOST
+    :return: tuple of (host, port)
+    """
+    host, _, port = text.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+
+class BatchingSink:
+    """
+    Agent side sink: packs results into compact lists and sends them to the coordinator in batches
+    """
+    def __init__(self, sock, send_lock, batch_size=100, flush_interval=1.0):
+        """
+        :param sock: socket connected to the coordinator
+        :param send_lock: lock serializing writers of the socket
+        :param batch_size: results per batch before sending early
+        :param flush_interval: seconds after which a partial batch is sent
+        """
+        self.sock = sock
+        self.send_lock = send_lock
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch = []
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="batch-flusher", daemon=True)
+        self.thread.start()
+
+    def emit(self, result):
+        """
+        Queue a single check result, sending the batch once it is full
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        with self.lock:
+            packed = [result[field] for field in RESULT_FIELDS]
+            extra = {field: value for field, value in result.items() if field not in RESULT_FIELDS}
+            if extra:
+                packed.append(extra)
+            self.batch.append(packed)
+            full = len(self.batch) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the pending batch
+        :return: None
+        """
+        with self.lock:
+            batch, self.batch = self.batch, []
+        if batch:
+            try:
+                send_message(self.sock, {'type': 'results', 'results': batch}, self.send_lock)
+            except OSError:
+                # Connection is gone, the agent loop notices and reconnects
+                pass
+
+    def run(self):
+        """
+        Flush partial batches periodically
+        :return: None
+        """
+        while not self.event.wait(self.flush_interval):
+            self.flush()
+
+    def reopen(self):
+        """
+        Nothing to reopen
+        :return: None
+        """
+        pass
+
+    def close(self):
+        """
+        Send what is left and stop flushing
+        :return: None
+        """
+        self.event.set()
+        self.flush()
+
+
+def run_agent(coordinator_address, name, heartbeat_interval=5, retry_interval=5, stop_event=None, adaptive=False):
+    """
+    Agent: connect to the coordinator, run the checks of the shard it assigns and stream results back.
+    Reconnects after losing the coordinator, stopping its checks meanwhile so they can be rebalanced.
+    :param coordinator_address: tuple of (host, port) of the coordinator
+    :param name: vantage point name reported with every result
+    :param heartbeat_interval: seconds between heartbeats
+    :param retry_interval: seconds between reconnection attempts
+    :param stop_event: event that stops the agent when set
+    :param adaptive: use adaptive intervals for services that do not set 'adaptive' themselves
+    :return: None
+    """
+    stop_event = stop_event or threading.Event()
+    connection = {}
+
+    # Unblock recv of the current connection when the agent is stopped
+    def unblock():
+        stop_event.wait()
+        sock = connection.get('sock')
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    threading.Thread(target=unblock, name="agent-stopper", daemon=True).start()
+
+    while not stop_event.is_set():
+        try:
+            sock = socket.create_connection(coordinator_address, timeout=10)
+        except OSError as e:
+            print(f"Cannot reach coordinator {coordinator_address}: {e}", file=sys.stderr)
+            stop_event.wait(retry_interval)
+            continue
+
+        sock.settimeout(None)
+        connection['sock'] = sock
+        send_lock = threading.Lock()
+        sink = BatchingSink(sock, send_lock)
+        engine = None
+
+        # Heartbeats let the coordinator notice a dead agent
+        def heartbeat():
+            while not stop_event.wait(heartbeat_interval):
+                try:
+                    send_message(sock, {'type': 'heartbeat'}, send_lock)
+                except OSError:
+                    return
+        threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+
+        try:
+            send_message(sock, {'type': 'hello', 'agent': name}, send_lock)
+            print(f"Connected to coordinator {coordinator_address} as {name}", file=sys.stderr)
+            while not stop_event.is_set():
+                message = recv_message(sock)
+                if message['type'] == 'assign':
+                    if engine is None:
+                        engine = MonitorEngine(message['shard'], [sink], adaptive=adaptive)
+                        engine.start()
+                    else:
+                        engine.reload(message['shard'])
+                    print(f"Assigned {len(message['shard'])} servers", file=sys.stderr)
+        except (OSError, ValueError, zlib.error) as e:
+            if not stop_event.is_set():
+                print(f"Lost coordinator: {e}", file=sys.stderr)
+        finally:
+            if engine:
+                engine.stop(timeout=5)
+            sink.close()
+            sock.close()
+
+        stop_event.wait(retry_interval)
+
+
+class Coordinator:
+    """
+    Assigns shards of the server dict to connected agents by consistent hashing, rebalancing when agents
+    join or disappear, and merges their results into per-target, per-vantage views. Offers the same
+    start/stop/reload interface as MonitorEngine so the config watcher can drive it.
+    """
+    def __init__(self, server_dict, sinks, address, replication=1, agent_timeout=15, selector=None):
+        """
+        :param server_dict: dictionary with server and service information
+        :param sinks: list of sinks that receive every result, tagged with its vantage point
+        :param address: tuple of (host, port) to listen on
+        :param replication: number of agents that check each server, more than one compares vantage points
+        :param agent_timeout: seconds without any message after which an agent is considered gone
+        :param selector: parsed selector limiting the checks, or None for all
+        """
+        self.selector = selector
+        self.server_dict = select_server_dict(server_dict, selector)
+        self.sinks = sinks
+        self.address = address
+        self.replication = replication
+        self.agent_timeout = agent_timeout
+        self.ring = HashRing()
+        self.agents = {}
+        self.shards = {}
+        self.views = {}
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.listener = None
+        self.started_at = None
+        self.first_result_at = None
+
+    @property
+    def check_count(self):
+        """
+        Number of configured checks spread across the agents
+        """
+        return sum(len(get_services(services)) for services in self.server_dict.values())
+
+    @property
+    def agent_count(self):
+        """
+        Number of agents connected
+        """
+        return len(self.agents)
+
+    def start(self):
+        """
+        Start listening for agents
+        :return: None
+        """
+        self.started_at = time.perf_counter()
+        self.listener = socket.create_server(self.address)
+        threading.Thread(target=self.accept_loop, name="coordinator-accept", daemon=True).start()
+        threading.Thread(target=self.reap_loop, name="coordinator-reaper", daemon=True).start()
+
+    def stop(self, timeout=None):
+        """
+        Disconnect every agent and stop listening
+        :param timeout: unused, kept for the engine interface
+        :return: None
+        """
+        self.event.set()
+        self.listener.close()
+        with self.lock:
+            for agent in self.agents.values():
+                agent['sock'].close()
+
+    def reload(self, server_dict):
+        """
+        Apply a new server dict and send changed shards to the agents
+        :param server_dict: new dictionary with server and service information
+        :return: tuple of (started, stopped, retuned) counts, which only the agents know
+        """
+        with self.lock:
+            self.server_dict = select_server_dict(server_dict, self.selector)
+            changed = self.rebalance()
+        self.send_assignments(changed)
+        return 0, 0, 0
+
+    def update_servers(self, changes):
+        """
+        Apply changes to single servers. Shards are cut from the whole server dict, so this reloads it.
+        :param changes: dictionary of changed server to its new config, None for a deleted server
+        :return: tuple of (started, stopped, retuned) check counts, as from reload
+        """
+        server_dict = dict(self.server_dict)
+        for server, config in changes.items():
+            if config is None:
+                server_dict.pop(server, None)
+            else:
+                server_dict[server] = config
+        return self.reload(server_dict)
+
+    def accept_loop(self):
+        """
+        Accept agent connections
+        :return: None
+        """
+        while not self.event.is_set():
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_agent, args=(sock,), daemon=True).start()
+
+    def serve_agent(self, sock):
+        """
+        Handle one agent connection until it closes
+        :param sock: socket connected to the agent
+        :return: None
+        """
+        name = None
+        try:
+            hello = recv_message(sock)
+            if hello.get('type') != 'hello':
+                return
+            name = hello['agent']
+            with self.lock:
+                # A reconnecting agent replaces its stale connection, and has to be sent its shard again
+                if name in self.agents:
+                    self.agents[name]['sock'].close()
+                    self.shards.pop(name, None)
+                else:
+                    self.ring.add(name)
+                self.agents[name] = {'sock': sock, 'send_lock': threading.Lock(), 'assign_lock': threading.Lock(),
+                                     'last_seen': time.monotonic(), 'shard': None, 'sent': None}
+                changed = self.rebalance()
+            self.send_assignments(changed)
+            print(f"Agent {name} joined, {len(self.agents)} agents connected", file=sys.stderr)
+
+            while not self.event.is_set():
+                message = recv_message(sock)
+                with self.lock:
+                    if self.agents.get(name, {}).get('sock') is not sock:
+                        return
+                    self.agents[name]['last_seen'] = time.monotonic()
+                if message['type'] == 'results':
+                    self.merge(name, message['results'])
+
+        except (OSError, ValueError, KeyError, zlib.error):
+            pass
+        finally:
+            if name:
+                self.remove_agent(name, sock)
+
+    def remove_agent(self, name, sock):
+        """
+        Drop an agent and hand its servers to the others
+        :param name: agent name
+        :param sock: the agent's socket, so a newer connection of the same agent is left alone
+        :return: None
+        """
+        with self.lock:
+            agent = self.agents.get(name)
+            if not agent or agent['sock'] is not sock:
+                return
+            del self.agents[name]
+            self.shards.pop(name, None)
+            self.ring.remove(name)
+            changed = self.rebalance()
+
+            # Forget what this vantage point saw
+            for vantages in self.views.values():
+                vantages.pop(name, None)
+        sock.close()
+        self.send_assignments(changed)
+        print(f"Agent {name} left, {len(self.agents)} agents connected", file=sys.stderr)
+
+    def reap_loop(self):
+        """
+        Disconnect agents that stopped sending heartbeats
+        :return: None
+        """
+        while not self.event.wait(1):
+            now = time.monotonic()
+            with self.lock:
+                stale = [(name, agent['sock']) for name, agent in self.agents.items()
+                         if now - agent['last_seen'] > self.agent_timeout]
+            for name, sock in stale:
+                self.remove_agent(name, sock)
+
+    def rebalance(self):
+        """
+        Work out the new shard of every agent. Caller must hold the lock, and send the changed shards with
+        send_assignments after releasing it, so that a slow agent does not hold up the others.
+        Consistent hashing means only the servers of a joining or leaving agent move.
+        :return: list of agents whose shard changed
+        """
+        if not self.agents:
+            return []
+        changed = []
+        for name, shard in self.ring.partition(self.server_dict, self.replication).items():
+            if self.shards.get(name) == shard:
+                continue
+            self.shards[name] = self.agents[name]['shard'] = shard
+            changed.append(self.agents[name])
+        return changed
+
+    def send_assignments(self, agents):
+        """
+        Send agents their latest shard. Must be called without holding the lock.
+        :param agents: agents returned by rebalance
+        :return: None
+        """
+        for agent in agents:
+            # Concurrent rebalances may overtake each other, whoever sends last sends the newest shard
+            with agent['assign_lock']:
+                shard = agent['shard']
+                if shard is agent['sent']:
+                    continue
+                try:
+                    send_message(agent['sock'], {'type': 'assign', 'shard': shard}, agent['send_lock'])
+                    agent['sent'] = shard
+                except OSError:
+                    # The agent's reader thread will notice and remove it
+                    pass
+
+    def merge(self, name, results):
+        """
+        Merge a batch of results from an agent into the views and forward them to the sinks
+        :param name: vantage point the results came from
+        :param results: packed results
+        :return: None
+        """
+        if self.first_result_at is None:
+            self.first_result_at = time.perf_counter()
+        for packed in results:
+            result = dict(zip(RESULT_FIELDS, packed))
+            if len(packed) > len(RESULT_FIELDS):
+                result.update(packed[len(RESULT_FIELDS)])
+            result['vantage'] = name
+            with self.lock:
+                self.views.setdefault((result['server'], result['service']), {})[name] = result
+            for sink in self.sinks:
+                sink.emit(result)
+
+    def view(self, server, service):
+        """
+        Latest result of a check from every vantage point that runs it
+        :param server: server of the check
+        :param service: protocol of the check
+        :return: dictionary of vantage point to latest result
+        """
+        with self.lock:
+            return dict(self.views.get((server, service), {}))
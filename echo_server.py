@@ -1,51 +1,141 @@
+import argparse
+import os
 import socket
+import threading
 
+# Size of the receive buffer of the bytes and splice echo paths
+BUFFER_SIZE = 65536
 
-def tcp_server():
+# Message that ends a connection
+GOODBYE = b"Goodbye"
+
+
+def echo_text(client_sock, client_address):
+    """
+    Echo messages as text, printing every request and reply. Used interactively with the echo client.
+    :param client_sock: connected client socket
+    :param client_address: address of the client
+    :return: None
+    """
+    # Receive messages until "Goodbye" received
+    while True:
+
+        # Receive data from echo client
+        message = client_sock.recv(1024).decode()
+        if not message or message == "Goodbye":
+            print(f"Goodbye message received. Closing connection with {client_address}...")
+            break
+
+        # Print the message and return to client
+        print(f"Received echo request message: {message}")
+        print(f"Sending back echo reply message: {message}")
+        client_sock.sendall(message.encode())
+
+
+def echo_bytes(client_sock, client_address):
+    """
+    Echo raw bytes without decoding or copying them: every chunk is received into one preallocated buffer
+    and sent back from a memoryview of it.
+    :param client_sock: connected client socket
+    :param client_address: address of the client
+    :return: None
+    """
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        count = client_sock.recv_into(buffer)
+        if not count or (count == len(GOODBYE) and view[:count] == GOODBYE):
+            break
+
+        # send may take only part of the chunk, slicing the view copies nothing
+        sent = 0
+        while sent < count:
+            sent += client_sock.send(view[sent:count])
+
+
+def echo_splice(client_sock, client_address):
+    """
+    Echo raw bytes inside the kernel: every chunk is spliced from the socket into a pipe and from the pipe back
+    into the socket, so it is never copied into the process. Linux only. The data is never seen, so a Goodbye
+    message is echoed like any other and the connection ends when the client closes it.
+    :param client_sock: connected client socket
+    :param client_address: address of the client
+    :return: None
+    """
+    read_end, write_end = os.pipe()
+    try:
+        while True:
+            count = os.splice(client_sock.fileno(), write_end, BUFFER_SIZE)
+            if not count:
+                break
+            while count:
+                count -= os.splice(read_end, client_sock.fileno(), count)
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+
+
+# Echo paths by mode, splice needs os.splice (Python 3.10 and later on Linux)
+ECHO_MODES = {'text': echo_text, 'bytes': echo_bytes}
+if hasattr(os, 'splice'):
+    ECHO_MODES['splice'] = echo_splice
+
+
+def handle_client(client_sock, client_address, echo, verbose):
+    """
+    Echo one connection until the client says goodbye or closes it
+    :param client_sock: connected client socket
+    :param client_address: address of the client
+    :param echo: echo path from ECHO_MODES
+    :param verbose: print connections as they open and close
+    :return: None
+    """
+    try:
+        echo(client_sock, client_address)
+    except (ConnectionError, UnicodeDecodeError):
+        pass
+    finally:
+        # Close client connection
+        client_sock.close()
+        if verbose:
+            print(f"Connection with {client_address} closed")
+
+
+def tcp_server(server_address='127.0.0.1', server_port=12345, mode='text'):
     """
     Local TCP echo server for use with network monitoring application and echo client. Will accept messages in the same
     TCP connection until the "Goodbye" message is received. In the case of the included echo client, this will be done
-    via user input. In the case of the network monitoring application, this will be done automatically.
+    via user input. In the case of the network monitoring application, this will be done automatically. Every
+    connection is served in its own thread.
+    :param server_address: address to listen on, the loop back address by default
+    :param server_port: port to listen on
+    :param mode: 'text' prints every message, 'bytes' and 'splice' echo raw bytes silently, for use as a load target
     :return: None
     """
-    # Create IPv4 sock stream socket
-    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    echo = ECHO_MODES[mode]
+    verbose = mode == 'text'
+
+    # Create IPv4 (or IPv6, for an IPv6 address) sock stream socket
+    family = socket.AF_INET6 if ":" in server_address else socket.AF_INET
+    server_sock = socket.socket(family, socket.SOCK_STREAM)
 
     # Bind the socket
-    server_address = '127.0.0.1'  # Loop back address for local host
-    server_port = 12345  # Port to listen on
+    server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_sock.bind((server_address, server_port))
 
     # Listen for incoming connections
-    server_sock.listen(5)  # Configure for backlog of 5 connections
+    server_sock.listen(128)
 
-    print('Server is listening for incoming connections...')
+    print(f'Server is listening for incoming connections ({mode} echo)...')
 
     try:
         while True:
             # Accept a connection
             client_sock, client_address = server_sock.accept()
-            print(f"Connection from {client_address}")
-
-            try:
-                # Receive messages until "Goodbye" received
-                while True:
-
-                    # Receive data from echo client
-                    message = client_sock.recv(1024).decode()
-                    if not message or message == "Goodbye":
-                        print(f"Goodbye message received. Closing connection with {client_address}...")
-                        break
-
-                    # Print the message and return to client
-                    print(f"Received echo request message: {message}")
-                    print(f"Sending back echo reply message: {message}")
-                    client_sock.sendall(message.encode())
-
-            finally:
-                # Close client connection
-                client_sock.close()
-                print(f"Connection with {client_address} closed")
+            if verbose:
+                print(f"Connection from {client_address}")
+            threading.Thread(target=handle_client, args=(client_sock, client_address, echo, verbose),
+                             daemon=True).start()
 
     except KeyboardInterrupt:
         print("Server is shutting down")
@@ -57,4 +147,10 @@ def tcp_server():
 
 
 if __name__ == '__main__':
-    tcp_server()
+    parser = argparse.ArgumentParser(description="Local TCP echo server")
+    parser.add_argument("--host", default='127.0.0.1', help="Address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=12345, help="Port to listen on (default 12345)")
+    parser.add_argument("--mode", choices=sorted(ECHO_MODES), default='text',
+                        help="text prints every message (default), bytes and splice echo raw bytes silently")
+    args = parser.parse_args()
+    tcp_server(args.host, args.port, args.mode)
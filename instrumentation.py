@@ -0,0 +1,427 @@
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+# Profiler while instrumentation is enabled, None otherwise. Nothing is wrapped until enable() is called,
+# so the checks run the plain functions and pay nothing when profiling is off.
+profiler = None
+
+# Socket calls timed as their own phases, by the name they are shown with
+SOCKET_METHODS = {
+    '__init__': "socket.create",
+    'connect': "socket.connect",
+    'connect_ex': "socket.connect",
+    'send': "socket.send",
+    'sendall': "socket.send",
+    'sendto': "socket.send",
+    'recv': "socket.recv",
+    'recvfrom': "socket.recv",
+    'recv_into': "socket.recv",
+    'recvfrom_into': "socket.recv"
+}
+RESOLVER_FUNCTIONS = {
+    'getaddrinfo': "dns.getaddrinfo",
+    'gethostbyname': "dns.gethostbyname",
+    'gethostbyname_ex': "dns.gethostbyname",
+    'gethostbyaddr': "dns.gethostbyaddr"
+}
+
+
+class Profiler:
+    """
+    Collects wall and CPU time per call stack of instrumented functions, time spent waiting for the shared output
+    lock, and scheduler lag (how much later than asked a sleeping check woke up). Stacks are kept per thread, so
+    a socket call is attributed to the probe and check that made it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = {}
+        self.lock_waits = {}
+        self.lags = {}
+        self.patches = []
+        self.started = time.time()
+
+    def stack(self):
+        """
+        Call stack of instrumented functions of the current thread
+        :return: list of frame names
+        """
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def timed(self, name, func, label=None):
+        """
+        Wrap a function so that every call records its wall and CPU time under the current stack
+        :param name: frame name of the function
+        :param func: function to wrap
+        :param label: optional function of the call arguments returning a more specific frame name
+        :return: wrapped function
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = self.stack()
+            stack.append(label(*args, **kwargs) if label else name)
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(tuple(stack), time.perf_counter() - wall, time.thread_time() - cpu)
+                stack.pop()
+        return wrapper
+
+    def frame(self, name, func, label=None):
+        """
+        Wrap a long running function, such as a check loop, so that it shows up as the root of the stacks of the
+        calls it makes without recording its own, mostly sleeping, time
+        :param name: frame name of the function
+        :param func: function to wrap
+        :param label: optional function of the call arguments returning a more specific frame name
+        :return: wrapped function
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = self.stack()
+            stack.append(label(*args, **kwargs) if label else name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stack.pop()
+        return wrapper
+
+    def record(self, stack, wall, cpu):
+        """
+        Add a call to the totals of its stack
+        :param stack: tuple of frame names, outermost first
+        :param wall: wall time of the call in seconds
+        :param cpu: CPU time of the call in seconds
+        :return: None
+        """
+        with self.lock:
+            totals = self.spans.get(stack)
+            if totals is None:
+                totals = self.spans[stack] = [0, 0.0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+            totals[3] = max(totals[3], wall)
+
+    def record_wait(self, name, seconds):
+        """
+        Record the time a thread waited for a lock
+        :param name: name of the lock
+        :param seconds: time waited
+        :return: None
+        """
+        with self.lock:
+            add_sample(self.lock_waits, name, seconds)
+
+    def record_lag(self, seconds):
+        """
+        Record how much later than asked the current thread woke up from a timed wait
+        :param seconds: oversleep in seconds
+        :return: None
+        """
+        stack = self.stack()
+        with self.lock:
+            add_sample(self.lags, stack[0] if stack else threading.current_thread().name, max(0.0, seconds))
+
+    def patch_function(self, func, wrapper):
+        """
+        Replace every module level reference to a function, including names copied by from-imports
+        :param func: original function
+        :param wrapper: replacement
+        :return: None
+        """
+        for module in list(sys.modules.values()):
+            namespace = getattr(module, '__dict__', None)
+            if not namespace:
+                continue
+            for attribute, value in list(namespace.items()):
+                if value is func:
+                    setattr(module, attribute, wrapper)
+                    self.patches.append((module, attribute, func, True))
+
+    def patch_attribute(self, owner, attribute, wrapper):
+        """
+        Replace an attribute of a class or module, remembering whether it was inherited
+        :param owner: class or module to patch
+        :param attribute: attribute name
+        :param wrapper: replacement
+        :return: None
+        """
+        original = owner.__dict__.get(attribute)
+        setattr(owner, attribute, wrapper)
+        self.patches.append((owner, attribute, original, original is not None))
+
+    def install(self):
+        """
+        Wrap the probes, check loops, socket calls and name resolution
+        :return: None
+        """
+        import socket
+        import ssl
+        import network_tests
+        import service_checks
+        import coalescing
+        import monitor_engine
+
+        # Every probe in network_tests
+        for name, func in inspect.getmembers(network_tests, inspect.isfunction):
+            if func.__module__ == network_tests.__name__:
+                self.patch_function(func, self.timed(name, func))
+
+        # Interactive check loops are roots, named after their server
+        for name, func in inspect.getmembers(service_checks, inspect.isfunction):
+            if name.endswith("_service_check"):
+                self.patch_function(func, self.frame(name, func, check_label(name)))
+        self.patch_function(service_checks.probe_service, self.timed(
+            "probe_service", service_checks.probe_service,
+            lambda server, service, params: f"probe_service {service}"))
+        self.patch_function(service_checks.print_check, self.timed("print_check", service_checks.print_check))
+
+        # Engine check loops are roots, named after their check
+        run_check = monitor_engine.MonitorEngine.run_check
+        self.patch_attribute(monitor_engine.MonitorEngine, 'run_check', self.frame(
+            "run_check", run_check, lambda engine, handle: f"{handle.service} {handle.server}"))
+        probe = coalescing.ProbeCoalescer.probe
+        self.patch_attribute(coalescing.ProbeCoalescer, 'probe', self.timed("ProbeCoalescer.probe", probe))
+
+        # Syscall heavy phases
+        for attribute, name in SOCKET_METHODS.items():
+            self.patch_attribute(socket.socket, attribute, self.timed(name, getattr(socket.socket, attribute)))
+        for attribute, name in RESOLVER_FUNCTIONS.items():
+            self.patch_function(getattr(socket, attribute), self.timed(name, getattr(socket, attribute)))
+        handshake = ssl.SSLSocket.do_handshake
+        self.patch_attribute(ssl.SSLSocket, 'do_handshake', self.timed("tls.handshake", handshake))
+
+    def uninstall(self):
+        """
+        Restore everything install replaced
+        :return: None
+        """
+        for owner, attribute, original, owned in reversed(self.patches):
+            if owned:
+                setattr(owner, attribute, original)
+            else:
+                delattr(owner, attribute)
+        self.patches = []
+
+    def report(self):
+        """
+        Snapshot of everything recorded so far
+        :return: json serializable dictionary
+        """
+        with self.lock:
+            return {
+                'started': self.started,
+                'elapsed_s': round(time.time() - self.started, 3),
+                'spans': [{'stack': list(stack), 'count': count, 'wall_s': wall, 'cpu_s': cpu, 'max_s': longest}
+                          for stack, (count, wall, cpu, longest) in self.spans.items()],
+                'lock_wait': {name: summarize_samples(totals) for name, totals in self.lock_waits.items()},
+                'lag': {name: summarize_samples(totals) for name, totals in self.lags.items()}
+            }
+
+    def dump(self, path):
+        """
+        Write the report as json, replacing the file in one step so readers never see half of it
+        :param path: file to write
+        :return: None
+        """
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.report(), file)
+        os.replace(path + ".tmp", path)
+
+
+def check_label(name):
+    """
+    Frame name of an interactive check loop: the loop and its server
+    :param name: name of the check loop
+    :return: label function taking the loop's arguments
+    """
+    return lambda server_dict, server, *args, **kwargs: f"{name} {server}"
+
+
+def add_sample(samples, name, seconds):
+    """
+    Add a sample to running count, total and maximum. Caller must hold the profiler lock.
+    :param samples: dictionary of name to [count, total, max]
+    :param name: name the sample belongs to
+    :param seconds: sample value
+    :return: None
+    """
+    totals = samples.get(name)
+    if totals is None:
+        totals = samples[name] = [0, 0.0, 0.0]
+    totals[0] += 1
+    totals[1] += seconds
+    totals[2] = max(totals[2], seconds)
+
+
+def summarize_samples(totals):
+    """
+    :param totals: [count, total, max]
+    :return: dictionary with count, total_s and max_s
+    """
+    return {'count': totals[0], 'total_s': totals[1], 'max_s': totals[2]}
+
+
+class InstrumentedLock:
+    """
+    Lock wrapper recording how long every acquire waited
+    """
+    def __init__(self, lock, name, profiler):
+        self.lock = lock
+        self.name = name
+        self.profiler = profiler
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        self.profiler.record_wait(self.name, time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class InstrumentedEvent:
+    """
+    Event wrapper recording the scheduler lag of every wait that ran into its timeout
+    """
+    def __init__(self, event, profiler):
+        self.event = event
+        self.profiler = profiler
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def set(self):
+        self.event.set()
+
+    def clear(self):
+        self.event.clear()
+
+    def wait(self, timeout=None):
+        start = time.perf_counter()
+        flag = self.event.wait(timeout)
+        if not flag and timeout:
+            self.profiler.record_lag(time.perf_counter() - start - timeout)
+        return flag
+
+
+def enable():
+    """
+    Start profiling, wrapping the instrumented functions
+    :return: Profiler
+    """
+    global profiler
+    if profiler is None:
+        profiler = Profiler()
+        profiler.install()
+    return profiler
+
+
+def disable():
+    """
+    Stop profiling and restore the plain functions
+    :return: Profiler that was active, or None
+    """
+    global profiler
+    active, profiler = profiler, None
+    if active:
+        active.uninstall()
+    return active
+
+
+def instrument_lock(lock, name="output"):
+    """
+    Wrap a lock to record wait times while profiling, or return it unchanged
+    :param lock: lock to wrap
+    :param name: name the waits are reported under
+    :return: lock
+    """
+    return InstrumentedLock(lock, name, profiler) if profiler else lock
+
+
+def instrument_event(event):
+    """
+    Wrap a stop event to record the scheduler lag of timed waits while profiling, or return it unchanged
+    :param event: event to wrap
+    :return: event
+    """
+    return InstrumentedEvent(event, profiler) if profiler else event
+
+
+def folded_stacks(report):
+    """
+    Convert a report to the folded stack format read by flamegraph.pl, speedscope and similar tools:
+    one "outer;inner;innermost <self time in microseconds>" line per stack
+    :param report: report returned by Profiler.report
+    :return: list of lines
+    """
+    wall = {tuple(span['stack']): span['wall_s'] for span in report['spans']}
+    children = {}
+    for stack, seconds in wall.items():
+        if len(stack) > 1:
+            children[stack[:-1]] = children.get(stack[:-1], 0.0) + seconds
+
+    # Outer frames of wrapped functions that were never timed themselves, e.g. check loops, have no own time
+    lines = []
+    for stack, seconds in sorted(wall.items()):
+        own = int((seconds - children.get(stack, 0.0)) * 1e6)
+        if own > 0:
+            lines.append(f"{';'.join(frame.replace(';', ',') for frame in stack)} {own}")
+    return lines
+
+
+def format_report(report, top=25):
+    """
+    Format a report as tables of the slowest stacks, lock waits and scheduler lag
+    :param report: report returned by Profiler.report
+    :param top: number of stacks to show
+    :return: formatted string
+    """
+    lines = [f"Profile of {report['elapsed_s']:.1f} s"]
+
+    # Phases are grouped by their innermost frame, stacks are shown by total time
+    phases = {}
+    for span in report['spans']:
+        totals = phases.setdefault(span['stack'][-1].split(" ")[0], [0, 0.0, 0.0, 0.0])
+        totals[0] += span['count']
+        totals[1] += span['wall_s']
+        totals[2] += span['cpu_s']
+        totals[3] = max(totals[3], span['max_s'])
+    lines += ["", f"{'Function':<32} {'Calls':>8} {'Wall ms':>11} {'CPU ms':>10} {'Mean ms':>9} {'Max ms':>9}"]
+    for name, (count, wall, cpu, longest) in sorted(phases.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name[:32]:<32} {count:>8} {wall * 1000:>11.1f} {cpu * 1000:>10.1f} "
+                     f"{wall * 1000 / count:>9.2f} {longest * 1000:>9.2f}")
+
+    spans = sorted(report['spans'], key=lambda span: -span['wall_s'])[:top]
+    lines += ["", f"{'Calls':>8} {'Wall ms':>11} {'CPU ms':>10}  Stack"]
+    for span in spans:
+        lines.append(f"{span['count']:>8} {span['wall_s'] * 1000:>11.1f} {span['cpu_s'] * 1000:>10.1f}  "
+                     f"{' > '.join(span['stack'])}")
+
+    for title, samples in (("Lock wait", report['lock_wait']), ("Scheduler lag", report['lag'])):
+        if samples:
+            lines += ["", f"{title:<40} {'Count':>8} {'Total ms':>10} {'Mean ms':>9} {'Max ms':>9}"]
+            for name, sample in sorted(samples.items(), key=lambda item: -item[1]['total_s']):
+                lines.append(f"{name[:40]:<40} {sample['count']:>8} {sample['total_s'] * 1000:>10.1f} "
+                             f"{sample['total_s'] * 1000 / sample['count']:>9.2f} {sample['max_s'] * 1000:>9.2f}")
+    return "\n".join(lines)
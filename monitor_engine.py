@@ -0,0 +1,428 @@
+import threading
+import time
+import instrumentation
+from coalescing import ProbeCoalescer
+from config_schema import apply_defaults, get_services
+from config_store import ConfigStore
+from server_selector import select_server_dict
+from service_checks import probe_service
+
+# Checks of a server whose parent is down are probed this many times less often
+SUPPRESSED_INTERVAL_FACTOR = 10
+
+
+def diff_server_dicts(old_server_dict, new_server_dict):
+    """
+    List the checks that have to be started, stopped or retuned to go from one server dict to another.
+    Every server in either dict is compared, servers whose config is unchanged with a single comparison.
+    To only pay for what changed, pass just the changed servers, as update_servers does.
+    :param old_server_dict: current dictionary with server and service information
+    :param new_server_dict: new dictionary with server and service information
+    :return: list of (action, server, service, params) with action 'start', 'stop' or 'retune'
+    """
+    changes = []
+    for server in old_server_dict.keys() | new_server_dict.keys():
+        old_services = get_services(old_server_dict.get(server, {}))
+        new_services = get_services(new_server_dict.get(server, {}))
+        if old_services == new_services:
+            continue
+
+        for service in old_services.keys() | new_services.keys():
+            if service not in new_services:
+                # Service or whole server removed
+                changes.append(('stop', server, service, None))
+            elif service not in old_services:
+                changes.append(('start', server, service, new_services[service]))
+            elif old_services[service] != new_services[service]:
+                changes.append(('retune', server, service, new_services[service]))
+
+    return changes
+
+
+def missing_parents(server_dict):
+    """
+    Find dependencies on servers that are not in a server dict, e.g. left out by a selector or not configured.
+    The state of such a parent is unknown, so the checks behind it are never suppressed.
+    :param server_dict: dictionary with server and service information an engine runs
+    :return: sorted list of (server, parent)
+    """
+    return sorted((server, parent) for server, config in server_dict.items()
+                  for parent in config.get('depends_on', []) if parent not in server_dict)
+
+
+class AdaptiveSchedule:
+    """
+    Picks the wait before the next probe of a check from its recent results. A state change is
+    re-probed at min_interval to confirm it quickly; from there the wait doubles on every result
+    that agrees, up to max_interval while healthy and up to the configured interval while failing,
+    so a dead target is not hammered. A flapping target keeps getting reset to min_interval.
+    """
+    def __init__(self, params):
+        """
+        :param params: parameters of the service, min_interval defaults to a quarter of interval
+        and max_interval to four times interval
+        """
+        self.interval = params['interval']
+        self.min_interval = params.get('min_interval', max(1, self.interval // 4))
+        self.max_interval = params.get('max_interval', self.interval * 4)
+        self.status = None
+        self.current = self.min_interval
+
+    def next_interval(self, status):
+        """
+        Record a result and get the wait before the next probe
+        :param status: True if the check succeeded
+        :return: seconds to wait
+        """
+        if status != self.status:
+            # State changed, confirm it fast
+            self.status = status
+            self.current = self.min_interval
+        elif status:
+            self.current = min(self.current * 2, self.max_interval)
+        else:
+            self.current = min(self.current * 2, self.interval)
+        return self.current
+
+
+class CheckHandle:
+    """
+    A single running service check and the events used to retune or stop it
+    """
+    def __init__(self, server, service, params):
+        self.server = server
+        self.service = service
+        self.params = params
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.thread = None
+
+
+class MonitorEngine:
+    """
+    Runs every configured service check in its own thread without any user interaction,
+    writing each result to the configured sinks. Checks can be added, removed or retuned
+    while the others keep running.
+    """
+    def __init__(self, server_dict, sinks, selector=None, adaptive=False, coalesce=True):
+        """
+        :param server_dict: dictionary with server and service information
+        :param sinks: list of sinks that receive every check result
+        :param selector: parsed selector limiting the engine to matching checks, or None for all
+        :param adaptive: use adaptive intervals for services that do not set 'adaptive' themselves
+        :param coalesce: run equivalent probes of different checks once and share the result
+        """
+        self.selector = selector
+        self.adaptive = adaptive
+        self.coalescer = ProbeCoalescer() if coalesce else None
+        self.server_dict = select_server_dict(server_dict, selector)
+        self.sinks = sinks
+        self.checks = {}
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.first_result_at = None
+
+    @property
+    def check_count(self):
+        """
+        Number of currently running checks
+        """
+        return len(self.checks)
+
+    def start(self):
+        """
+        Start a thread for every service of every server
+        :return: None
+        """
+        self.started_at = time.perf_counter()
+        with self.lock:
+            for server in self.server_dict:
+                for service, params in get_services(self.server_dict[server]).items():
+                    self.start_check(server, service, params)
+
+    def stop(self, timeout=None):
+        """
+        Signal every check thread to stop and wait for them
+        :param timeout: seconds to wait for each thread
+        :return: None
+        """
+        with self.lock:
+            handles = list(self.checks.values())
+            self.checks = {}
+        for handle in handles:
+            handle.stop_event.set()
+            handle.wake_event.set()
+        for handle in handles:
+            handle.thread.join(timeout)
+
+    def reload(self, server_dict):
+        """
+        Apply a new server dict, touching only the checks that changed
+        :param server_dict: new dictionary with server and service information
+        :return: tuple of (started, stopped, retuned) check counts
+        """
+        server_dict = select_server_dict(server_dict, self.selector)
+        with self.lock:
+            old_server_dict, self.server_dict = self.server_dict, server_dict
+            return self.apply_changes(diff_server_dicts(old_server_dict, server_dict))
+
+    def update_servers(self, changes):
+        """
+        Apply changes to single servers, e.g. replayed from the config journal, touching only those servers
+        :param changes: dictionary of changed server to its new config, None for a deleted server
+        :return: tuple of (started, stopped, retuned) check counts
+        """
+        with self.lock:
+            old_servers, new_servers = {}, {}
+            for server, config in changes.items():
+                if server in self.server_dict:
+                    old_servers[server] = self.server_dict[server]
+                if config is not None:
+                    new_servers.update(select_server_dict({server: config}, self.selector))
+
+            for server in old_servers.keys() - new_servers.keys():
+                del self.server_dict[server]
+            self.server_dict.update(new_servers)
+            return self.apply_changes(diff_server_dicts(old_servers, new_servers))
+
+    def apply_changes(self, changes):
+        """
+        Start, stop and retune checks. Caller must hold the engine lock.
+        :param changes: list of (action, server, service, params) from diff_server_dicts
+        :return: tuple of (started, stopped, retuned) check counts
+        """
+        started = stopped = retuned = 0
+        for action, server, service, params in changes:
+            key = (server, service)
+            if action == 'stop':
+                self.statuses.pop(key, None)
+                if self.coalescer:
+                    self.coalescer.forget(server, service)
+                handle = self.checks.pop(key, None)
+                if handle:
+                    handle.stop_event.set()
+                    handle.wake_event.set()
+                    stopped += 1
+            elif action == 'start' or key not in self.checks:
+                self.start_check(server, service, params)
+                started += 1
+            else:
+                # Swap params in place and wake the check so it runs with them right away
+                handle = self.checks[key]
+                handle.params = params
+                handle.wake_event.set()
+                retuned += 1
+
+        return started, stopped, retuned
+
+    def start_check(self, server, service, params):
+        """
+        Start the thread for a single service check. Caller must hold the engine lock.
+        :param server: server the check belongs to
+        :param service: protocol of the service
+        :param params: parameters of the service
+        :return: None
+        """
+        handle = CheckHandle(server, service, params)
+        handle.thread = threading.Thread(target=self.run_check, args=(handle,), name=f"{server}/{service}", daemon=True)
+        self.checks[(server, service)] = handle
+        handle.thread.start()
+
+    def run_check(self, handle):
+        """
+        Loop a single service check until it is stopped
+        :param handle: handle of the check to run
+        :return: None
+        """
+        params = schedule = None
+        while not handle.stop_event.is_set():
+            # Start a fresh schedule whenever the check is retuned
+            if params is not handle.params:
+                params = handle.params
+                schedule = AdaptiveSchedule(params) if params.get('adaptive', self.adaptive) else None
+
+            suppressed_by = self.suppressed_by(handle.server)
+            if self.coalescer:
+                result = self.coalescer.probe(handle.server, handle.service, params)
+            else:
+                result = probe_service(handle.server, handle.service, params)
+            if suppressed_by:
+                result['suppressed_by'] = suppressed_by
+
+            # Record when the very first result came in
+            if self.first_result_at is None:
+                self.first_result_at = time.perf_counter()
+
+            self.record_status(handle.server, handle.service, result['status'])
+            self.emit(result)
+
+            # Behind a failed parent, probe rarely until the parent recovers and wakes this check
+            interval = schedule.next_interval(result['status']) if schedule else params['interval']
+            timeout = params['interval'] * SUPPRESSED_INTERVAL_FACTOR if suppressed_by else interval
+            waited = time.perf_counter()
+            if not handle.wake_event.wait(timeout) and instrumentation.profiler:
+                # Scheduler lag: how much later than its timeout the check got to run again
+                instrumentation.profiler.record_lag(time.perf_counter() - waited - timeout)
+            handle.wake_event.clear()
+
+    def server_down(self, server):
+        """
+        A server is down when the latest result of every one of its checks failed
+        :param server: server to look up
+        :return: True if the server has results and all of them failed
+        """
+        statuses = [self.statuses.get((server, service)) for service in get_services(self.server_dict.get(server, {}))]
+        return any(status is not None for status in statuses) and not any(statuses)
+
+    def suppressed_by(self, server, seen=None):
+        """
+        Find a parent, direct or further upstream, that is down
+        :param server: server whose dependencies to follow
+        :param seen: servers already visited, guards against dependency cycles
+        :return: name of a down parent, or None
+        """
+        seen = seen or {server}
+        for parent in self.server_dict.get(server, {}).get('depends_on', []):
+            if parent in seen:
+                continue
+            seen.add(parent)
+            if self.server_down(parent):
+                return parent
+            upstream = self.suppressed_by(parent, seen)
+            if upstream:
+                return upstream
+        return None
+
+    def record_status(self, server, service, status):
+        """
+        Remember the latest status of a check, and wake the checks of dependent servers when the server recovers
+        :param server: server of the check
+        :param service: protocol of the check
+        :param status: True if the check succeeded
+        :return: None
+        """
+        was_down = self.server_down(server)
+        self.statuses[(server, service)] = status
+        if was_down and not self.server_down(server):
+            with self.lock:
+                handles = [handle for (child, _), handle in self.checks.items()
+                           if server in self.server_dict.get(child, {}).get('depends_on', [])]
+            for handle in handles:
+                handle.wake_event.set()
+
+    def emit(self, result):
+        """
+        Send a result to every sink
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        for sink in self.sinks:
+            sink.emit(result)
+
+
+class ConfigWatcher:
+    """
+    Polls the config file and its journal for changes and applies them to a running engine. When only the
+    journal grew, just the appended entries are applied; a rewritten snapshot is loaded and diffed in full.
+    All reloads run in the watcher thread, also the ones requested from a signal handler.
+    """
+    def __init__(self, path, engine, poll_interval=2, on_reload=None, on_error=None, on_request=None):
+        """
+        :param path: path to the json config file
+        :param engine: engine to reload when the file changes
+        :param poll_interval: seconds between checks of the file, 0 to only reload on request
+        :param on_reload: callback receiving the (started, stopped, retuned) counts after a reload
+        :param on_error: callback receiving the exception when the file cannot be loaded
+        :param on_request: callback run in the watcher thread before a requested reload, e.g. to reopen log files
+        """
+        self.path = path
+        self.store = ConfigStore(path)
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.on_reload = on_reload
+        self.on_error = on_error
+        self.on_request = on_request
+        self.event = threading.Event()
+        self.requested = threading.Event()
+        self.signature = self.store.signature()
+        # Unknown until the watcher loaded the config itself, the first change is then applied in full
+        self.journal_offset = None
+        self.thread = threading.Thread(target=self.run, name="config-watcher", daemon=True)
+
+    def check(self, force=False):
+        """
+        Reload the engine if the file changed since the last check
+        :param force: reload the whole config even if it did not change
+        :return: result of engine.reload or engine.update_servers, or None if nothing was applied
+        """
+        signature = self.store.signature()
+        if signature == self.signature and not force:
+            return None
+
+        try:
+            if not force and self.journal_offset is not None and signature[0] == self.signature[0]:
+                entries, journal_offset, snapshot = self.store.read_journal(self.journal_offset)
+                if snapshot == self.signature[0]:
+                    self.signature, self.journal_offset = signature, journal_offset
+                    if not entries:
+                        return None
+                    # Later entries for the same server replace earlier ones
+                    changes = {entry['server']: entry.get('services') for entry in entries}
+                    apply_defaults({server: config for server, config in changes.items() if config is not None})
+                    counts = self.engine.update_servers(changes)
+                    if self.on_reload:
+                        self.on_reload(counts)
+                    return counts
+
+            server_dict = apply_defaults(self.store.load())
+        except (OSError, ValueError) as e:
+            # Edited by hand and left invalid, try again next poll
+            if self.on_error:
+                self.on_error(e)
+            return None
+
+        self.signature, self.journal_offset = signature, self.store.journal_offset
+        counts = self.engine.reload(server_dict)
+        if self.on_reload:
+            self.on_reload(counts)
+        return counts
+
+    def request_reload(self):
+        """
+        Ask the watcher thread for a full reload. Only sets an event, so it is safe to call from a signal handler.
+        :return: None
+        """
+        self.requested.set()
+
+    def run(self):
+        """
+        Poll until stopped, reloading in full when requested
+        :return: None
+        """
+        while not self.event.is_set():
+            self.requested.wait(self.poll_interval or None)
+            if self.event.is_set():
+                break
+            force = self.requested.is_set()
+            self.requested.clear()
+            if force and self.on_request:
+                self.on_request()
+            if force or self.poll_interval:
+                self.check(force)
+
+    def start(self):
+        """
+        Start polling in a background thread
+        :return: None
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop polling and wait for the thread
+        :return: None
+        """
+        self.event.set()
+        self.requested.set()
+        self.thread.join()
@@ -0,0 +1,544 @@
+import time
+
+# Taken before any other import so startup time includes module loading
+LAUNCHED_AT = time.perf_counter()
+
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+from config_store import ConfigStore
+from server_selector import parse_selector
+
+# Subsystems (probes, alerting, sharding, distribution, bulk io, ...) are imported by the subcommands that
+# use them, so that starting one command does not pay for loading all the others
+
+# Columns of check-once csv output, optional fields a result lacks are left empty
+RESULT_FIELDS = ['timestamp', 'server', 'service', 'status', 'latency_ms', 'resolve_ms', 'detail']
+
+# File formats of bulk_io.FORMATS, repeated here so that parsing the command line does not import bulk_io
+FILE_FORMATS = ['csv', 'jsonl', 'yaml']
+
+
+def load_server_dict(path):
+    """
+    Load the server dict from a json file and its journal, with defaults for the parameters left out
+    :param path: path to the json config file
+    :return: dictionary with server and service information
+    """
+    from config_schema import apply_defaults
+
+    return apply_defaults(ConfigStore(path).load())
+
+
+def create_sinks(args, get_server_dict):
+    """
+    Create the result sinks given on the command line plus a RateSink and, if requested, a PathHistory
+    and a StateTracker
+    :param args: parsed command line arguments
+    :param get_server_dict: returns the server dict the engine currently runs
+    :return: tuple of (list of sinks, the RateSink among them)
+    """
+    from sinks import RateSink, create_sink
+
+    rates = RateSink()
+    sinks = [create_sink(spec) for spec in args.sink or ["stdout"]] + [rates]
+    if args.path_history:
+        from path_history import PathHistory, format_change
+        report_change = lambda change: print(format_change(change), file=sys.stderr)
+        sinks.append(PathHistory(args.path_history, on_change=report_change))
+    if args.alert:
+        from alerting import AlertDispatcher, StateTracker, create_channel
+        confirm, window = args.confirm
+        dispatcher = AlertDispatcher([create_channel(spec) for spec in args.alert])
+        sinks.append(StateTracker(dispatcher, get_server_dict, confirm, window))
+    return sinks, rates
+
+
+def parse_confirmation(text):
+    """
+    Parse an N-of-M confirmation such as "2/3"
+    :param text: confirmation text
+    :return: tuple of (N, M)
+    """
+    confirm, _, window = text.partition("/")
+    confirm, window = int(confirm), int(window or confirm)
+    if not 0 < confirm <= window:
+        raise ValueError(f"invalid confirmation {text!r}")
+    return confirm, window
+
+
+def run(args):
+    """
+    Monitor every configured server without user interaction until SIGTERM or SIGINT is received.
+    Changes to the config file are applied to the running checks, and SIGHUP forces a reload
+    and reopens file sinks.
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    server_dict = load_server_dict(args.config)
+    if args.profile:
+        import instrumentation
+        instrumentation.enable()
+    if args.dns_ttl:
+        import resolution
+        resolution.cache.read_ttl = True
+    sinks, rates = create_sinks(args, lambda: engine.server_dict)
+    if args.workers > 1:
+        from sharding import Supervisor
+        engine = Supervisor(server_dict, sinks, args.workers, args.select, args.adaptive, not args.no_coalesce)
+    else:
+        from monitor_engine import MonitorEngine
+        engine = MonitorEngine(server_dict, sinks, args.select, args.adaptive, not args.no_coalesce)
+    return serve(engine, sinks, rates, args, lambda: f"Started {engine.check_count} checks")
+
+
+def coordinator_command(args):
+    """
+    Hand the configured servers out to agents and merge their results until SIGTERM or SIGINT is received.
+    Config changes and SIGHUP are handled as in run.
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    from distributed import Coordinator, parse_address
+
+    server_dict = load_server_dict(args.config)
+    sinks, rates = create_sinks(args, lambda: engine.server_dict)
+    engine = Coordinator(server_dict, sinks, parse_address(args.listen), args.replication, args.agent_timeout,
+                         args.select)
+    return serve(engine, sinks, rates, args, lambda: f"Listening for agents on {args.listen} with {engine.check_count} checks")
+
+
+def agent_command(args):
+    """
+    Run the checks a coordinator assigns until SIGTERM or SIGINT is received
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    from distributed import parse_address, run_agent
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    # Run in a thread so the main thread stays free to handle signals
+    agent = threading.Thread(target=run_agent, args=(parse_address(args.coordinator), args.name),
+                             kwargs={'heartbeat_interval': args.heartbeat_interval, 'stop_event': stop_event,
+                                     'adaptive': args.adaptive})
+    agent.start()
+    while agent.is_alive():
+        agent.join(0.5)
+    print("Agent stopped", file=sys.stderr)
+    return 0
+
+
+def report_rates(rates, server_dict):
+    """
+    Write the effective probe rate of every target to stderr, next to the rate its fixed interval would give
+    :param rates: RateSink counting the engine's results
+    :param server_dict: dictionary with server and service information the engine runs
+    :return: None
+    """
+    effective_total = fixed_total = 0
+    for (server, service), rate in sorted(rates.rates().items()):
+        params = server_dict.get(server, {}).get(service)
+        if not params:
+            continue
+        fixed = 60 / params['interval']
+        effective_total += rate
+        fixed_total += fixed
+        print(f"{service} {server}: {rate:.2f} probes/min (fixed interval {fixed:.2f})", file=sys.stderr)
+    print(f"Total: {effective_total:.2f} probes/min (fixed intervals {fixed_total:.2f})", file=sys.stderr)
+
+
+def report_coalescing(coalescer):
+    """
+    Write how many probes were saved by sharing the results of equivalent probes to stderr
+    :param coalescer: ProbeCoalescer of the engine
+    :return: None
+    """
+    stats = coalescer.stats()
+    print(f"Probes: {stats['executed']} sent, {stats['coalesced']} shared ({stats['saved']:.0%} saved), "
+          f"{stats['shared_keys']} probes shared by several checks", file=sys.stderr)
+
+
+def report_resolution():
+    """
+    Write how often the shared resolution cache answered name lookups to stderr
+    :return: None
+    """
+    import resolution
+
+    stats = resolution.cache.stats()
+    print(f"Name lookups: {stats['hits']} cached, {stats['misses']} resolved, {stats['negative_hits']} cached failures, "
+          f"{stats['coalesced']} joined a running lookup, {stats['refreshes']} refreshed ahead of expiry "
+          f"({stats['hit_rate']:.0%} answered from the cache, {stats['names']} names cached)", file=sys.stderr)
+
+
+def serve(engine, sinks, rates, args, describe):
+    """
+    Run an engine until SIGTERM or SIGINT is received, applying config changes and handling SIGHUP.
+    SIGUSR1 reports the effective probe rate of every target, and writes the profile when profiling.
+    :param engine: MonitorEngine, Supervisor or Coordinator
+    :param sinks: sinks the engine writes to, closed on exit
+    :param rates: RateSink among the sinks
+    :param args: parsed command line arguments
+    :param describe: returns a description of the started engine for the startup report
+    :return: exit status
+    """
+    import instrumentation
+    from monitor_engine import ConfigWatcher, MonitorEngine, missing_parents
+
+    shutdown = threading.Event()
+    warned = set()
+
+    def handle_shutdown(signum, frame):
+        shutdown.set()
+
+    def warn_missing_parents():
+        # Dependency groups are kept together across workers and agents, but a selector or a typo can still
+        # leave a parent out, and then suppression silently never triggers
+        for server, parent in missing_parents(engine.server_dict):
+            if (server, parent) not in warned:
+                warned.add((server, parent))
+                print(f"Warning: {server} depends on {parent}, which is not checked here, "
+                      f"so its checks are never suppressed", file=sys.stderr)
+
+    def report_reload(counts):
+        print(f"Reloaded {args.config}: {counts[0]} checks started, {counts[1]} stopped, {counts[2]} retuned",
+              file=sys.stderr)
+        warn_missing_parents()
+
+    def report_error(error):
+        print(f"Keeping current config, failed to reload {args.config}: {error}", file=sys.stderr)
+
+    def reopen_sinks():
+        for sink in sinks:
+            sink.reopen()
+
+    # Reloads, also the ones SIGHUP asks for, run in the watcher thread rather than in the signal handler,
+    # which could interrupt the main thread while it holds the engine lock
+    watcher = ConfigWatcher(args.config, engine, args.watch_interval, report_reload, report_error, reopen_sinks)
+
+    def handle_reload(signum, frame):
+        watcher.request_reload()
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, handle_reload)
+    def handle_report(signum, frame):
+        report_rates(rates, engine.server_dict)
+        if isinstance(engine, MonitorEngine) and engine.coalescer:
+            report_coalescing(engine.coalescer)
+        if isinstance(engine, MonitorEngine):
+            report_resolution()
+        if instrumentation.profiler:
+            instrumentation.profiler.dump(args.profile)
+            print(f"Profile written to {args.profile}", file=sys.stderr)
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, handle_report)
+
+    # Start monitoring right away
+    engine.start()
+    watcher.start()
+    print(f"{describe()} {(engine.started_at - LAUNCHED_AT) * 1000:.1f} ms after launch", file=sys.stderr)
+    warn_missing_parents()
+
+    try:
+        # Wake up periodically so signal handlers run promptly
+        reported = args.quiet_startup
+        while not shutdown.wait(0.5):
+            if not reported and engine.first_result_at is not None:
+                print(f"First check result {(engine.first_result_at - LAUNCHED_AT) * 1000:.1f} ms after launch",
+                      file=sys.stderr)
+                reported = True
+
+    finally:
+        watcher.stop()
+        engine.stop(timeout=5)
+        for sink in sinks:
+            sink.close()
+        if instrumentation.profiler:
+            instrumentation.disable().dump(args.profile)
+            print(f"Profile written to {args.profile}", file=sys.stderr)
+        print("Monitoring stopped", file=sys.stderr)
+
+    return 0
+
+
+def check_once(args):
+    """
+    Run every configured service once in parallel and write the results to stdout.
+    :param args: parsed command line arguments
+    :return: exit status, 1 if any check failed
+    """
+    import csv
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    import instrumentation
+    import resolution
+    from coalescing import ProbeCoalescer
+    from config_schema import get_services
+    from server_selector import select_server_dict
+
+    server_dict = select_server_dict(load_server_dict(args.config), args.select)
+    checks = [(server, service, params)
+              for server in server_dict for service, params in get_services(server_dict[server]).items()]
+
+    # Write results as soon as each check completes
+    if args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda result: print(json.dumps(result), flush=True)
+
+    if args.profile:
+        instrumentation.enable()
+
+    # Equivalent checks, e.g. DNS entries of several servers querying the same dns_server, are probed once
+    coalescer = ProbeCoalescer()
+    all_up = True
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = [executor.submit(coalescer.probe, *check) for check in checks]
+        for future in as_completed(futures):
+            result = future.result()
+            all_up = all_up and result['status']
+            write(result)
+
+    if coalescer.coalesced:
+        report_coalescing(coalescer)
+    if resolution.cache.stats()['names']:
+        report_resolution()
+    if instrumentation.profiler:
+        instrumentation.disable().dump(args.profile)
+    return 0 if all_up else 1
+
+
+def import_command(args):
+    """
+    Validate and merge servers from a csv, jsonl or yaml file into the config
+    :param args: parsed command line arguments
+    :return: exit status, 1 if any row was rejected
+    """
+    from bulk_io import import_servers
+
+    store = ConfigStore(args.config)
+    reports = []
+
+    def merge(server_dict):
+        report = import_servers(args.file, server_dict, args.format)
+        reports.append(report)
+        return not args.dry_run and bool(report.added or report.updated)
+
+    # Read, merge and write under one exclusive lock so concurrent imports and edits are not lost, with one
+    # atomic rewrite for the whole import rather than a journal entry per row
+    store.update(merge)
+    print(reports[0].summary())
+    return 1 if reports[0].rejected else 0
+
+
+def export_command(args):
+    """
+    Write every configured service to a csv, jsonl or yaml file, or stdout
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    from bulk_io import detect_format, export_servers
+
+    server_dict = load_server_dict(args.config)
+    if args.file == "-":
+        count = export_servers(server_dict, sys.stdout, args.format or "jsonl")
+    else:
+        with open(args.file, "w", newline="") as file:
+            count = export_servers(server_dict, file, detect_format(args.file, args.format))
+    print(f"Exported {count} services", file=sys.stderr)
+    return 0
+
+
+def infer_dependencies_command(args):
+    """
+    Propose depends_on entries from traceroute paths, and save them with --apply
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    from dependencies import infer_dependencies
+
+    store = ConfigStore(args.config)
+    server_dict = store.load()
+    parents = infer_dependencies(server_dict, args.max_hops)
+    for server, parent in sorted(parents.items()):
+        declared = server_dict[server].get('depends_on')
+        if declared:
+            print(f"{server} -> {parent} (keeping declared {', '.join(declared)})")
+            continue
+        print(f"{server} -> {parent}")
+        if args.apply:
+            store.set_server(server, {**server_dict[server], 'depends_on': [parent]})
+    print(f"Inferred parents for {len(parents)} of {len(server_dict)} servers", file=sys.stderr)
+    return 0
+
+
+def paths_command(args):
+    """
+    Summarize the traceroute path history: traces, distinct routes and route changes per target
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    from path_history import PathHistory
+
+    paths = PathHistory(args.history, keep=sys.maxsize)
+    summary = paths.summary()
+    paths.close()
+    for target, info in sorted(summary.items()):
+        if args.target and target != args.target:
+            continue
+        print(f"{target}: {info['traces']} traces, {info['routes']} routes, {info['route_changes']} route changes")
+        print(f"    current route: {' > '.join(info['current'])}")
+    return 0
+
+
+def stats_command(args):
+    """
+    Show a profile written by run or check-once with --profile, or convert it for flame graph tools
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    import instrumentation
+
+    with open(args.profile, "r") as file:
+        report = json.load(file)
+    if args.folded:
+        print("\n".join(instrumentation.folded_stacks(report)))
+    else:
+        print(instrumentation.format_report(report, args.top))
+    return 0
+
+
+def build_parser():
+    """
+    Build the command line parser for headless operation
+    :return: argument parser
+    """
+    # Options shared by several commands
+    config_options = argparse.ArgumentParser(add_help=False)
+    config_options.add_argument("--config", default="server_dict.json", help="Path to server config json file")
+
+    select_options = argparse.ArgumentParser(add_help=False)
+    select_options.add_argument("--select", type=parse_selector,
+                                help="Only run matching checks, e.g. env=prod,proto=HTTPS (keys: proto, port, server, "
+                                     "any tag)")
+
+    monitor_options = argparse.ArgumentParser(add_help=False)
+    monitor_options.add_argument("--sink", action="append",
+                                 help="Result sink: stdout, text:<path>, jsonl:<path> or async-text/async-jsonl:<path>"
+                                      "[?max_mb=&every=&keep=&gzip=] (repeatable, default stdout)")
+    monitor_options.add_argument("--path-history",
+                                 help="Record ICMP traceroutes in this file and report route changes and latency "
+                                      "shifts")
+    monitor_options.add_argument("--alert", action="append",
+                                 help="Alert channel for state changes (repeatable): webhook:<url>, file:<path>, "
+                                      "syslog or syslog:<host>:<port>")
+    monitor_options.add_argument("--confirm", type=parse_confirmation, default=(2, 3),
+                                 help="N/M: N of the last M results must agree before the state changes (default 2/3)")
+    monitor_options.add_argument("--watch-interval", type=float, default=2,
+                                 help="Seconds between checks of the config file for changes (0 disables)")
+    monitor_options.add_argument("--quiet-startup", action="store_true", help="Do not report time to first result")
+
+    parser = argparse.ArgumentParser(prog="netcam", description="Headless NetCam network monitoring")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Monitor all configured servers until stopped",
+                                       parents=[config_options, select_options, monitor_options])
+    run_parser.add_argument("--workers", type=int, default=1,
+                            help="Worker processes to shard the servers across (default 1, in-process)")
+    run_parser.add_argument("--adaptive", action="store_true",
+                            help="Back off healthy checks toward max_interval and re-probe state changes quickly, "
+                                 "for services that do not set 'adaptive' themselves")
+    run_parser.add_argument("--no-coalesce", action="store_true",
+                            help="Probe every check separately, even when several checks send the same probe")
+    run_parser.add_argument("--profile",
+                            help="Time probes, socket calls, lock waits and scheduler lag and write them to this file "
+                                 "on SIGUSR1 and exit (in-process checks only, not with --workers)")
+    run_parser.add_argument("--dns-ttl", action="store_true",
+                            help="Cache resolved names for their DNS TTL, read with dnspython in the background at the "
+                                 "cost of extra DNS queries, instead of for 60 seconds (in-process checks only)")
+    run_parser.set_defaults(func=run)
+
+    once_parser = subparsers.add_parser("check-once", help="Run every configured check once and exit",
+                                        parents=[config_options, select_options])
+    once_parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="Output format")
+    once_parser.add_argument("--concurrency", type=int, default=32, help="Maximum checks running at once")
+    once_parser.add_argument("--profile", help="Time probes and socket calls and write them to this file")
+    once_parser.set_defaults(func=check_once)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="Spread the configured servers across agents",
+                                               parents=[config_options, select_options, monitor_options])
+    coordinator_parser.add_argument("--listen", default="127.0.0.1:9700",
+                                    help="Address agents connect to (host:port, default 127.0.0.1:9700). Agents "
+                                         "are not authenticated, only listen on other addresses on trusted networks")
+    coordinator_parser.add_argument("--replication", type=int, default=1,
+                                    help="Agents checking each server, more than 1 compares vantage points (default 1)")
+    coordinator_parser.add_argument("--agent-timeout", type=float, default=15,
+                                    help="Seconds without a heartbeat before an agent's servers are reassigned")
+    coordinator_parser.set_defaults(func=coordinator_command, profile=None)
+
+    agent_parser = subparsers.add_parser("agent", help="Run the checks assigned by a coordinator")
+    agent_parser.add_argument("--coordinator", required=True, help="Coordinator address (host:port)")
+    agent_parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}",
+                              help="Vantage point name reported with results (default hostname-pid)")
+    agent_parser.add_argument("--heartbeat-interval", type=float, default=5, help="Seconds between heartbeats")
+    agent_parser.add_argument("--adaptive", action="store_true",
+                              help="Use adaptive intervals for services that do not set 'adaptive' themselves")
+    agent_parser.set_defaults(func=agent_command)
+
+    infer_parser = subparsers.add_parser("infer-deps", help="Propose server dependencies from traceroute paths",
+                                         parents=[config_options])
+    infer_parser.add_argument("--max-hops", type=int, default=30, help="Maximum hops to trace per server")
+    infer_parser.add_argument("--apply", action="store_true",
+                              help="Save the inferred parents of servers that do not declare depends_on")
+    infer_parser.set_defaults(func=infer_dependencies_command)
+
+    paths_parser = subparsers.add_parser("paths", help="Summarize the traceroute path history")
+    paths_parser.add_argument("target", nargs="?", help="Only show this server")
+    paths_parser.add_argument("--history", default="path_history.jsonl", help="Path history file")
+    paths_parser.set_defaults(func=paths_command)
+
+    stats_parser = subparsers.add_parser("stats", help="Show a profile written with --profile")
+    stats_parser.add_argument("profile", help="Profile file")
+    stats_parser.add_argument("--top", type=int, default=25, help="Slowest call stacks to show (default 25)")
+    stats_parser.add_argument("--folded", action="store_true",
+                              help="Print folded stacks for flamegraph.pl or speedscope instead")
+    stats_parser.set_defaults(func=stats_command)
+
+    import_parser = subparsers.add_parser("import", help="Merge servers from a csv, jsonl or yaml file",
+                                          parents=[config_options])
+    import_parser.add_argument("file", help="File to import")
+    import_parser.add_argument("--format", choices=FILE_FORMATS, help="File format (default from extension)")
+    import_parser.add_argument("--dry-run", action="store_true", help="Validate and report without saving")
+    import_parser.set_defaults(func=import_command)
+
+    export_parser = subparsers.add_parser("export", help="Write all servers to a csv, jsonl or yaml file",
+                                          parents=[config_options])
+    export_parser.add_argument("file", help="File to write, or - for stdout")
+    export_parser.add_argument("--format", choices=FILE_FORMATS, help="File format (default from extension)")
+    export_parser.set_defaults(func=export_command)
+
+    return parser
+
+def main(argv=None):
+    """
+    Entry point for headless operation
+    :param argv: command line arguments, defaults to sys.argv
+    :return: exit status
+    """
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
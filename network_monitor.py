@@ -1,10 +1,24 @@
 import sys
-from prompt_toolkit import prompt
-from prompt_toolkit.patch_stdout import patch_stdout
+import instrumentation
+from config_schema import get_services, parse_tags
+from dashboard import DashboardState, run_dashboard
+from monitor_engine import MonitorEngine
+from path_history import PathHistory
+from server_registry import ServerRegistry
+from server_selector import parse_selector, resolve_selector
 from prompts import *
 from service_checks import *
 
 
+def prompt(*args, **kwargs):
+    """
+    Prompt the user with prompt_toolkit, which is only imported once the first prompt is shown
+    :return: user's input
+    """
+    from prompt_toolkit import prompt as toolkit_prompt
+    return toolkit_prompt(*args, **kwargs)
+
+
 def show_commands():
     """
     Show available primary commands
@@ -18,7 +32,9 @@ def show_commands():
     │   delete-server   Delete an existing server   │
     │   show-servers    Show config of all servers  │
     │   monitor-server  Monitor a single server     │
+    │   monitor-group   Monitor servers by selector │
     │   monitor-all     Monitor all servers         │
+    │   stats           Show profiling statistics   │
     │   exit            Exit the application        │
     └───────────────────────────────────────────────┘
     """)
@@ -35,6 +51,7 @@ def show_edit_commands():
     │   add-service     Add a new service to this server           │
     │   edit-service    Edit an existing service for this server   │
     │   delete-service  Delete an existing service for this server │
+    │   edit-tags       Set the tags of this server                │
     └──────────────────────────────────────────────────────────────┘
     """)
 
@@ -50,7 +67,7 @@ def show_services():
     │                                  │
     │   ICMP  HTTP  HTTPS  LOCAL TCP   │
     │                                  │
-    │   NTP   DNS   TCP    UDP         │
+    │   NTP   DNS   TCP    UDP   TLS   │
     │                                  │
     └──────────────────────────────────┘
     """)
@@ -75,18 +92,57 @@ def show_record_types():
     """)
 
 
-def show_server_configs(server_dict):
+def show_server_configs(registry, page_size=20, paged=True):
     """
     Show current servers and services they are
-    registered to monitor.
+    registered to monitor, one page at a time.
+    :param registry: ServerRegistry of the configured servers
+    :param page_size: servers shown per page
+    :param paged: ask before showing each further page, otherwise only show the first page
     :return: None
     """
-    for server in server_dict:
-        print(f"\nServer: {server}")
-        print(f"Services: {', '.join(server_dict[server].keys())}")
-
-
-def initialize_threads(server_dict, server, lock, event, thread_list):
+    number = 0
+    while True:
+        for server in registry.page(number, page_size):
+            print(f"\nServer: {server}")
+            print(f"Services: {', '.join(get_services(registry.server_dict[server]))}")
+
+        # Stop at the last page
+        remaining = len(registry) - (number + 1) * page_size
+        if remaining <= 0:
+            break
+        if not paged:
+            print(f"\n... and {remaining} more servers")
+            break
+        if prompt(f"\n{remaining} more servers, press enter to show more or q to stop: ").lower() == "q":
+            break
+        number += 1
+
+
+def set_server_tags(server_dict, server):
+    """
+    Prompt for the tags of a server, e.g. env=prod,team=network
+    :param server_dict: dictionary with server and service information
+    :param server: server to tag
+    :return: None
+    """
+    while True:
+        current = ','.join(f"{key}={value}" for key, value in server_dict[server].get('tags', {}).items())
+        text = prompt("Tags (key=value, comma separated, enter for none): ", default=current)
+        try:
+            tags = parse_tags(text)
+            break
+        except ValueError as e:
+            print(e)
+
+    # Set or clear tags
+    if tags:
+        server_dict[server]['tags'] = tags
+    else:
+        server_dict[server].pop('tags', None)
+
+
+def initialize_threads(server_dict, server, lock, event, thread_list, protocols=None, paths=None):
     """
     Initializes necessary threads for the service checks of a particular server
     :param server_dict: dictionary with server and service information
@@ -94,6 +150,8 @@ def initialize_threads(server_dict, server, lock, event, thread_list):
     :param lock: thread lock to prevent overlapping output
     :param event: event to trigger killing thread
     :param thread_list: list of currently running threads
+    :param protocols: protocols to start, defaults to every service of the server
+    :param paths: PathHistory the icmp checks record their traces in
     :return: None
     """
     # Map protocols to their service checks
@@ -101,6 +159,7 @@ def initialize_threads(server_dict, server, lock, event, thread_list):
         'ICMP': icmp_service_check,
         'HTTP': http_service_check,
         'HTTPS': https_service_check,
+        'TLS': tls_service_check,
         'NTP': ntp_service_check,
         'DNS': dns_service_check,
         'TCP': tcp_service_check,
@@ -109,11 +168,13 @@ def initialize_threads(server_dict, server, lock, event, thread_list):
     }
 
     # Get protocols for server
-    protocols = server_dict[server].keys()
+    protocols = protocols or get_services(server_dict[server]).keys()
 
     # Start service check threads and add them to list
     for protocol in protocols:
-        thread = threading.Thread(target=service_check_map[protocol], args=(server_dict, server, lock, event))
+        kwargs = {'paths': paths} if protocol == 'ICMP' else {}
+        thread = threading.Thread(target=service_check_map[protocol], args=(server_dict, server, lock, event),
+                                  kwargs=kwargs)
         thread.start()
         thread_list.append(thread)
 
@@ -138,7 +199,7 @@ def set_service_params(server_dict, server, service):
             'timeout': 1,
             'sequence_number': 1,
             'max_hops': 30,
-            'pings_per_hops': 1,
+            'pings_per_hop': 1,
             'verbose': False,
             'interval': interval
         }
@@ -159,7 +220,7 @@ def set_service_params(server_dict, server, service):
             server_dict[server][service]['sequence_number'] = int(sequence_number) if sequence_number else 1
             server_dict[server][service]['max_hops'] = int(max_hops) if max_hops else 30
             server_dict[server][service]['pings_per_hop'] = int(pings_per_hop) if pings_per_hop else 1
-            server_dict[server][service]['verbose'] = verbose if verbose else False
+            server_dict[server][service]['verbose'] = verbose.lower() == 'true'
 
     # Get/set http specific parameters
     elif service == "HTTP":
@@ -185,6 +246,29 @@ def set_service_params(server_dict, server, service):
             # Set optional param
             server_dict[server][service]['timeout'] = int(timeout) if timeout else 5
 
+    # Get/set tls specific parameters
+    elif service == "TLS":
+        print("\nPlease enter the requested parameters: ")
+        interval = int(prompt("Test Interval (secs): "))
+
+        # Add service to dict
+        server_dict[server][service] = {'port': 443, 'timeout': 5, 'expiry_days': 7, 'resume': True,
+                                        'interval': interval}
+
+        # Inquire about optional params
+        if prompt("\nWould you like to set optional parameters? (y/n): ") == 'y':
+            print("\nPlease enter the optional parameters (press enter for defaults): ")
+            port = prompt("Target Port (Default = 443): ")
+            timeout = prompt("Timeout of Handshake (secs) (Default = 5): ")
+            expiry_days = prompt("Fail When Certificate Expires Within (days) (Default = 7): ")
+            resume = prompt("Resume TLS Sessions (True/False) (Default = True): ")
+
+            # Set optional params
+            server_dict[server][service]['port'] = int(port) if port else 443
+            server_dict[server][service]['timeout'] = int(timeout) if timeout else 5
+            server_dict[server][service]['expiry_days'] = int(expiry_days) if expiry_days else 7
+            server_dict[server][service]['resume'] = resume.lower() != 'false'
+
     # Get/set ntp specific parameters
     elif service == "NTP":
         print("\nPlease enter the requested parameters: ")
@@ -268,8 +352,10 @@ def main() -> None:
     start_string = "Press enter to begin ..."
     print(start_string.center(columns - 1))
 
-    # Sleep to prevent auto enter
-    time.sleep(1)
+    # Load prompt_toolkit during the sleep that prevents auto enter
+    load_start = time.perf_counter()
+    from prompt_toolkit.patch_stdout import patch_stdout
+    time.sleep(max(0.0, 1 - (time.perf_counter() - load_start)))
 
     # Start program upon keypress
     if prompt("") == "":
@@ -280,6 +366,18 @@ def main() -> None:
         # Start the main loop
         is_running: bool = True
 
+    # Indexed copy of the server dict, loaded once and written through to the config store
+    registry = ServerRegistry()
+    registry.load()
+
+    # Traceroute history shared by every icmp check, for route change detection
+    paths = PathHistory("path_history.jsonl")
+
+    # Opt-in profiling of the checks, written to the given file on exit
+    profile_path = os.environ.get("NETCAM_PROFILE")
+    if profile_path:
+        instrumentation.enable()
+
     try:
         with patch_stdout():
             while is_running:
@@ -290,9 +388,9 @@ def main() -> None:
                 show_commands()
                 command: str = home_command_prompt("Enter command: ")
 
-                # Get server dict from json file
-                with open("server_dict.json", "r") as file:
-                    server_dict = json.loads(file.read())
+                # Pick up changes made by other instances
+                registry.refresh()
+                server_dict = registry.server_dict
 
                 if command == "add-server":
 
@@ -325,12 +423,15 @@ def main() -> None:
                             # Stop loop and print separator
                             adding_services = False
 
+                            # Tag the server so it can be selected with monitor-group
+                            print("\nTag this server to monitor it as part of a group (optional)")
+                            set_server_tags(server_dict, server)
+
                             # Clear terminal
                             os.system('cls') if sys.platform.startswith('win') else os.system('clear')
 
-                            # Persist server dict to JSON file
-                            with open('server_dict.json', 'w') as file:
-                                file.write(json.dumps(server_dict))
+                            # Persist server to the registry and config store
+                            registry.set_server(server, server_dict[server])
 
                 elif command == "edit-server" and len(server_dict) > 0:
 
@@ -338,10 +439,10 @@ def main() -> None:
                     print("\nWhat server would you like to edit?")
 
                     # Show current server configs
-                    show_server_configs(server_dict)
+                    show_server_configs(registry)
 
                     # Prompt for server and validate
-                    server: str = server_prompt("\nServer: ")
+                    server: str = server_prompt("\nServer: ", registry)
                     print(f"Great! You are now editing the server {server} ...")
 
                     # Provide selection between adding, editing, and deleting a service
@@ -373,9 +474,8 @@ def main() -> None:
                                 # Clear terminal
                                 os.system('cls') if sys.platform.startswith('win') else os.system('clear')
 
-                                # Persist server dict to JSON file
-                                with open('server_dict.json', 'w') as file:
-                                    file.write(json.dumps(server_dict))
+                                # Persist server to the registry and config store
+                                registry.set_server(server, server_dict[server])
 
                     elif command == "edit-service":
 
@@ -386,7 +486,7 @@ def main() -> None:
                             print(f"\nWhat service would you like to edit?")
 
                             # Get and validate service
-                            print(f"Services: {', '.join(server_dict[server].keys())}")
+                            print(f"Services: {', '.join(get_services(server_dict[server]))}")
                             service: str = service_prompt("\nService: ").upper()
 
                             # Add new service to given server
@@ -401,9 +501,8 @@ def main() -> None:
                                 # Clear terminal
                                 os.system('cls') if sys.platform.startswith('win') else os.system('clear')
 
-                                # Persist server dict to JSON file
-                                with open('server_dict.json', 'w') as file:
-                                    file.write(json.dumps(server_dict))
+                                # Persist server to the registry and config store
+                                registry.set_server(server, server_dict[server])
 
                     elif command == "delete-service":
 
@@ -414,7 +513,7 @@ def main() -> None:
                             print(f"\nWhat service would you like to delete?")
 
                             # Get and validate service
-                            print(f"Services: {', '.join(server_dict[server].keys())}")
+                            print(f"Services: {', '.join(get_services(server_dict[server]))}")
                             service: str = service_prompt("Service: ").upper()
 
                             # Delete service
@@ -428,9 +527,15 @@ def main() -> None:
                                 # Clear terminal
                                 os.system('cls') if sys.platform.startswith('win') else os.system('clear')
 
-                                # Persist server dict to JSON file
-                                with open('server_dict.json', 'w') as file:
-                                    file.write(json.dumps(server_dict))
+                                # Persist server to the registry and config store
+                                registry.set_server(server, server_dict[server])
+
+                    elif command == "edit-tags":
+
+                        # Set tags and persist
+                        set_server_tags(server_dict, server)
+                        registry.set_server(server, server_dict[server])
+                        print(f"\nSuccessfully updated the tags of {server}!")
 
                 elif command == "delete-server" and len(server_dict) > 0:
 
@@ -441,11 +546,11 @@ def main() -> None:
                         print(f"\nWhat server would you like to delete?")
 
                         # Get and validate service
-                        show_server_configs(server_dict)
-                        server: str = server_prompt("\nServer: ")
+                        show_server_configs(registry)
+                        server: str = server_prompt("\nServer: ", registry)
 
-                        # Delete server
-                        del server_dict[server]
+                        # Delete server from the registry and config store
+                        registry.delete_server(server)
 
                         # Success message
                         print(f"\nSuccessfully deleted {server} from server list!")
@@ -458,17 +563,13 @@ def main() -> None:
                             # Clear terminal
                             os.system('cls') if sys.platform.startswith('win') else os.system('clear')
 
-                            # Persist server dict to JSON file
-                            with open('server_dict.json', 'w') as file:
-                                file.write(json.dumps(server_dict))
-
                 elif command == "edit-server" or command == "delete-server" and len(server_dict) == 0:
                     print("There are no servers to edit or delete!\n")
 
                 elif command == "show-servers":
 
                     # Show the server configs
-                    show_server_configs(server_dict)
+                    show_server_configs(registry)
 
                     # Go back home when user presses enter
                     if prompt("\nPress enter to go back to home: ") == "":
@@ -482,17 +583,18 @@ def main() -> None:
                     print("\nWhat server would you like to monitor?")
 
                     # Show current server configs
-                    show_server_configs(server_dict)
+                    show_server_configs(registry)
 
                     # Prompt for server and validate
-                    server: str = server_prompt("\nServer: ")
+                    server: str = server_prompt("\nServer: ", registry)
 
                     # Event, lock and list to stop, prioritize, and track threads
-                    event, lock = threading.Event(), threading.Lock()
+                    event = instrumentation.instrument_event(threading.Event())
+                    lock = instrumentation.instrument_lock(threading.Lock())
                     thread_list = []
 
                     # Initialize proper threads for service checks of the current server
-                    initialize_threads(server_dict, server, lock, event, thread_list)
+                    initialize_threads(server_dict, server, lock, event, thread_list, paths=paths)
 
                     # Quit service checks when user presses enter
                     if prompt("\nPress enter to quit monitoring: ") == "":
@@ -505,20 +607,33 @@ def main() -> None:
                         # Print divider
                         print("\n" + "=" * columns + "\n")
 
-                elif command == "monitor-all":
-
-                    # List servers prior to beginning monitor
-                    show_server_configs(server_dict)
+                elif command == "monitor-group":
+
+                    # Ask which checks to monitor
+                    print("\nWhich servers would you like to monitor?")
+                    print("Enter a selector such as env=prod,proto=HTTPS (keys: proto, port, server, or any tag)")
+                    try:
+                        selector = parse_selector(prompt("Selector: "))
+                    except ValueError as e:
+                        print(f"{e}\n")
+                        continue
+
+                    # Resolve selector through the registry indexes
+                    matches = resolve_selector(registry, selector)
+                    if not matches:
+                        print("No servers match that selector!\n")
+                        continue
+                    print(f"\nMonitoring {sum(len(services) for services in matches.values())} checks "
+                          f"on {len(matches)} servers ...")
 
                     # Event, lock and list to stop, prioritize, and track threads
-                    event, lock = threading.Event(), threading.Lock()
+                    event = instrumentation.instrument_event(threading.Event())
+                    lock = instrumentation.instrument_lock(threading.Lock())
                     thread_list = []
 
-                    # Start service_checks for all services
-                    for server in server_dict:
-
-                        # Initialize proper threads for service checks of current server
-                        initialize_threads(server_dict, server, lock, event, thread_list)
+                    # Start only the matching service checks
+                    for server, protocols in matches.items():
+                        initialize_threads(server_dict, server, lock, event, thread_list, protocols, paths)
 
                     # Quit service checks when user presses enter
                     if prompt("\nPress enter to quit monitoring: ") == "":
@@ -531,10 +646,35 @@ def main() -> None:
                         # Print divider
                         print("\n" + "=" * columns + "\n")
 
+                elif command == "monitor-all":
+
+                    # Live table of every check, fed by the engine instead of interleaved prints
+                    state = DashboardState()
+                    for server in server_dict:
+                        for service in get_services(server_dict[server]):
+                            state.add_check(server, service)
+                    engine = MonitorEngine(server_dict, [state, paths])
+                    engine.start()
+
+                    # Quit service checks when user presses q or enter
+                    try:
+                        run_dashboard(state, "NetCam monitor-all")
+                    finally:
+                        engine.stop(timeout=5)
+
+                elif command == "stats":
+                    if instrumentation.profiler:
+                        print(instrumentation.format_report(instrumentation.profiler.report()) + "\n")
+                    else:
+                        print("Profiling is off, start NetCam with NETCAM_PROFILE=<file> to turn it on\n")
+
                 elif command == "exit":
                     is_running = False
 
     finally:
+        paths.close()
+        if instrumentation.profiler:
+            instrumentation.disable().dump(profile_path)
         print("\nThank you for using NetCam! Goodbye.")
 
 
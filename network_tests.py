@@ -2,8 +2,17 @@
 # pip install requests
 # pip install ntplib
 # pip install dnspython
+# pip install lorem
+#
+# These are imported inside the probes that use them, so a protocol's library is only
+# loaded the first time that protocol is checked. This keeps startup fast for one-shot
+# runs and for configs that only use a few protocols.
+import calendar
+import errno
+import hashlib
 import os
 import random
+import select
 import socket
 import string
 import struct
@@ -12,12 +21,8 @@ import time
 import zlib
 from socket import gaierror
 from time import ctime
-from typing import Tuple, Optional, Any
-import dns.resolver
-import dns.exception
-import lorem
-import ntplib
-import requests
+from typing import Tuple, Optional, Any, List
+import resolution
 
 
 def calculate_icmp_checksum(data: bytes) -> int:
@@ -89,13 +94,13 @@ def create_icmp_packet(icmp_type: int = 8, icmp_code: int = 0, sequence_number:
     icmp_id = zlib.crc32(f"{thread_id}{process_id}".encode()) & 0xffff
 
     # Pack the ICMP header fields into a bytes object.
-    # 'bbHHh' is the format string for struct.pack, which means:
-    # b - signed char (1 byte) for ICMP type
-    # b - signed char (1 byte) for ICMP code
+    # 'BBHHh' is the format string for struct.pack, which means:
+    # B - unsigned char (1 byte) for ICMP type, unsigned so that ICMPv6 types (128 and up) fit
+    # B - unsigned char (1 byte) for ICMP code
     # H - unsigned short (2 bytes) for checksum, initially set to 0
     # H - unsigned short (2 bytes) for ICMP identifier
     # h - short (2 bytes) for sequence number
-    header: bytes = struct.pack('bbHHh', icmp_type, icmp_code, 0, icmp_id, sequence_number)
+    header: bytes = struct.pack('BBHHh', icmp_type, icmp_code, 0, icmp_id, sequence_number)
 
     # Create the data payload for the ICMP packet.
     # It's a sequence of a single randomly chosen alphanumeric character (uppercase or lowercase),
@@ -108,76 +113,454 @@ def create_icmp_packet(icmp_type: int = 8, icmp_code: int = 0, sequence_number:
 
     # Repack the header with the correct checksum.
     # socket.htons ensures the checksum is in network byte order.
-    header = struct.pack('bbHHh', icmp_type, icmp_code, socket.htons(chksum), icmp_id, sequence_number)
+    header = struct.pack('BBHHh', icmp_type, icmp_code, socket.htons(chksum), icmp_id, sequence_number)
 
     # Return the complete ICMP packet by concatenating the header and data.
     return header + data
 
 
-def ping(host: str, ttl: int = 64, timeout: int = 1, sequence_number: int = 1) -> Tuple[Any, float] | Tuple[Any, None]:
+# Linux socket options that queue ICMP errors (e.g. time exceeded) for reading with MSG_ERRQUEUE
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+IPV6_RECVERR = getattr(socket, 'IPV6_RECVERR', 25)
+
+# Origin of a queued error that came from an ICMP or ICMPv6 message, see sock_extended_err in linux/errqueue.h
+SO_EE_ORIGIN_ICMP = 2
+SO_EE_ORIGIN_ICMP6 = 3
+
+# ICMP message types handled when matching replies
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACHABLE = 3
+ICMP_TIME_EXCEEDED = 11
+
+# ICMPv6 uses its own numbers for the same messages (RFC 4443)
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+ICMPV6_DEST_UNREACHABLE = 1
+ICMPV6_TIME_EXCEEDED = 3
+
+# Size of the IPv6 header quoted by ICMPv6 errors, which unlike IPv4 has no length field of its own
+IPV6_HEADER_SIZE = 40
+
+# Ports tried by the TCP ping fallback; a refused connection proves the host is up just as well
+TCP_PING_PORTS = (443, 80)
+
+# Names of the address families in probe descriptions
+FAMILY_NAMES = {socket.AF_INET: "IPv4", socket.AF_INET6: "IPv6"}
+
+# ICMP socket type that worked last for each address family, tried first: SOCK_DGRAM or SOCK_RAW
+icmp_socket_types = {}
+
+
+def resolve_addresses(host: str, port: Optional[int] = None, family: int = socket.AF_UNSPEC) -> List[Tuple[int, tuple]]:
+    """
+    Resolve a host name or address literal to its IPv4 and IPv6 addresses.
+
+    Args:
+    host (str): The IP address (IPv4 or IPv6) or hostname to resolve.
+    port (int): Port to put in the socket addresses, None for 0.
+    family (int): AF_INET or AF_INET6 to only resolve one family, AF_UNSPEC for both.
+
+    Returns:
+    list: One (address family, socket address) tuple per address, in the order the system prefers them
+          (RFC 6724, normally IPv6 first where it is routable). The socket address can be passed to connect or sendto.
+
+    Raises:
+    socket.gaierror: If the host does not resolve.
+
+    Description:
+    Names are resolved through the process-wide cache in resolution.py, so every probe of the same host shares one
+    lookup per TTL instead of resolving it again on every check.
+    """
+    return resolution.cache.resolve(host, port, family)
+
+
+def open_connection(host: str, port: int, timeout: float = 3) -> socket.socket:
+    """
+    Connect to a TCP port, trying each resolved address of the host in turn like socket.create_connection.
+
+    Args:
+    host (str): The IP address (IPv4 or IPv6) or hostname of the target host.
+    port (int): The TCP port to connect to.
+    timeout (float): The timeout of each connection attempt, which stays set on the returned socket.
+
+    Returns:
+    socket.socket: The connected socket.
+
+    Raises:
+    OSError: The error of the last address tried, or socket.gaierror if the host does not resolve.
+    """
+    error = None
+    for family, address in resolve_addresses(host, port):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error
+
+
+def hop_limit_option(family: int) -> Tuple[int, int]:
+    """
+    Socket option limiting the hops of outgoing packets: the TTL for IPv4, the hop limit for IPv6.
+
+    Args:
+    family (int): AF_INET or AF_INET6.
+
+    Returns:
+    tuple: The level and option to pass to setsockopt.
+    """
+    if family == socket.AF_INET6:
+        return socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS
+    return socket.IPPROTO_IP, socket.IP_TTL
+
+
+def enable_error_queue(sock: socket.socket) -> None:
+    """
+    Queue the ICMP errors a socket receives for reading with read_error_queue, where the system supports it.
+
+    Args:
+    sock (socket.socket): An IPv4 or IPv6 socket.
+    """
+    try:
+        if sock.family == socket.AF_INET6:
+            sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+    except OSError:
+        pass
+
+
+def open_icmp_socket(family: int = socket.AF_INET) -> Optional[socket.socket]:
+    """
+    Open an ICMP (or ICMPv6) socket, preferring an unprivileged ping socket over a raw one.
+
+    Args:
+    family (int): AF_INET for ICMP, AF_INET6 for ICMPv6.
+
+    Returns:
+    socket.socket | None: The socket, or None if the system allows neither kind to this process.
+
+    Description:
+    Linux lets the groups in net.ipv4.ping_group_range open SOCK_DGRAM ICMP sockets without root, for both address
+    families. The kernel assigns the ICMP identifier and only delivers the replies to this socket's own requests, so
+    concurrent pings never see each other's replies. Raw sockets need root (or CAP_NET_RAW) and receive every ICMP
+    packet on the host.
+    """
+    protocol = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    kinds = [socket.SOCK_DGRAM, socket.SOCK_RAW]
+    if icmp_socket_types.get(family) in kinds:
+        kinds.remove(icmp_socket_types[family])
+        kinds.insert(0, icmp_socket_types[family])
+
+    for kind in kinds:
+        try:
+            sock = socket.socket(family, kind, protocol)
+        except OSError:
+            continue
+        icmp_socket_types[family] = kind
+        return sock
+    icmp_socket_types.pop(family, None)
+    return None
+
+
+def read_error_queue(sock: socket.socket) -> Tuple[Optional[int], Optional[str], bytes]:
+    """
+    Read one ICMP or ICMPv6 error queued on a socket set up with enable_error_queue.
+
+    Args:
+    sock (socket.socket): An IPv4 or IPv6 socket with its error queue enabled.
+
+    Returns:
+    tuple: The ICMP type of the error and the address of the router or host that sent it, both None if no ICMP
+           error is queued, and the start of the packet that caused it.
+    """
+    # Only Linux has an error queue
+    if not hasattr(socket, 'MSG_ERRQUEUE'):
+        return None, None, b""
+
+    try:
+        data, ancillary, flags, _ = sock.recvmsg(512, 512, socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT)
+    except (BlockingIOError, InterruptedError):
+        return None, None, b""
+
+    for level, kind, payload in ancillary:
+        if len(payload) < 16:
+            continue
+        # struct sock_extended_err (errno, origin, type, code, pad, info, data), then the sender's socket address
+        ee_errno, origin, icmp_type, code, pad, info, ee_data = struct.unpack('IBBBBII', payload[:16])
+        if level == socket.IPPROTO_IP and kind == IP_RECVERR and origin == SO_EE_ORIGIN_ICMP and len(payload) >= 24:
+            # sockaddr_in: family, port, then the IPv4 address
+            return icmp_type, socket.inet_ntop(socket.AF_INET, payload[20:24]), data
+        if level == socket.IPPROTO_IPV6 and kind == IPV6_RECVERR and origin == SO_EE_ORIGIN_ICMP6 and len(payload) >= 40:
+            # sockaddr_in6: family, port, flow info, then the IPv6 address
+            return icmp_type, socket.inet_ntop(socket.AF_INET6, payload[24:40]), data
+    return None, None, data
+
+
+def match_icmp_reply(data: bytes, raw: bool, icmp_id: int, sequence_number: int, family: int = socket.AF_INET) -> bool:
+    """
+    Check whether an ICMP packet answers the Echo Request with the given identifier and sequence number.
+
+    Args:
+    data (bytes): The received packet. IPv4 raw sockets (and ping sockets on some systems) include the IP header,
+                  IPv6 sockets never include it.
+    raw (bool): True for raw sockets, where the identifier has to be checked as well since every ICMP packet on
+                the host is received. Ping sockets are filtered by the kernel.
+    icmp_id (int): Identifier of the request.
+    sequence_number (int): Sequence number of the request.
+    family (int): AF_INET for ICMP, AF_INET6 for ICMPv6.
+
+    Returns:
+    bool: True for an Echo Reply to the request, or a Time Exceeded or Destination Unreachable message quoting it.
+    """
+    if family == socket.AF_INET6:
+        echo_reply, errors = ICMPV6_ECHO_REPLY, (ICMPV6_TIME_EXCEEDED, ICMPV6_DEST_UNREACHABLE)
+    else:
+        echo_reply, errors = ICMP_ECHO_REPLY, (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE)
+        # Skip the IP header if there is one, ICMP types never start with the IPv4 version nibble
+        if data and data[0] >> 4 == 4:
+            data = data[(data[0] & 0x0f) * 4:]
+    if len(data) < 8:
+        return False
+
+    icmp_type = data[0]
+    if icmp_type in errors:
+        # The error quotes the IP header and (at least) the first 8 bytes of the request that caused it
+        quoted = data[8:]
+        if family == socket.AF_INET6:
+            data = quoted[IPV6_HEADER_SIZE:]
+        elif len(quoted) >= 20:
+            data = quoted[(quoted[0] & 0x0f) * 4:]
+        else:
+            return False
+        if len(data) < 8:
+            return False
+    elif icmp_type != echo_reply:
+        return False
+
+    _, _, _, reply_id, reply_sequence = struct.unpack('BBHHh', data[:8])
+    return reply_sequence == sequence_number and (not raw or reply_id == icmp_id)
+
+
+def ping(host: str, ttl: int = 64, timeout: int = 1, sequence_number: int = 1, family: int = socket.AF_UNSPEC) -> Tuple[Any, float] | Tuple[Any, None]:
     """
     Send an ICMP Echo Request to a specified host and measure the round-trip time.
 
-    This function creates a raw socket to send an ICMP Echo Request packet to the given host.
-    It then waits for an Echo Reply, measuring the time taken for the round trip. If the
+    This function sends an ICMP Echo Request packet (ICMPv6 for IPv6 hosts) to the given host over an unprivileged
+    ping socket where the system allows one, or a raw socket otherwise, and waits for the matching Echo Reply (or,
+    when the TTL runs out, the Time Exceeded message of the router that dropped it), measuring the time taken for the
+    round trip. Without permission for either socket it falls back to timing a TCP connection, see tcp_ping. If the
     specified timeout is exceeded before receiving a reply, the function returns None for the ping time.
 
     Args:
-    host (str): The IP address or hostname of the target host.
-    ttl (int): Time-To-Live for the ICMP packet. Determines how many hops (routers) the packet can pass through.
+    host (str): The IP address (IPv4 or IPv6) or hostname of the target host.
+    ttl (int): Time-To-Live (hop limit for IPv6) for the ICMP packet. Determines how many hops (routers) the packet can pass through.
     timeout (int): The time in seconds that the function will wait for a reply before giving up.
     sequence_number (int): The sequence number for the ICMP packet. Useful for matching requests with replies.
+    family (int): AF_INET or AF_INET6 to ping a dual-stack host over one family, AF_UNSPEC for the address the system prefers.
 
     Returns:
     Tuple[Any, float] | Tuple[Any, None]: A tuple containing the address of the replier and the total ping time in milliseconds.
     If the request times out, the function returns None for the ping time. The address part of the tuple is also None if no reply is received.
     """
+    try:
+        family, address = resolve_addresses(host, family=family)[0]
+    except gaierror:
+        return None, None
 
-    # Create a raw socket with the Internet Protocol (IPv4) and ICMP.
-    # socket.AF_INET specifies the IPv4 address family.
-    # socket.SOCK_RAW allows sending raw packets (including ICMP).
-    # socket.IPPROTO_ICMP specifies the ICMP protocol.
-    with socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP) as sock:
-        # Set the Time-To-Live (TTL) for the ICMP packet.
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+    sock = open_icmp_socket(family)
+    if sock is None:
+        return tcp_ping(address[0], ttl, timeout)
 
-        # Set the timeout for the socket's blocking operations (e.g., recvfrom).
-        sock.settimeout(timeout)
+    with sock:
+        raw = sock.type == socket.SOCK_RAW
+
+        # Set the Time-To-Live (TTL) or IPv6 hop limit for the ICMP packet.
+        sock.setsockopt(*hop_limit_option(family), ttl)
+
+        # Ping sockets report Time Exceeded and Destination Unreachable through the error queue.
+        if not raw:
+            enable_error_queue(sock)
 
         # Create an ICMP Echo Request packet.
-        # icmp_type=8 and icmp_code=0 are standard for Echo Request.
+        # icmp_type=8 (128 for ICMPv6) and icmp_code=0 are standard for Echo Request.
         # sequence_number is used to match Echo Requests with Replies.
-        packet: bytes = create_icmp_packet(icmp_type=8, icmp_code=0, sequence_number=sequence_number)
+        # The ICMPv6 checksum covers a pseudo-header with the source address, which is only known once the kernel
+        # has routed the packet, so for IPv6 the kernel always computes it, for raw and ping sockets alike.
+        echo_request = ICMPV6_ECHO_REQUEST if family == socket.AF_INET6 else ICMP_ECHO_REQUEST
+        packet: bytes = create_icmp_packet(icmp_type=echo_request, icmp_code=0, sequence_number=sequence_number)
+        icmp_id = struct.unpack('BBHHh', packet[:8])[3]
 
         # Send the ICMP packet to the target host.
-        # The second argument of sendto is a tuple (host, port).
-        # For raw sockets, the port number is irrelevant, hence set to 1.
-        sock.sendto(packet, (host, 1))
+        # The resolved socket address carries a port, which is irrelevant for ICMP.
+        # Ping sockets replace the identifier with their own and fill in the checksum.
+        try:
+            sock.sendto(packet, address)
+        except OSError:
+            # No route to the host
+            return None, None
 
         # Record the current time to measure the round-trip time later.
-        start: float = time.time()
+        start: float = time.perf_counter()
+        deadline: float = start + timeout
+
+        # Wait for the reply to this request, skipping anything else that arrives
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # If no reply is received within the timeout period, return None for the ping time.
+                return None, None
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                continue
+
+            if not raw:
+                icmp_type, offender, quoted = read_error_queue(sock)
+                if offender:
+                    if len(quoted) >= 8 and struct.unpack('BBHHh', quoted[:8])[4] == sequence_number:
+                        return (offender, 0), (time.perf_counter() - start) * 1000
+                    continue
 
-        try:
-            # Wait to receive data from the socket (up to 1024 bytes).
-            # This will be the ICMP Echo Reply if the target host is reachable.
-            data, addr = sock.recvfrom(1024)
+            try:
+                data, addr = sock.recvfrom(1024, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                # The error behind a queued ICMP message, read from the error queue on the next pass
+                continue
 
-            # Record the time when the reply is received.
-            end: float = time.time()
+            if match_icmp_reply(data, raw, icmp_id, sequence_number, family):
+                # Return the address of the replier and the total ping time in milliseconds.
+                return addr, (time.perf_counter() - start) * 1000
 
-            # Calculate the round-trip time in milliseconds.
-            total_ping_time = (end - start) * 1000
 
-            # Return the address of the replier and the total ping time.
-            return addr, total_ping_time
-        except socket.timeout:
-            # If no reply is received within the timeout period, return None for the ping time.
-            return None, None
+def tcp_ping(host: str, ttl: int = 64, timeout: int = 1, ports: Tuple[int, ...] = TCP_PING_PORTS, family: int = socket.AF_UNSPEC) -> Tuple[Any, float] | Tuple[Any, None]:
+    """
+    Measure the round-trip time to a host by timing a TCP connection attempt, for systems where ICMP is not allowed.
+
+    Args:
+    host (str): The IP address (IPv4 or IPv6) or hostname of the target host.
+    ttl (int): Time-To-Live (hop limit for IPv6) of the connection attempt.
+    timeout (int): The time in seconds to wait for an answer, shared by all ports.
+    ports (tuple): TCP ports to try in order until one answers.
+    family (int): AF_INET or AF_INET6 to use one family of a dual-stack host, AF_UNSPEC for the address the system prefers.
 
+    Returns:
+    Tuple[Any, float] | Tuple[Any, None]: The address of the replier and the round-trip time in milliseconds, like ping.
 
-def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: bool = False) -> str:
+    Description:
+    The host answers a connection attempt with a SYN-ACK if the port is open and a RST if it is closed; either way
+    it is up, and the answer takes one round trip. When the TTL runs out on the way, the router's Time Exceeded
+    message is read from the socket's error queue, so this also works for traceroute. Nothing is sent after the
+    handshake.
     """
-    Perform a traceroute to the specified host, with multiple pings per hop.
+    try:
+        family, address = resolve_addresses(host, family=family)[0]
+    except gaierror:
+        return None, None
+
+    deadline = time.perf_counter() + timeout
+    for port in ports:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(*hop_limit_option(family), ttl)
+            enable_error_queue(sock)
+            sock.setblocking(False)
+
+            start = time.perf_counter()
+            sock.connect_ex((address[0], port) + address[2:])
+            remaining = deadline - start
+            if remaining <= 0:
+                break
+            _, writable, failed = select.select([], [sock], [sock], remaining)
+            elapsed = (time.perf_counter() - start) * 1000
+            if not writable and not failed:
+                # Filtered or slow, try the next port with the time that is left
+                continue
+
+            # A router on the way reported the TTL ran out
+            icmp_type, offender, _ = read_error_queue(sock)
+            if offender:
+                return (offender, 0), elapsed
+
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error in (0, errno.ECONNREFUSED):
+                return (address[0], port), elapsed
+
+    return None, None
+
+
+def connect_each_family(host: str, port: int, timeout: float = 3) -> List[Tuple[int, tuple, Optional[float], Optional[str]]]:
+    """
+    Connect to a TCP port over IPv4 and IPv6 at the same time and measure the handshake of each family.
+
+    Args:
+    host (str): The IP address (IPv4 or IPv6) or hostname of the target host.
+    port (int): The TCP port to connect to.
+    timeout (float): The time in seconds to wait for the handshakes, shared by both families.
+
+    Returns:
+    list: One (address family, socket address, handshake time in ms or None, error or None) tuple per family the
+          host resolves to, in the order the system prefers them.
+
+    Description:
+    Like Happy Eyeballs (RFC 8305), the connection attempts of both families run in parallel on non-blocking sockets,
+    so a dual-stack host is checked in a single round trip and a broken family costs no more than the timeout. Unlike
+    Happy Eyeballs nothing is cancelled once the first family connects: the other one is waited for as well, so the
+    latency of each family is reported and a broken family is noticed even while the other one works. The first
+    address of each family is tried.
+    """
+    # First address of each family, in the order the system prefers
+    targets = {}
+    for family, address in resolve_addresses(host, port):
+        targets.setdefault(family, address)
+
+    results = {}
+    pending = {}
+    for family, address in targets.items():
+        sock = None
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            start = time.perf_counter()
+            error = sock.connect_ex(address)
+        except OSError as e:
+            # e.g. IPv6 disabled on this host
+            error = e.errno or errno.EAFNOSUPPORT
+        if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            pending[sock] = (family, address, start)
+            continue
+        results[family] = (address, None, os.strerror(error)) if error else (address, 0.0, None)
+        if sock:
+            sock.close()
+
+    deadline = time.perf_counter() + timeout
+    try:
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            _, writable, failed = select.select([], list(pending), list(pending), remaining)
+            now = time.perf_counter()
+            for sock in set(writable) | set(failed):
+                family, address, start = pending.pop(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                results[family] = (address, None, os.strerror(error)) if error else (address, (now - start) * 1000, None)
+                sock.close()
+    finally:
+        for sock, (family, address, start) in pending.items():
+            results[family] = (address, None, "timed out")
+            sock.close()
+
+    return [(family,) + results[family] for family in targets]
+
+
+def traceroute_hops(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: bool = False) -> List[Tuple[int, Optional[str], List[float]]]:
+    """
+    Perform a traceroute to the specified host, with multiple pings per hop, and return the raw hops.
 
     Args:
     host (str): The IP address or hostname of the target host.
@@ -186,10 +569,16 @@ def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: b
     verbose (bool): If True, print additional details during execution.
 
     Returns:
-    str: The results of the traceroute, including statistics for each hop.
+    list: One (ttl, address or None, list of ping times in ms) tuple per hop.
     """
-    # Header row for the results. Each column is formatted for alignment and width.
-    results = [f"{'Hop':>3} {'Address':<15} {'Min (ms)':>8}   {'Avg (ms)':>8}   {'Max (ms)':>8}   {'Count':>5}"]
+    hops = []
+
+    # Resolve once, so that every hop is probed towards the same address and the end of the path is recognized
+    try:
+        family, address = resolve_addresses(host)[0]
+    except gaierror:
+        return hops
+    target = address[0]
 
     # Loop through each TTL (Time-To-Live) value from 1 to max_hops.
     for ttl in range(1, max_hops + 1):
@@ -204,12 +593,43 @@ def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: b
         for _ in range(pings_per_hop):
             # Ping the host with the current TTL and sequence number.
             # The sequence number is incremented with TTL for each ping.
-            addr, response = ping(host, ttl=ttl, sequence_number=ttl)
+            addr, response = ping(target, ttl=ttl, sequence_number=ttl, family=family)
 
             # If a response is received (not None), append it to ping_times.
             if response is not None:
                 ping_times.append(response)
 
+        # Record the hop, with no address if nothing answered.
+        hops.append((ttl, addr[0] if addr and ping_times else None, ping_times))
+
+        # Print the hop if verbose mode is enabled.
+        if verbose:
+            print(f"\tResult: {hops[-1][1] or '*'} with {len(ping_times)} replies")
+
+        # If the address of the response matches the target host, stop the traceroute.
+        if addr and addr[0] == target:
+            break
+
+    return hops
+
+
+def format_traceroute(hops: List[Tuple[int, Optional[str], List[float]]]) -> str:
+    """
+    Format the hops of a traceroute as a table with statistics for each hop.
+
+    Args:
+    hops (list): One (ttl, address or None, list of ping times in ms) tuple per hop, as returned by traceroute_hops.
+
+    Returns:
+    str: The formatted table.
+    """
+    # The address column fits an IPv4 address, and widens for IPv6 addresses.
+    width = max([15] + [len(address) for ttl, address, ping_times in hops if address])
+
+    # Header row for the results. Each column is formatted for alignment and width.
+    results = [f"{'Hop':>3} {'Address':<{width}} {'Min (ms)':>8}   {'Avg (ms)':>8}   {'Max (ms)':>8}   {'Count':>5}"]
+
+    for ttl, address, ping_times in hops:
         # If there are valid ping responses, calculate and format the statistics.
         if ping_times:
             min_time = min(ping_times)  # Minimum ping time.
@@ -218,23 +638,31 @@ def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: b
             count = len(ping_times)  # Count of successful pings.
 
             # Append the formatted results for this TTL to the results list.
-            results.append(f"{ttl:>3} {addr[0] if addr else '*':<15} {min_time:>8.2f}ms {avg_time:>8.2f}ms {max_time:>8.2f}ms {count:>5}")
+            results.append(f"{ttl:>3} {address or '*':<{width}} {min_time:>8.2f}ms {avg_time:>8.2f}ms {max_time:>8.2f}ms {count:>5}")
         else:
             # If no valid responses, append a row of asterisks and zero count.
-            results.append(f"{ttl:>3} {'*':<15} {'*':>8}   {'*':>8}   {'*':>8}   {0:>5}")
-
-        # Print the last entry in the results if verbose mode is enabled.
-        if verbose and results:
-            print(f"\tResult: {results[-1]}")
-
-        # If the address of the response matches the target host, stop the traceroute.
-        if addr and addr[0] == host:
-            break
+            results.append(f"{ttl:>3} {'*':<{width}} {'*':>8}   {'*':>8}   {'*':>8}   {0:>5}")
 
     # Join all results into a single string with newline separators and return.
     return '\n'.join(results)
 
 
+def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: bool = False) -> str:
+    """
+    Perform a traceroute to the specified host, with multiple pings per hop.
+
+    Args:
+    host (str): The IP address or hostname of the target host.
+    max_hops (int): Maximum number of hops to try before stopping.
+    pings_per_hop (int): Number of pings to perform at each hop.
+    verbose (bool): If True, print additional details during execution.
+
+    Returns:
+    str: The results of the traceroute, including statistics for each hop.
+    """
+    return format_traceroute(traceroute_hops(host, max_hops, pings_per_hop, verbose))
+
+
 def check_server_http(url: str) -> Tuple[bool, Optional[int]]:
     """
     Check if an HTTP server is up by making a request to the provided URL.
@@ -247,6 +675,8 @@ def check_server_http(url: str) -> Tuple[bool, Optional[int]]:
     :return: Tuple (True/False, status code)
              True if server is up (status code < 400), False otherwise
     """
+    import requests
+
     try:
         # Making a GET request to the server
         response: requests.Response = requests.get(url)
@@ -282,6 +712,8 @@ def check_server_https(url: str, timeout: int = 5) -> Tuple[bool, Optional[int],
     :param timeout: Timeout for the request in seconds. Default is 5 seconds.
     :return: Tuple (True/False for server status, status code, description)
     """
+    import requests
+
     try:
         # Setting custom headers for the request. Here, 'User-Agent' is set to mimic a web browser.
         headers: dict = {'User-Agent': 'Mozilla/5.0'}
@@ -310,6 +742,322 @@ def check_server_https(url: str, timeout: int = 5) -> Tuple[bool, Optional[int],
         return False, None, f"Error during request: {e}"
 
 
+# TLS sessions to resume, and the latest full and resumed handshake times, per (host, port)
+tls_sessions = {}
+tls_handshakes = {}
+
+# Parsed certificate chains by the SHA-256 fingerprint of their leaf certificate, so that an unchanged
+# certificate is parsed once rather than on every check
+certificate_cache = {}
+CERTIFICATE_CACHE_SIZE = 1024
+
+# Shared by every TLS check, sessions can only be resumed through the context that created them
+tls_context = None
+tls_lock = threading.Lock()
+
+
+def get_tls_context():
+    """
+    Get the SSL context shared by every TLS check, creating it on first use.
+
+    Returns:
+    ssl.SSLContext: A context verifying certificates against the system's trusted CAs (or SSL_CERT_FILE).
+
+    Description:
+    Hostname checking is left to check_tls, so that a certificate issued for another name is still read and
+    reported instead of only failing the handshake.
+    """
+    import ssl
+
+    global tls_context
+    with tls_lock:
+        if tls_context is None:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            tls_context = context
+        return tls_context
+
+
+def certificate_matches(host: str, names: List[Tuple[str, str]]) -> bool:
+    """
+    Check whether a certificate is valid for a host, by its subject alternative names.
+
+    Args:
+    host (str): The hostname or IP address the certificate was requested for.
+    names (list): The subjectAltName entries of the certificate, e.g. ('DNS', '*.example.com') or ('IP Address', '::1').
+
+    Returns:
+    bool: True if a DNS name (with a wildcard only as the whole leftmost label) or IP address entry matches the host.
+    """
+    family = resolution.address_family(host)
+    if family:
+        address = socket.inet_pton(family, host)
+        for kind, value in names:
+            if kind == 'IP Address' and resolution.address_family(value.strip()) == family:
+                if socket.inet_pton(family, value.strip()) == address:
+                    return True
+        return False
+
+    host = host.lower().rstrip(".")
+    for kind, value in names:
+        if kind != 'DNS':
+            continue
+        pattern = value.lower().rstrip(".")
+        if pattern.startswith("*."):
+            label, _, rest = host.partition(".")
+            if label and rest == pattern[2:]:
+                return True
+        elif pattern == host:
+            return True
+    return False
+
+
+def parse_certificate(info: dict) -> dict:
+    """
+    Extract what check_tls reports from a certificate, as decoded by the ssl module.
+
+    Args:
+    info (dict): The certificate as returned by getpeercert().
+
+    Returns:
+    dict: The subject and issuer common names, the expiry as seconds since the epoch and the subject alternative names.
+    """
+    import ssl
+
+    def common_name(name):
+        return next((value for rdn in name for key, value in rdn if key == 'commonName'), "")
+
+    return {
+        'subject': common_name(info.get('subject', ())),
+        'issuer': common_name(info.get('issuer', ())),
+        'not_after': ssl.cert_time_to_seconds(info['notAfter']),
+        'names': [tuple(entry) for entry in info.get('subjectAltName', ())]
+    }
+
+
+def certificate_not_after(certificate: bytes) -> float:
+    """
+    Read the expiry of a DER encoded certificate, which the ssl module only decodes for the leaf.
+
+    Args:
+    certificate (bytes): The certificate in DER form.
+
+    Returns:
+    float: The notAfter time of the certificate as seconds since the epoch.
+    """
+    def element(offset):
+        # Tag, start and end of the contents of the DER element at offset
+        tag, length = certificate[offset], certificate[offset + 1]
+        offset += 2
+        if length & 0x80:
+            count = length & 0x7f
+            length = int.from_bytes(certificate[offset:offset + count], "big")
+            offset += count
+        return tag, offset, offset + length
+
+    # Certificate > tbsCertificate > [version], serialNumber, signature, issuer, validity > notBefore, notAfter
+    _, offset, _ = element(0)
+    _, offset, _ = element(offset)
+    tag, _, end = element(offset)
+    if tag == 0xa0:
+        offset = end
+    for _ in range(3):
+        offset = element(offset)[2]
+    _, offset, _ = element(offset)
+    tag, start, end = element(element(offset)[2])
+    text = certificate[start:end].decode("ascii")
+
+    # UTCTime has a two digit year, GeneralizedTime a four digit one
+    if tag == 0x17:
+        year, text = int(text[:2]), text[2:]
+        year += 1900 if year >= 50 else 2000
+    else:
+        year, text = int(text[:4]), text[4:]
+    return calendar.timegm((year, int(text[0:2]), int(text[2:4]), int(text[4:6]), int(text[6:8]), int(text[8:10])))
+
+
+def certificate_chain_info(sock: Any) -> dict:
+    """
+    Get the parsed certificate chain of a TLS connection, from the cache when the leaf certificate is unchanged.
+
+    Args:
+    sock (ssl.SSLSocket): A connected socket that verified its peer.
+
+    Returns:
+    dict: The parsed leaf certificate (see parse_certificate), plus the SHA-256 fingerprint of the leaf, the earliest
+          expiry of any certificate in the chain, the chain length and whether the chain is complete.
+
+    Description:
+    Only the leaf is fetched in binary form and hashed on every check. The chain is decoded once per new leaf, from a
+    full handshake: resumed handshakes do not send the chain again, so until a full handshake sees a new certificate,
+    only its leaf is decoded. The chain is only available where the ssl module exposes it (Python 3.13 and later),
+    elsewhere only the leaf is checked and the leaf's fingerprint alone decides whether it is decoded again.
+    """
+    leaf = sock.getpeercert(True)
+    fingerprint = hashlib.sha256(leaf).hexdigest()
+    chain_available = hasattr(sock, 'get_verified_chain')
+    with tls_lock:
+        cached = certificate_cache.get(fingerprint)
+    # A leaf first seen on a resumed handshake is decoded again, with its chain, on the next full one
+    if cached and (cached['complete'] or sock.session_reused or not chain_available):
+        return cached
+
+    # Certificates of the verified chain in binary form, leaf first
+    try:
+        chain = sock.get_verified_chain() if chain_available else []
+    except ValueError:
+        chain = []
+    leaf_info = parse_certificate(sock.getpeercert())
+    try:
+        chain_not_after = min([leaf_info['not_after']] + [certificate_not_after(certificate) for certificate in chain])
+    except (IndexError, ValueError):
+        chain, chain_not_after = [], leaf_info['not_after']
+
+    info = dict(leaf_info, fingerprint=fingerprint, chain_not_after=chain_not_after, chain_length=len(chain) or 1,
+                complete=bool(chain))
+    with tls_lock:
+        if fingerprint not in certificate_cache and len(certificate_cache) >= CERTIFICATE_CACHE_SIZE:
+            certificate_cache.pop(next(iter(certificate_cache)))
+        certificate_cache[fingerprint] = info
+    return info
+
+
+def wait_for_session_ticket(sock: Any, wait: float) -> None:
+    """
+    Give a TLS 1.3 server the time to send its session tickets, which arrive after the handshake.
+
+    Args:
+    sock (ssl.SSLSocket): A socket that just completed its handshake.
+    wait (float): The most seconds to wait.
+    """
+    import ssl
+
+    deadline = time.perf_counter() + wait
+    sock.setblocking(False)
+    while not sock.session.has_ticket:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+            return
+        try:
+            # Reading processes the ticket records, servers do not send application data before a request
+            if not sock.recv(1):
+                return
+        except ssl.SSLWantReadError:
+            continue
+        except (ssl.SSLError, OSError):
+            return
+
+
+def check_tls(host: str, port: int = 443, timeout: int = 5, expiry_days: int = 7, resume: bool = True) -> Tuple[bool, str, dict]:
+    """
+    Check the TLS handshake and certificate of a server.
+
+    Args:
+    host (str): The IP address (IPv4 or IPv6) or hostname of the server.
+    port (int): The TCP port of the TLS service. Default is 443.
+    timeout (int): The timeout in seconds of the connection and the handshake. Default is 5 seconds.
+    expiry_days (int): The check fails once any certificate in the chain expires within this many days, 0 to only fail
+                       on expired certificates (which also fail verification). Default is 7 days.
+    resume (bool): Resume the TLS session of the previous check, so repeated checks do an abbreviated handshake.
+
+    Returns:
+    tuple: A boolean, True if the handshake succeeded with a verified certificate that is valid for the host and does not
+           expire soon, a description, and a dictionary with handshake_ms, resumed, full_ms and resumed_ms (the latest
+           handshake time of each kind), protocol, cipher and the certificate's subject, issuer, expiry, days_left,
+           chain_days_left and name_match. The dictionary is empty if the handshake failed.
+
+    Description:
+    The handshake is timed on its own, after the TCP connection is established. With resume, the session (or TLS 1.3
+    session ticket) of each host and port is kept and offered on the next check, so a server supporting resumption
+    skips the certificate exchange and key agreement; both kinds of handshake time are reported. The certificate chain
+    is decoded once per new leaf certificate, see certificate_chain_info.
+    """
+    import ssl
+
+    key = (host.lower(), port)
+    with tls_lock:
+        session = tls_sessions.get(key) if resume else None
+
+    try:
+        with open_connection(host, port, timeout) as raw:
+            start = time.perf_counter()
+            with get_tls_context().wrap_socket(raw, server_hostname=host, session=session) as sock:
+                handshake_ms = (time.perf_counter() - start) * 1000
+                resumed = sock.session_reused
+                protocol, cipher = sock.version(), sock.cipher()[0]
+                certificate = certificate_chain_info(sock)
+                if resume and not resumed:
+                    wait_for_session_ticket(sock, min(timeout, max(0.05, handshake_ms * 2 / 1000)))
+                    with tls_lock:
+                        tls_sessions[key] = sock.session
+
+    except ssl.SSLCertVerificationError as e:
+        with tls_lock:
+            tls_sessions.pop(key, None)
+        return False, f"Certificate of {host}:{port} failed verification: {e.verify_message}", {}
+
+    except ssl.SSLError as e:
+        with tls_lock:
+            tls_sessions.pop(key, None)
+        return False, f"TLS handshake with {host}:{port} failed: {e.reason or e}", {}
+
+    except socket.timeout:
+        return False, f"TLS handshake with {host}:{port} timed out.", {}
+
+    except socket.gaierror as e:
+        return False, f"{host} could not be resolved: {e}", {}
+
+    except OSError as e:
+        return False, f"Port {port} on {host} is closed or not reachable: {e}", {}
+
+    with tls_lock:
+        handshakes = tls_handshakes.setdefault(key, {'full_ms': None, 'resumed_ms': None})
+        handshakes['resumed_ms' if resumed else 'full_ms'] = handshake_ms
+        handshakes = dict(handshakes)
+
+    now = time.time()
+    days_left = int((certificate['not_after'] - now) // 86400)
+    chain_days_left = int((certificate['chain_not_after'] - now) // 86400)
+    name_match = certificate_matches(host, certificate['names'])
+    info = {
+        'handshake_ms': round(handshake_ms, 2),
+        'resumed': resumed,
+        'full_ms': round(handshakes['full_ms'], 2) if handshakes['full_ms'] is not None else None,
+        'resumed_ms': round(handshakes['resumed_ms'], 2) if handshakes['resumed_ms'] is not None else None,
+        'protocol': protocol,
+        'cipher': cipher,
+        'subject': certificate['subject'],
+        'issuer': certificate['issuer'],
+        'expires': time.strftime('%Y-%m-%d', time.gmtime(certificate['not_after'])),
+        'days_left': days_left,
+        'chain_days_left': chain_days_left,
+        'name_match': name_match
+    }
+
+    # Describe the handshake, comparing with the other kind where both were seen
+    if resumed:
+        handshake = f"resumed handshake {handshake_ms:.2f} ms"
+        if handshakes['full_ms'] is not None:
+            handshake += f" (full {handshakes['full_ms']:.2f} ms)"
+    else:
+        handshake = f"full handshake {handshake_ms:.2f} ms"
+        if resume and session is not None:
+            handshake += " (session not resumed)"
+    description = (f"{protocol} {cipher}, {handshake}, certificate {certificate['subject'] or '?'} issued by "
+                   f"{certificate['issuer'] or '?'} expires {info['expires']} ({days_left} days)")
+    if chain_days_left < days_left:
+        description += f", chain expires in {chain_days_left} days"
+
+    problems = []
+    if not name_match:
+        problems.append(f"not valid for {host}")
+    if chain_days_left < expiry_days:
+        problems.append(f"expires within {expiry_days} days")
+    if problems:
+        description += f", certificate {' and '.join(problems)}"
+    return not problems, description + ".", info
+
+
 def check_ntp_server(server: str) -> Tuple[bool, Optional[str]]:
     """
     Checks if an NTP server is up and returns its status and time.
@@ -322,13 +1070,16 @@ def check_ntp_server(server: str) -> Tuple[bool, Optional[str]]:
                                  (True if up, False if down) and the current time as a string
                                  if the server is up, or None if it's down.
     """
+    import ntplib
+
     # Create an NTP client instance
     client = ntplib.NTPClient()
 
     try:
         # Request time from the NTP server
         # 'version=3' specifies the NTP version to use for the request
-        response = client.request(server, version=3)
+        # The server name is resolved through the shared cache, ntplib only gets its address
+        response = client.request(resolve_addresses(server, 123)[0][1][0], version=3)
 
         # If request is successful, return True and the server time
         # 'ctime' converts the time in seconds since the epoch to a readable format
@@ -347,10 +1098,14 @@ def check_dns_server_status(server, query, record_type) -> (bool, str):
     :param record_type: Type of DNS record (e.g., 'A', 'AAAA', 'MX', 'CNAME')
     :return: Tuple (status, query_results)
     """
+    import dns.exception
+    import dns.resolver
+
     try:
         # Set the DNS resolver to use the specified server
         resolver = dns.resolver.Resolver()
-        resolver.nameservers = [socket.gethostbyname(server)]
+        # The server may be reachable over IPv4 or IPv6, use the address the system prefers
+        resolver.nameservers = [resolve_addresses(server, 53)[0][1][0]]
 
         # Perform a DNS query for the specified domain and record type
         query_results = resolver.resolve(query, record_type)
@@ -363,13 +1118,14 @@ def check_dns_server_status(server, query, record_type) -> (bool, str):
         return False, str(e)
 
 
-def check_tcp_port(ip_address: str, port: int) -> (bool, str):
+def check_tcp_port(ip_address: str, port: int, timeout: float = 3) -> (bool, str):
     """
     Checks the status of a specific TCP port on a given IP address.
 
     Args:
-    ip_address (str): The IP address of the target server.
+    ip_address (str): The IP address (IPv4 or IPv6) or hostname of the target server.
     port (int): The TCP port number to check.
+    timeout (float): The timeout duration in seconds for the connection attempts. Default is 3 seconds.
 
     Returns:
     tuple: A tuple containing a boolean and a string.
@@ -379,38 +1135,47 @@ def check_tcp_port(ip_address: str, port: int) -> (bool, str):
     Description:
     This function attempts to establish a TCP connection to the specified port on the given IP address.
     If the connection is successful, it means the port is open; otherwise, the port is considered closed or unreachable.
+    A dual-stack host is connected to over IPv4 and IPv6 in parallel (see connect_each_family): the port is open if
+    either family connects, and the description lists the handshake time or error of each family.
     """
 
     try:
-        # Create a socket object using the AF_INET address family (IPv4) and SOCK_STREAM socket type (TCP).
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            # Set a timeout for the socket to avoid waiting indefinitely. Here, 3 seconds is used as a reasonable timeout duration.
-            s.settimeout(3)
-
-            # Attempt to connect to the specified IP address and port.
-            # If the connection is successful, the port is open.
-            s.connect((ip_address, port))
-            return True, f"Port {port} on {ip_address} is open."
-
-    except socket.timeout:
-        # If a timeout occurs, it means the connection attempt took too long, implying the port might be filtered or the server is slow to respond.
-        return False, f"Port {port} on {ip_address} timed out."
+        # Connect over every address family the host resolves to at once.
+        results = connect_each_family(ip_address, port, timeout)
 
-    except socket.error:
-        # If a socket error occurs, it generally means the port is closed or not reachable.
+    except socket.gaierror:
+        # The host name did not resolve, so there is nothing to connect to.
         return False, f"Port {port} on {ip_address} is closed or not reachable."
 
     except Exception as e:
         # Catch any other exceptions and return a general failure message along with the exception raised.
         return False, f"Failed to check port {port} on {ip_address} due to an error: {e}"
 
+    errors = [error for family, address, latency, error in results if error]
+    if len(errors) < len(results):
+        # If a connection is successful, the port is open.
+        status, description = True, f"Port {port} on {ip_address} is open"
+    elif all(error == "timed out" for error in errors):
+        # If every attempt took too long, the port might be filtered or the server is slow to respond.
+        status, description = False, f"Port {port} on {ip_address} timed out"
+    else:
+        # Otherwise the port is closed or not reachable.
+        status, description = False, f"Port {port} on {ip_address} is closed or not reachable"
+
+    # Report each family of a dual-stack host, so a broken family shows up even while the other one works
+    if len(results) > 1:
+        families = [f"{FAMILY_NAMES[family]} {f'{latency:.2f} ms' if error is None else error}"
+                    for family, address, latency, error in results]
+        description += f" ({', '.join(families)})"
+    return status, description + "."
+
 
 def check_udp_port(ip_address: str, port: int, timeout: int = 3) -> (bool, str):
     """
     Checks the status of a specific UDP port on a given IP address.
 
     Args:
-    ip_address (str): The IP address of the target server.
+    ip_address (str): The IP address (IPv4 or IPv6) or hostname of the target server.
     port (int): The UDP port number to check.
     timeout (int): The timeout duration in seconds for the socket operation. Default is 3 seconds.
 
@@ -422,23 +1187,32 @@ def check_udp_port(ip_address: str, port: int, timeout: int = 3) -> (bool, str):
     Description:
     This function attempts to send a UDP packet to the specified port on the given IP address.
     Since UDP is a connectionless protocol, the function can't definitively determine if the port is open.
-    It can only confirm if the port is closed, typically indicated by an ICMP 'Destination Unreachable' response.
+    It can only confirm if the port is closed, typically indicated by an ICMP 'Destination Unreachable' response,
+    or open, if the target answers.
     """
 
     try:
-        # Create a socket object using the AF_INET address family (IPv4) and SOCK_DGRAM socket type (UDP).
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        # Resolve the address, IPv4 or IPv6, the system prefers for the host.
+        family, address = resolve_addresses(ip_address, port)[0]
+
+        # Create a socket object using the address family of the host and SOCK_DGRAM socket type (UDP).
+        with socket.socket(family, socket.SOCK_DGRAM) as s:
             # Set a timeout for the socket to avoid waiting indefinitely.
             s.settimeout(timeout)
 
             # Send a dummy packet to the specified IP address and port.
-            # As UDP is connectionless, this does not establish a connection but merely sends the packet.
-            s.sendto(b'', (ip_address, port))
+            # As UDP is connectionless, this does not establish a connection, but connecting the socket makes
+            # the kernel report an ICMP 'Destination Unreachable' for the port on the next receive.
+            s.connect(address)
+            s.send(b'')
 
             try:
                 # Try to receive data from the socket.
                 # If an ICMP 'Destination Unreachable' message is received, the port is considered closed.
-                s.recvfrom(1024)
+                s.recv(1024)
+                return True, f"Port {port} on {ip_address} is open and answered."
+
+            except ConnectionRefusedError:
                 return False, f"Port {port} on {ip_address} is closed."
 
             except socket.timeout:
@@ -450,62 +1224,75 @@ def check_udp_port(ip_address: str, port: int, timeout: int = 3) -> (bool, str):
         return False, f"Failed to check UDP port {port} on {ip_address} due to an error: {e}"
 
 
-def local_tcp_echo(ip_address: str, port: int) -> (bool, str):
+def local_tcp_echo(ip_address: str, port: int, verbose: bool = True) -> (bool, str):
     """
     Adapted from check_tcp_status to test functionality of local TCP server.
 
     Args:
-    ip_address (str): The IP address of the target server.
+    ip_address (str): The IP address (IPv4 or IPv6) or hostname of the target server.
     port (int): The TCP port number to check.
+    verbose (bool): If True, print the echo request and reply messages as they are exchanged.
 
-    Returns: None
+    Returns:
+    tuple: A tuple containing a boolean and a string.
+           The boolean is True if every echo reply matched its request, False otherwise.
+           The string provides a description of the echo status.
 
     Description:
     Checks the status of a specific TCP port on a given IP address. Then, sends random number (1-3) of randomly
     generated lorem ipsum sentences as echo request messages to the server. The server should send the sentences back
     in echo reply messages for easy verification that the server is working properly.
     """
-    try:
-        # Create a socket object using the AF_INET address family (IPv4) and SOCK_STREAM socket type (TCP).
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            # Set a timeout for the socket to avoid waiting indefinitely.
-            s.settimeout(3)
+    import lorem
+
+    # Only print when running interactively
+    log = print if verbose else (lambda *args, **kwargs: None)
 
-            # Attempt to connect to the specified IP address and port.
-            # If the connection is successful, the port is open.
-            s.connect((ip_address, port))
-            print(f"Port {port} on {ip_address} is open.")
+    try:
+        # Attempt to connect to the specified IP address and port, over each address (IPv4 or IPv6) of the host in
+        # turn. A timeout keeps every attempt from waiting indefinitely.
+        # If the connection is successful, the port is open.
+        with open_connection(ip_address, port, timeout=3) as s:
+            log(f"Port {port} on {ip_address} is open.")
 
             # Test a small random number of messages
-            for _ in range(random.randint(1, 3)):
+            echoed = 0
+            messages = random.randint(1, 3)
+            for _ in range(messages):
 
                 # Get a random lorem ipsum sentence
                 message = lorem.sentence()
 
                 # Send message
-                print(f"\nSending echo request message: {message}")
+                log(f"\nSending echo request message: {message}")
                 s.sendall(message.encode())
 
                 # Receive message
                 reply = s.recv(1024).decode()
-                print(f"Received echo reply message: {reply}")
+                log(f"Received echo reply message: {reply}")
+                echoed += reply == message
 
             # Send termination message
-            print(f"\nSending termination message to {(ip_address, port)} ... ")
+            log(f"\nSending termination message to {(ip_address, port)} ... ")
             s.sendall("Goodbye".encode())
-            print(f"Connection with {(ip_address, port)} is closed.")
+            log(f"Connection with {(ip_address, port)} is closed.")
+
+            return echoed == messages, f"Echoed {echoed}/{messages} messages on port {port} of {ip_address}."
 
     except socket.timeout:
         # Connection attempt took too long; port might be filtered or the server is slow to respond.
-        print(f"Port {port} on {ip_address} timed out.")
+        log(f"Port {port} on {ip_address} timed out.")
+        return False, f"Port {port} on {ip_address} timed out."
 
     except socket.error:
         # If a socket error occurs, it generally means the port is closed or not reachable.
-        print(f"Port {port} on {ip_address} is closed or not reachable.")
+        log(f"Port {port} on {ip_address} is closed or not reachable.")
+        return False, f"Port {port} on {ip_address} is closed or not reachable."
 
     except Exception as e:
         # Catch any other exceptions and return a general failure message along with the exception raised.
-        print(f"Failed to check port {port} on {ip_address} due to an error: {e}")
+        log(f"Failed to check port {port} on {ip_address} due to an error: {e}")
+        return False, f"Failed to check port {port} on {ip_address} due to an error: {e}"
 
 
 # # Ping Usage Example
@@ -0,0 +1,262 @@
+import collections
+import json
+import os
+import threading
+
+
+def routes_match(old, new):
+    """
+    Compare two routes, treating hops that did not answer as wildcards, so that a rate limited router
+    or a trace that stopped early does not look like a new route
+    :param old: tuple of hop addresses, '*' for hops that did not answer
+    :param new: tuple of hop addresses, '*' for hops that did not answer
+    :return: True if the routes can be the same path
+    """
+    shorter, longer = sorted((old, new), key=len)
+    return (all(a == b or a == '*' or b == '*' for a, b in zip(shorter, longer))
+            and all(hop == '*' for hop in longer[len(shorter):]))
+
+
+class PathHistory:
+    """
+    History of the traceroute paths to every target. Routes (the address at every hop) are interned: each
+    distinct route is stored once with an id, and every trace only stores that id plus its per-hop latencies,
+    so frequent traces of a stable path take little space. Detects route changes and hops whose latency
+    shifts well above their usual level, hops that did not answer match any address. The file is rewritten
+    with only the traces kept in memory once it holds twice as many. Can be used as a sink for results
+    carrying 'hops'.
+    """
+    def __init__(self, path=None, keep=1000, latency_factor=2.0, latency_min_ms=20, alpha=0.2, on_change=None):
+        """
+        :param path: json lines file the history is loaded from and appended to, or None to keep it in memory
+        :param keep: traces kept in memory per target
+        :param latency_factor: a hop latency this many times its usual level is a shift
+        :param latency_min_ms: and it must also be at least this many ms above its usual level
+        :param alpha: weight of the newest trace in the usual level of a hop
+        :param on_change: callback receiving every detected change
+        """
+        self.path = path
+        self.keep = keep
+        self.latency_factor = latency_factor
+        self.latency_min_ms = latency_min_ms
+        self.alpha = alpha
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.route_ids = {}
+        self.routes = []
+        self.traces = {}
+        self.current = {}
+        self.baselines = {}
+        self.route_changes = collections.Counter()
+        self.kept_traces = 0
+        self.file_traces = 0
+        self.file = None
+
+        if path:
+            if os.path.exists(path):
+                self.load()
+            self.file = open(path, "a", buffering=1)
+            with self.lock:
+                self.compact_if_needed()
+
+    def load(self):
+        """
+        Rebuild the history from its file, skipping a torn last line
+        :return: None
+        """
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if 'route' in entry:
+                    self.route_ids[tuple(entry['route'])] = entry['id']
+                    self.routes.append(tuple(entry['route']))
+                elif 'target' in entry and entry['id'] < len(self.routes):
+                    self.apply(entry['target'], entry['t'], entry['id'], entry['rtt'])
+                    self.file_traces += 1
+
+    def intern(self, route):
+        """
+        Get the id of a route, storing it the first time it is seen. Caller must hold the lock.
+        :param route: tuple of hop addresses, '*' for hops that did not answer
+        :return: route id
+        """
+        route_id = self.route_ids.get(route)
+        if route_id is None:
+            route_id = self.route_ids[route] = len(self.routes)
+            self.routes.append(route)
+            self.write({'id': route_id, 'route': list(route)})
+        return route_id
+
+    def record(self, target, timestamp, hops):
+        """
+        Add a trace to the history
+        :param target: traced server
+        :param timestamp: time of the trace
+        :param hops: list of (ttl, address or None, list of ping times in ms) as returned by traceroute_hops
+        :return: list of detected changes
+        """
+        route = tuple(address or '*' for ttl, address, ping_times in hops)
+        rtts = [round(sum(ping_times) / len(ping_times), 2) if ping_times else None for ttl, address, ping_times in hops]
+        with self.lock:
+            route_id = self.intern(route)
+            self.write({'target': target, 't': timestamp, 'id': route_id, 'rtt': rtts})
+            self.file_traces += 1
+            changes = self.apply(target, timestamp, route_id, rtts)
+            self.compact_if_needed()
+
+        if self.on_change:
+            for change in changes:
+                self.on_change(change)
+        return changes
+
+    def apply(self, target, timestamp, route_id, rtts):
+        """
+        Update the in-memory history with a trace and detect changes. Caller must hold the lock.
+        :param target: traced server
+        :param timestamp: time of the trace
+        :param route_id: id of the trace's route
+        :param rtts: average latency of every hop, None for hops that did not answer
+        :return: list of detected changes
+        """
+        changes = []
+        traces = self.traces.setdefault(target, collections.deque(maxlen=self.keep))
+        if len(traces) < self.keep:
+            self.kept_traces += 1
+        traces.append((timestamp, route_id, rtts))
+
+        # Route change. A trace matching the current route apart from unanswered hops is the same route,
+        # and becomes the current route if it has fewer unanswered hops, so later traces are compared
+        # against the most complete version of it
+        previous = self.current.get(target)
+        if previous is None or previous == route_id:
+            self.current[target] = route_id
+        elif routes_match(self.routes[previous], self.routes[route_id]):
+            if self.routes[route_id].count('*') < self.routes[previous].count('*'):
+                self.current[target] = route_id
+        else:
+            self.current[target] = route_id
+            self.route_changes[target] += 1
+            old, new = self.routes[previous], self.routes[route_id]
+            changed = [ttl for ttl in range(1, max(len(old), len(new)) + 1)
+                       if old[ttl - 1:ttl] != new[ttl - 1:ttl]]
+            changes.append({'type': 'route_change', 'target': target, 'timestamp': timestamp,
+                            'old': list(old), 'new': list(new), 'changed_hops': changed})
+
+        # Latency shifts are measured against the usual level of the same hop on the same route
+        baseline = self.baselines.setdefault((target, self.current[target]), [])
+        baseline.extend([None] * (len(rtts) - len(baseline)))
+        for index, rtt in enumerate(rtts):
+            if rtt is None:
+                continue
+            usual = baseline[index]
+            if usual is not None and rtt >= usual * self.latency_factor and rtt - usual >= self.latency_min_ms:
+                changes.append({'type': 'latency_shift', 'target': target, 'timestamp': timestamp,
+                                'hop': index + 1, 'address': self.routes[route_id][index],
+                                'usual_ms': round(usual, 2), 'rtt_ms': rtt})
+            baseline[index] = rtt if usual is None else usual + self.alpha * (rtt - usual)
+
+        return changes
+
+    def history(self, target):
+        """
+        Traces of a target kept in memory, oldest first
+        :param target: traced server
+        :return: list of (timestamp, route, per-hop latencies)
+        """
+        with self.lock:
+            return [(timestamp, self.routes[route_id], rtts)
+                    for timestamp, route_id, rtts in self.traces.get(target, ())]
+
+    def summary(self):
+        """
+        Per target trace counts, distinct routes, route changes and current route
+        :return: dictionary of target to a summary dict
+        """
+        with self.lock:
+            return {target: {'traces': len(traces),
+                             'routes': len({route_id for timestamp, route_id, rtts in traces}),
+                             'route_changes': self.route_changes[target],
+                             'current': list(self.routes[self.current[target]])}
+                    for target, traces in self.traces.items()}
+
+    def compact_if_needed(self):
+        """
+        Rewrite the history file with only the traces kept in memory, once it holds twice as many, so that
+        it does not grow forever and loading it stays fast. Caller must hold the lock.
+        :return: None
+        """
+        if not self.file or self.file_traces <= 2 * self.kept_traces:
+            return
+
+        # Through a temp file and rename, a crash leaves the old or the new history
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            for route_id, route in enumerate(self.routes):
+                file.write(json.dumps({'id': route_id, 'route': list(route)}, separators=(',', ':')) + "\n")
+            for target, traces in self.traces.items():
+                for timestamp, route_id, rtts in traces:
+                    file.write(json.dumps({'target': target, 't': timestamp, 'id': route_id, 'rtt': rtts},
+                                          separators=(',', ':')) + "\n")
+        os.replace(temp_path, self.path)
+        self.file.close()
+        self.file = open(self.path, "a", buffering=1)
+        self.file_traces = self.kept_traces
+
+    def write(self, entry):
+        """
+        Append an entry to the history file. Caller must hold the lock.
+        :param entry: json serializable entry
+        :return: None
+        """
+        if self.file:
+            self.file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+    def emit(self, result):
+        """
+        Record the trace of an ICMP check result
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        if result.get('hops'):
+            self.record(result['server'], result['timestamp'], result['hops'])
+
+    def reopen(self):
+        """
+        Reopen the history file, e.g. after it was rotated
+        :return: None
+        """
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = open(self.path, "a", buffering=1)
+
+                # Traces only reference routes by id, so a fresh file needs the routes again
+                if self.file.tell() == 0:
+                    for route_id, route in enumerate(self.routes):
+                        self.write({'id': route_id, 'route': list(route)})
+
+    def close(self):
+        """
+        Close the history file
+        :return: None
+        """
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def format_change(change):
+    """
+    Format a detected path change as a single line of text
+    :param change: change returned by PathHistory.record
+    :return: formatted string
+    """
+    if change['type'] == 'route_change':
+        return (f"[{change['timestamp']}] Route to {change['target']} changed at hops "
+                f"{', '.join(map(str, change['changed_hops']))}: {' > '.join(change['old'])} => {' > '.join(change['new'])}")
+    return (f"[{change['timestamp']}] Latency to hop {change['hop']} ({change['address']}) on the way to "
+            f"{change['target']} rose to {change['rtt_ms']:.2f} ms from {change['usual_ms']:.2f} ms")
@@ -1,7 +1,4 @@
-import json
-from prompt_toolkit import PromptSession
-from prompt_toolkit.completion import WordCompleter
-from prompt_toolkit.validation import Validator
+# prompt_toolkit is imported inside each prompt so that importing this module stays cheap
 
 
 def home_command_prompt(prompt_msg):
@@ -10,6 +7,10 @@ def home_command_prompt(prompt_msg):
     :param prompt_msg: prompt message defined in main
     :return: None
     """
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.completion import WordCompleter
+    from prompt_toolkit.validation import Validator
+
     # Define available main commands
     home_commands = [
         'add-server',
@@ -17,7 +18,9 @@ def home_command_prompt(prompt_msg):
         'delete-server',
         'show-servers',
         'monitor-server',
+        'monitor-group',
         'monitor-all',
+        'stats',
         'exit'
     ]
 
@@ -41,8 +44,12 @@ def service_prompt(prompt_msg):
     :param prompt_msg: prompt message defined in main
     :return: None
     """
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.completion import WordCompleter
+    from prompt_toolkit.validation import Validator
+
     # Define available services
-    services = ['ICMP', 'HTTP', 'HTTPS', 'NTP', 'DNS', 'TCP', 'UDP', 'LOCAL TCP']
+    services = ['ICMP', 'HTTP', 'HTTPS', 'TLS', 'NTP', 'DNS', 'TCP', 'UDP', 'LOCAL TCP']
 
     # Initialize auto-completer and validator for prompt session
     completer: WordCompleter = WordCompleter(services, ignore_case=True)
@@ -64,8 +71,12 @@ def edit_command_prompt(prompt_msg):
     :param prompt_msg: prompt message defined in main
     :return: None
     """
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.completion import WordCompleter
+    from prompt_toolkit.validation import Validator
+
     # Define available commands for editing a server
-    edit_commands = ['add-service', 'edit-service', 'delete-service']
+    edit_commands = ['add-service', 'edit-service', 'delete-service', 'edit-tags']
 
     # Initialize auto-completer and validator for prompt session
     completer: WordCompleter = WordCompleter(edit_commands, ignore_case=True)
@@ -87,6 +98,9 @@ def record_type_prompt(prompt_msg):
     :param prompt_msg: prompt message defined in main
     :return: user's input
     """
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.completion import WordCompleter
+
     # Define available record types
     record_types = ['A', 'MX', 'AAAA', 'CNAME', 'ANAME', 'NS', 'SOA', 'TXT', 'PTR', 'SRV', 'SPF']
 
@@ -100,28 +114,34 @@ def record_type_prompt(prompt_msg):
     return prompt.prompt(f"{prompt_msg}")
 
 
-def server_prompt(prompt_msg):
+def server_prompt(prompt_msg, registry):
     """
     Prompt user for a server to work with
     :param prompt_msg: prompt message defined in main
+    :param registry: ServerRegistry of the configured servers
     :return: None
     """
-    # Get server dict from json file
-    with open("server_dict.json", "r") as file:
-        server_dict = json.loads(file.read())
-
-    # Get current servers from server dict
-    servers = list(server_dict.keys())
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.completion import Completer, Completion
+    from prompt_toolkit.validation import Validator
+
+    class ServerCompleter(Completer):
+        """
+        Completes from the registry's sorted name index rather than scanning every server
+        """
+        def get_completions(self, document, complete_event):
+            text = document.text_before_cursor
+            for server in registry.search(text):
+                yield Completion(server, start_position=-len(text))
 
     # Initialize auto-completer and validator for prompt session
-    completer: WordCompleter = WordCompleter(servers, ignore_case=True)
     validator = Validator.from_callable(
-        lambda text: text in servers,
+        lambda text: text in registry,
         error_message=f"This is not an existing server!",
         move_cursor_to_end=True)
 
     # Start prompt session
-    prompt: PromptSession = PromptSession(completer=completer, validator=validator)
+    prompt: PromptSession = PromptSession(completer=ServerCompleter(), validator=validator)
 
     # Prompt and return the input
     return prompt.prompt(f"{prompt_msg}")
@@ -0,0 +1,286 @@
+import socket
+import threading
+import time
+
+# Address families the probes use, other getaddrinfo results (e.g. AF_PACKET on some systems) are skipped
+FAMILIES = (socket.AF_INET, socket.AF_INET6)
+
+# Record types looked up for the TTL of each address family, when enabled and dnspython is installed
+TTL_RECORD_TYPES = {socket.AF_INET: ("A",), socket.AF_INET6: ("AAAA",), socket.AF_UNSPEC: ("A", "AAAA")}
+
+
+def address_family(host):
+    """
+    :param host: host name or address literal
+    :return: AF_INET or AF_INET6 if host is an IPv4 or IPv6 address, which needs no resolution, otherwise None
+    """
+    for family in FAMILIES:
+        try:
+            socket.inet_pton(family, host)
+            return family
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def with_port(sockaddr, port):
+    """
+    :param sockaddr: IPv4 (host, port) or IPv6 (host, port, flowinfo, scope_id) socket address
+    :param port: port to put in it
+    :return: copy of the socket address with the port
+    """
+    return (sockaddr[0], port or 0) + tuple(sockaddr[2:])
+
+
+class ResolutionCache:
+    """
+    Process-wide cache of host name resolutions shared by every probe. Answers are kept for default_ttl, or
+    with read_ttl for their DNS TTL, which is looked up with dnspython in the background once the answer is
+    stored so that it never delays a probe. Failures are kept for negative_ttl. An answer
+    that is used after refresh_ahead of its lifetime is refreshed in the background, so busy names never
+    expire in front of a probe, and concurrent lookups of the same name wait for a single resolution.
+    Also keeps per-thread timing so that probes can report resolution time separately from their latency.
+    """
+    def __init__(self, default_ttl=60, negative_ttl=10, min_ttl=5, max_ttl=3600, refresh_ahead=0.8, read_ttl=False):
+        """
+        :param default_ttl: seconds to keep an answer whose TTL is unknown
+        :param negative_ttl: seconds to keep a failed lookup
+        :param min_ttl: shortest time an answer is kept, however low its TTL
+        :param max_ttl: longest time an answer is kept, however high its TTL
+        :param refresh_ahead: share of an answer's lifetime after which using it triggers a background refresh
+        :param read_ttl: look up the TTL of every answer with dnspython, which costs extra DNS queries
+        """
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.refresh_ahead = refresh_ahead
+        self.read_ttl = read_ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.running = {}
+        self.local = threading.local()
+        self.dns_resolver = None
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+        self.refreshes = 0
+
+    def resolve(self, host, port=None, family=socket.AF_UNSPEC):
+        """
+        Resolve a host name to its addresses, from the cache where possible
+        :param host: host name or address literal
+        :param port: port to put in the socket addresses, None for 0
+        :param family: AF_INET or AF_INET6 to only resolve one family, AF_UNSPEC for both
+        :return: list of (address family, socket address) in the order the system prefers them
+        :raises socket.gaierror: if the host does not resolve, also while a failed lookup is cached
+        """
+        literal = address_family(host)
+        if literal:
+            # Literals are only parsed, which is neither cached nor counted as resolution time
+            if family not in (socket.AF_UNSPEC, literal):
+                raise socket.gaierror(socket.EAI_NONAME, f"{host} is not an address of the requested family")
+            addresses = [(literal, (host, 0) if literal == socket.AF_INET else (host, 0, 0, 0))]
+        else:
+            start = time.perf_counter()
+            try:
+                addresses = self.cached(host.lower().rstrip("."), family)
+            finally:
+                self.local.elapsed = getattr(self.local, 'elapsed', 0.0) + time.perf_counter() - start
+                self.local.lookups = getattr(self.local, 'lookups', 0) + 1
+        return [(af, with_port(sockaddr, port)) for af, sockaddr in addresses]
+
+    def cached(self, host, family):
+        """
+        Get the answer for a name from the cache, resolving it if it is missing or expired
+        :param host: normalized host name
+        :param family: address family to resolve
+        :return: list of (address family, socket address with port 0)
+        """
+        key = (host, family)
+        with self.lock:
+            now = time.monotonic()
+            entry = self.entries.get(key)
+            if entry and now < entry['expires']:
+                if entry['error']:
+                    self.negative_hits += 1
+                    raise socket.gaierror(*entry['error'])
+                self.hits += 1
+                if now >= entry['refresh'] and key not in self.running:
+                    # Refresh in the background while this and later callers keep using the answer
+                    self.running[key] = threading.Event()
+                    self.refreshes += 1
+                    threading.Thread(target=self.refresh, args=(key,), name="resolve-refresh", daemon=True).start()
+                return entry['addresses']
+
+            # Single flight: the first caller resolves, the others wait for its answer
+            done = self.running.get(key)
+            leader = done is None
+            if leader:
+                done = self.running[key] = threading.Event()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            self.refresh(key)
+        else:
+            done.wait()
+
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            # Invalidated in the meantime
+            return self.cached(host, family)
+        if entry['error']:
+            raise socket.gaierror(*entry['error'])
+        return entry['addresses']
+
+    def refresh(self, key):
+        """
+        Resolve a name and store the answer, waking the callers waiting for it
+        :param key: tuple of (normalized host name, address family)
+        :return: None
+        """
+        host, family = key
+        try:
+            entry = {'addresses': self.lookup(host, family), 'error': None, 'ttl': self.default_ttl}
+        except socket.gaierror as e:
+            entry = {'addresses': [], 'error': e.args, 'ttl': self.negative_ttl}
+        except Exception as e:
+            entry = {'addresses': [], 'error': (socket.EAI_FAIL, str(e)), 'ttl': self.negative_ttl}
+
+        with self.lock:
+            now = time.monotonic()
+            previous = self.entries.get(key)
+            # A failed background refresh keeps the answer it was meant to replace until that expires
+            stored = not (entry['error'] and previous and not previous['error'] and now < previous['expires'])
+            if stored:
+                self.set_lifetime(entry, now, entry['ttl'])
+                self.entries[key] = entry
+            self.running.pop(key).set()
+
+        if stored and self.read_ttl and not entry['error']:
+            threading.Thread(target=self.adjust_ttl, args=(key, entry), name="resolve-ttl", daemon=True).start()
+
+    def set_lifetime(self, entry, stored_at, ttl):
+        """
+        Set when an answer expires and when it is refreshed. Caller must hold the lock.
+        :param entry: cache entry
+        :param stored_at: monotonic time the answer was stored
+        :param ttl: seconds to keep the answer
+        :return: None
+        """
+        entry['stored'] = stored_at
+        entry['ttl'] = ttl
+        entry['expires'] = stored_at + ttl
+        entry['refresh'] = stored_at + ttl * self.refresh_ahead if not entry['error'] else entry['expires']
+
+    def adjust_ttl(self, key, entry):
+        """
+        Replace the default lifetime of a stored answer with its DNS TTL. Runs in the background, a name
+        that is not in DNS (e.g. only in the hosts file) or an unreachable DNS server keeps the default.
+        :param key: tuple of (normalized host name, address family)
+        :param entry: cache entry stored for the name
+        :return: None
+        """
+        ttl = self.record_ttl(*key)
+        if ttl is None:
+            return
+        with self.lock:
+            if self.entries.get(key) is entry:
+                self.set_lifetime(entry, entry['stored'], min(max(ttl, self.min_ttl), self.max_ttl))
+
+    def lookup(self, host, family):
+        """
+        Resolve a name with the system resolver, which honours the hosts file and orders the addresses
+        :param host: host name
+        :param family: address family to resolve
+        :return: list of (address family, socket address with port 0)
+        """
+        addresses = []
+        for af, _, _, _, sockaddr in socket.getaddrinfo(host, None, family, socket.SOCK_STREAM):
+            if af in FAMILIES and (af, sockaddr) not in addresses:
+                addresses.append((af, sockaddr))
+        if not addresses:
+            raise socket.gaierror(socket.EAI_NONAME, f"{host} has no IPv4 or IPv6 address")
+        return addresses
+
+    def record_ttl(self, host, family):
+        """
+        Look up the TTL of a name's address records, the system resolver does not report it
+        :param host: host name
+        :param family: address family the records are for
+        :return: lowest TTL in seconds, or None if dnspython is not installed or the records are not in DNS
+        """
+        try:
+            import dns.exception
+            import dns.resolver
+        except ImportError:
+            return None
+
+        with self.lock:
+            if self.dns_resolver is None:
+                self.dns_resolver = dns.resolver.Resolver()
+                self.dns_resolver.lifetime = 2
+            dns_resolver = self.dns_resolver
+        ttls = []
+        for record_type in TTL_RECORD_TYPES.get(family, ()):
+            try:
+                answer = dns_resolver.resolve(host, record_type, raise_on_no_answer=False)
+            except (dns.exception.DNSException, OSError):
+                continue
+            if answer.rrset is not None:
+                ttls.append(answer.rrset.ttl)
+        return min(ttls) if ttls else None
+
+    def start_timing(self):
+        """
+        Start counting the time this thread spends resolving names
+        :return: None
+        """
+        self.local.elapsed = 0.0
+        self.local.lookups = 0
+
+    def stop_timing(self):
+        """
+        :return: milliseconds this thread spent resolving names since start_timing, None if it resolved none
+        """
+        lookups, elapsed = getattr(self.local, 'lookups', 0), getattr(self.local, 'elapsed', 0.0)
+        self.start_timing()
+        return elapsed * 1000 if lookups else None
+
+    def invalidate(self, host=None):
+        """
+        Drop cached answers
+        :param host: name to drop, None for every name
+        :return: None
+        """
+        with self.lock:
+            for key in list(self.entries):
+                if host is None or key[0] == host.lower().rstrip("."):
+                    del self.entries[key]
+
+    def stats(self):
+        """
+        Cache statistics
+        :return: dictionary with hits, misses, cached failures, lookups that waited for another one,
+        background refreshes, the share of lookups answered from the cache without waiting and the number
+        of cached names
+        """
+        with self.lock:
+            total = self.hits + self.negative_hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'negative_hits': self.negative_hits,
+                'coalesced': self.coalesced,
+                'refreshes': self.refreshes,
+                'hit_rate': (self.hits + self.negative_hits) / total if total else 0.0,
+                'names': len(self.entries)
+            }
+
+
+# Shared by every probe in the process
+cache = ResolutionCache()
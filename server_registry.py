@@ -0,0 +1,205 @@
+import bisect
+from config_schema import get_services
+from config_store import ConfigStore
+
+# Well known ports of services that do not configure one
+DEFAULT_PORTS = {'HTTP': 80, 'HTTPS': 443, 'TLS': 443, 'NTP': 123, 'DNS': 53}
+
+
+class ServerRegistry:
+    """
+    In-process copy of the server dict, loaded once and kept indexed by server name, protocol, tag and port
+    so lookups, completion and paging stay fast with tens of thousands of servers. Changes are written
+    through to the config store.
+    """
+    def __init__(self, store=None):
+        """
+        :param store: ConfigStore to load from and persist to
+        """
+        self.store = store or ConfigStore("server_dict.json")
+        self.server_dict = {}
+        self.signature = None
+        self.clear_indexes()
+
+    def clear_indexes(self):
+        """
+        Reset every index
+        :return: None
+        """
+        self.sorted_names = []
+        self.by_protocol = {}
+        self.by_tag = {}
+        self.by_port = {}
+        self.indexed = {}
+
+    def load(self):
+        """
+        Load the server dict from the store and rebuild the indexes
+        :return: None
+        """
+        self.signature = self.store.signature()
+        self.server_dict = self.store.load()
+        self.build_indexes()
+
+    @classmethod
+    def from_dict(cls, server_dict):
+        """
+        Build an index over a server dict that is not tied to the config file, e.g. in the headless engine
+        :param server_dict: dictionary with server and service information
+        :return: ServerRegistry
+        """
+        registry = cls()
+        registry.server_dict = server_dict
+        registry.build_indexes()
+        return registry
+
+    def build_indexes(self):
+        """
+        Rebuild every index from the server dict
+        :return: None
+        """
+        self.clear_indexes()
+        for server in self.server_dict:
+            self.index(server)
+        self.sorted_names = sorted(self.server_dict, key=str.lower)
+
+    def refresh(self):
+        """
+        Reload only if another process changed the config since it was loaded
+        :return: True if the config was reloaded
+        """
+        if self.store.signature() == self.signature:
+            return False
+        self.load()
+        return True
+
+    def index(self, server):
+        """
+        Add a server to the protocol, tag and port indexes
+        :param server: server to index
+        :return: None
+        """
+        services = self.server_dict[server]
+        protocols = list(get_services(services))
+        tags = [f"{key}={value}" for key, value in services.get('tags', {}).items()]
+        ports = [services[protocol].get('port', DEFAULT_PORTS.get(protocol)) for protocol in protocols]
+
+        for keys, index in ((protocols, self.by_protocol), (tags, self.by_tag), (ports, self.by_port)):
+            for key in keys:
+                if key is not None:
+                    index.setdefault(key, set()).add(server)
+
+        # Remember what was indexed so it can be removed even if the dict is edited in place
+        self.indexed[server] = (protocols, tags, ports)
+
+    def unindex(self, server):
+        """
+        Remove a server from the protocol, tag and port indexes
+        :param server: server to remove
+        :return: None
+        """
+        protocols, tags, ports = self.indexed.pop(server, ((), (), ()))
+        for keys, index in ((protocols, self.by_protocol), (tags, self.by_tag), (ports, self.by_port)):
+            for key in keys:
+                if key in index:
+                    index[key].discard(server)
+                    if not index[key]:
+                        del index[key]
+
+    def set_server(self, server, services):
+        """
+        Add or replace a server, update the indexes and persist it
+        :param server: server to add or replace
+        :param services: dictionary of the server's services and their params
+        :return: None
+        """
+        if server not in self.indexed:
+            position = bisect.bisect_left(self.sorted_names, server.lower(), key=str.lower)
+            self.sorted_names.insert(position, server)
+        self.unindex(server)
+        self.server_dict[server] = services
+        self.index(server)
+        self.store.set_server(server, services)
+        self.signature = self.store.signature()
+
+    def delete_server(self, server):
+        """
+        Delete a server, update the indexes and persist the deletion
+        :param server: server to delete
+        :return: None
+        """
+        if server in self.indexed:
+            position = bisect.bisect_left(self.sorted_names, server.lower(), key=str.lower)
+            while self.sorted_names[position] != server:
+                position += 1
+            del self.sorted_names[position]
+        self.unindex(server)
+        self.server_dict.pop(server, None)
+        self.store.delete_server(server)
+        self.signature = self.store.signature()
+
+    def __contains__(self, server):
+        return server in self.server_dict
+
+    def __len__(self):
+        return len(self.server_dict)
+
+    def search(self, text, limit=50):
+        """
+        Find servers for the completer: case-insensitive prefix matches first, then substring matches
+        :param text: text typed so far
+        :param limit: maximum number of matches
+        :return: list of server names
+        """
+        text = text.lower()
+        matches = []
+
+        # Prefix matches are a contiguous run of the sorted names
+        position = bisect.bisect_left(self.sorted_names, text, key=str.lower)
+        while position < len(self.sorted_names) and len(matches) < limit:
+            name = self.sorted_names[position]
+            if not name.lower().startswith(text):
+                break
+            matches.append(name)
+            position += 1
+
+        # Fill up with names that contain the text elsewhere
+        if text and len(matches) < limit:
+            for name in self.sorted_names:
+                if text in name.lower() and not name.lower().startswith(text):
+                    matches.append(name)
+                    if len(matches) == limit:
+                        break
+
+        return matches
+
+    def page(self, number, page_size=20):
+        """
+        Get one page of servers in name order
+        :param number: page number, starting at 0
+        :param page_size: servers per page
+        :return: list of server names
+        """
+        return self.sorted_names[number * page_size:(number + 1) * page_size]
+
+    def servers_with_protocol(self, protocol):
+        """
+        :param protocol: protocol such as HTTPS
+        :return: set of servers with a service of that protocol
+        """
+        return self.by_protocol.get(protocol, set())
+
+    def servers_with_tag(self, key, value):
+        """
+        :param key: tag name
+        :param value: tag value
+        :return: set of servers carrying the tag
+        """
+        return self.by_tag.get(f"{key}={value}", set())
+
+    def servers_with_port(self, port):
+        """
+        :param port: port number
+        :return: set of servers with a service on that port
+        """
+        return self.by_port.get(port, set())
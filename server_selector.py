@@ -0,0 +1,74 @@
+import fnmatch
+from config_schema import METADATA_KEYS, get_services, parse_tags
+from server_registry import DEFAULT_PORTS, ServerRegistry
+
+
+def parse_selector(text):
+    """
+    Parse a selector such as "env=prod,proto=HTTPS". proto, port and server are built in keys,
+    server accepts shell style wildcards, and any other key matches a server tag.
+    :param text: selector text
+    :return: dictionary of key to value
+    """
+    selector = parse_tags(text)
+    if 'proto' in selector:
+        selector['proto'] = selector['proto'].upper()
+    if 'port' in selector:
+        selector['port'] = int(selector['port'])
+    return selector
+
+
+def resolve_selector(registry, selector):
+    """
+    Find the checks matching a selector by intersecting the registry's indexes
+    :param registry: ServerRegistry of the configured servers
+    :param selector: parsed selector
+    :return: dictionary of matching server to the list of its matching services
+    """
+    # Start from the smallest index lookups and narrow down
+    candidates = []
+    for key, value in selector.items():
+        if key == 'proto':
+            candidates.append(registry.servers_with_protocol(value))
+        elif key == 'port':
+            candidates.append(registry.servers_with_port(value))
+        elif key != 'server':
+            candidates.append(registry.servers_with_tag(key, value))
+    candidates.sort(key=len)
+
+    if candidates:
+        servers = set(candidates[0]).intersection(*candidates[1:])
+    else:
+        servers = set(registry.server_dict)
+
+    if 'server' in selector:
+        servers = {server for server in servers if fnmatch.fnmatch(server, selector['server'])}
+
+    # Only keep the services the selector asked for
+    matches = {}
+    for server in servers:
+        services = []
+        for service, params in get_services(registry.server_dict[server]).items():
+            port = params.get('port', DEFAULT_PORTS.get(service))
+            if selector.get('proto', service) == service and selector.get('port', port) == port:
+                services.append(service)
+        if services:
+            matches[server] = services
+    return matches
+
+
+def select_server_dict(server_dict, selector):
+    """
+    Cut a server dict down to the servers and services matching a selector, keeping the servers' metadata
+    :param server_dict: dictionary with server and service information
+    :param selector: parsed selector, or None to keep everything
+    :return: new dictionary with only the matching checks
+    """
+    if not selector:
+        return server_dict
+    registry = ServerRegistry.from_dict(server_dict)
+    selected = {}
+    for server, services in resolve_selector(registry, selector).items():
+        selected[server] = {key: server_dict[server][key] for key in METADATA_KEYS if key in server_dict[server]}
+        selected[server].update({service: server_dict[server][service] for service in services})
+    return selected
@@ -1,15 +1,33 @@
 import shutil
 from datetime import datetime
+import resolution
 from network_tests import *
+from path_history import format_change
 
 
-def icmp_service_check(server_dict, server, lock, event):
+def print_check(lock, title, lines):
+    """
+    Print the output of one check as a block, holding the lock only while printing so that a slow
+    probe never keeps the other checks from reporting
+    :param lock: thread lock to prevent overlapping output
+    :param title: name of the check shown in the header
+    :param lines: output lines of the check
+    :return: None
+    """
+    columns, _ = shutil.get_terminal_size()
+    text = "\n".join([f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {title}", "=" * columns] + lines)
+    with lock:
+        print(text)
+
+
+def icmp_service_check(server_dict, server, lock, event, paths=None):
     """
     Runs icmp service check on timer set by interval variable
     :param server_dict: dictionary with server and service information
     :param server: server the program is currently monitoring
     :param lock: thread lock to prevent overlapping output
     :param event: event to trigger killing thread
+    :param paths: PathHistory recording every trace, or None
     :return: None
     """
     # Extract variables
@@ -24,30 +42,32 @@ def icmp_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
-        lock.acquire()
+        # Verbose traces print every hop as it is probed, so they hold the lock for the whole check
+        if verbose:
+            lock.acquire()
         try:
-            # Header
-            columns, lines = shutil.get_terminal_size()
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ICMP Service Check")
-            print("=" * columns)
-
-            # Ping Test
-            print("Ping Test:")
             ping_addr, ping_time = ping(server, ttl, timeout, sequence_number)
-            if ping_addr and ping_time:
-                print(f"{server} (ping): {ping_addr[0]} - {ping_time:.2f} ms")
-            else:
-                print(f"{server} (ping): Request timed out or no reply received")
+            hops = traceroute_hops(server, max_hops, pings_per_hop, verbose)
+        finally:
+            if verbose:
+                lock.release()
 
-            # Traceroute Test
-            print("\nTraceroute Test:")
-            print(f"{server} (traceroute):")
-            print(traceroute(server, max_hops, pings_per_hop, verbose))
+        # Ping Test
+        lines = ["Ping Test:"]
+        if ping_addr and ping_time:
+            lines.append(f"{server} (ping): {ping_addr[0]} - {ping_time:.2f} ms")
+        else:
+            lines.append(f"{server} (ping): Request timed out or no reply received")
 
-        finally:
-            # Release lock
-            lock.release()
+        # Traceroute Test
+        lines += ["\nTraceroute Test:", f"{server} (traceroute):", format_traceroute(hops)]
+
+        # Flag route changes and latency shifts since the previous traces
+        if paths:
+            for change in paths.record(server, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), hops):
+                lines.append(format_change(change))
+
+        print_check(lock, "ICMP Service Check", lines)
 
         # Sleep the loop for the given interval
         event.wait(interval)
@@ -69,22 +89,12 @@ def http_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
-        lock.acquire()
-        try:
-            # Header
-            columns, lines = shutil.get_terminal_size()
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] HTTP Service Check")
-            print("=" * columns)
-
-            # HTTP Request
-            print(f"Sending HTTP Request to {server} ... ")
-            http_server_status, http_server_response_code = check_server_http(http_url)
-            print(f"HTTP URL: {http_url}, HTTP server status: {http_server_status}, Status Code: {http_server_response_code if http_server_response_code is not None else 'N/A'}")
-
-        finally:
-            # Release lock
-            lock.release()
+        # HTTP Request, printed once the response arrived
+        http_server_status, http_server_response_code = check_server_http(http_url)
+        print_check(lock, "HTTP Service Check", [
+            f"Sending HTTP Request to {server} ... ",
+            f"HTTP URL: {http_url}, HTTP server status: {http_server_status}, Status Code: {http_server_response_code if http_server_response_code is not None else 'N/A'}"
+        ])
 
         # Sleep the loop for the given interval
         event.wait(interval)
@@ -107,22 +117,42 @@ def https_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
-        lock.acquire()
-        try:
-            # Header
-            columns, lines = shutil.get_terminal_size()
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] HTTPS Service Check")
-            print("=" * columns)
+        # HTTP Request, printed once the response arrived
+        https_server_status, https_server_response_code, description = check_server_https(https_url, timeout)
+        print_check(lock, "HTTPS Service Check", [
+            f"Sending HTTPS Request to {server} ... ",
+            f"HTTP URL: {https_url}, HTTP server status: {https_server_status}, Status Code: {https_server_response_code if https_server_response_code is not None else 'N/A'}, Description: {description}"
+        ])
 
-            # HTTP Request
-            print(f"Sending HTTPS Request to {server} ... ")
-            https_server_status, https_server_response_code, description = check_server_https(https_url, timeout)
-            print(f"HTTP URL: {https_url}, HTTP server status: {https_server_status}, Status Code: {https_server_response_code if https_server_response_code is not None else 'N/A'}, Description: {description}")
+        # Sleep the loop for the given interval
+        event.wait(interval)
 
-        finally:
-            # Release lock
-            lock.release()
+
+def tls_service_check(server_dict, server, lock, event):
+    """
+    Runs tls service check on timer set by interval variable
+    :param server_dict: dictionary with server and service information
+    :param server: server the program is currently monitoring
+    :param lock: thread lock to prevent overlapping output
+    :param event: event to trigger killing thread
+    :return: None
+    """
+    # Extract variables
+    port = server_dict[server]["TLS"]["port"]
+    timeout = server_dict[server]["TLS"]["timeout"]
+    expiry_days = server_dict[server]["TLS"]["expiry_days"]
+    resume = server_dict[server]["TLS"]["resume"]
+    interval = server_dict[server]["TLS"]["interval"]
+
+    # Loop until thread event is set
+    while not event.is_set():
+
+        # TLS handshake, printed once it completed
+        tls_status, tls_description, tls_info = check_tls(server, port, timeout, expiry_days, resume)
+        print_check(lock, "TLS Service Check", [
+            f"Starting TLS Handshake with {server} at Port {port} ... ",
+            f"Server: {server}, TLS Port: {port}, TLS Status: {tls_status}, Description: {tls_description}"
+        ])
 
         # Sleep the loop for the given interval
         event.wait(interval)
@@ -143,22 +173,12 @@ def ntp_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
-        lock.acquire()
-        try:
-            # Header
-            columns, lines = shutil.get_terminal_size()
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] NTP Service Check")
-            print("=" * columns)
-
-            # NTP Test
-            print(f"Testing Status of NTP Server {server} ... ")
-            ntp_server_status, ntp_server_time = check_ntp_server(server)
-            print(f"{server} is up. Time: {ntp_server_time}" if ntp_server_status else f"{server} is down.")
-
-        finally:
-            # Release lock
-            lock.release()
+        # NTP Test
+        ntp_server_status, ntp_server_time = check_ntp_server(server)
+        print_check(lock, "NTP Service Check", [
+            f"Testing Status of NTP Server {server} ... ",
+            f"{server} is up. Time: {ntp_server_time}" if ntp_server_status else f"{server} is down."
+        ])
 
         # Sleep the loop for the given interval
         event.wait(interval)
@@ -182,23 +202,12 @@ def dns_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
-        lock.acquire()
-        try:
-            # Header
-            columns, lines = shutil.get_terminal_size()
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] DNS Service Check")
-            print("=" * columns)
-
-            # DNS Test
-            print(f"Querying DNS Server {dns_server} with Server {query} ... ")
-            for dns_record_type in record_types:
-                dns_server_status, dns_query_results = check_dns_server_status(dns_server, query, dns_record_type)
-                print(f"DNS Server: {dns_server}, Status: {dns_server_status}, {dns_record_type} Records Results: {dns_query_results}")
-
-        finally:
-            # Release lock
-            lock.release()
+        # DNS Test
+        lines = [f"Querying DNS Server {dns_server} with Server {query} ... "]
+        for dns_record_type in record_types:
+            dns_server_status, dns_query_results = check_dns_server_status(dns_server, query, dns_record_type)
+            lines.append(f"DNS Server: {dns_server}, Status: {dns_server_status}, {dns_record_type} Records Results: {dns_query_results}")
+        print_check(lock, "DNS Service Check", lines)
 
         # Sleep the loop for the given interval
         event.wait(interval)
@@ -220,22 +229,12 @@ def tcp_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
-        lock.acquire()
-        try:
-            # Header
-            columns, lines = shutil.get_terminal_size()
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] TCP Service Check")
-            print("=" * columns)
-
-            # TCP test
-            print(f"Testing TCP to Server {server} at Port {port} ... ")
-            tcp_port_status, tcp_port_description = check_tcp_port(server, port)
-            print(f"Server: {server}, TCP Port: {port}, TCP Port Status: {tcp_port_status}, Description: {tcp_port_description}")
-
-        finally:
-            # Release lock
-            lock.release()
+        # TCP test
+        tcp_port_status, tcp_port_description = check_tcp_port(server, port)
+        print_check(lock, "TCP Service Check", [
+            f"Testing TCP to Server {server} at Port {port} ... ",
+            f"Server: {server}, TCP Port: {port}, TCP Port Status: {tcp_port_status}, Description: {tcp_port_description}"
+        ])
 
         # Sleep the loop for the given interval
         event.wait(interval)
@@ -258,22 +257,12 @@ def udp_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
-        lock.acquire()
-        try:
-            # Header
-            columns, lines = shutil.get_terminal_size()
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] UDP Service Check")
-            print("=" * columns)
-
-            # TCP test
-            print(f"Testing UDP to Server {server} at Port {port} ... ")
-            udp_port_status, udp_port_description = check_udp_port(server, port, timeout)
-            print(f"Server: {server}, UDP Port: {port}, UDP Port Status: {udp_port_status}, Description: {udp_port_description}")
-
-        finally:
-            # Release lock
-            lock.release()
+        # UDP test
+        udp_port_status, udp_port_description = check_udp_port(server, port, timeout)
+        print_check(lock, "UDP Service Check", [
+            f"Testing UDP to Server {server} at Port {port} ... ",
+            f"Server: {server}, UDP Port: {port}, UDP Port Status: {udp_port_status}, Description: {udp_port_description}"
+        ])
 
         # Sleep the loop for the given interval
         event.wait(interval)
@@ -295,7 +284,7 @@ def local_tcp_service_check(server_dict, server, lock, event):
     # Loop until thread event is set
     while not event.is_set():
 
-        # Set lock
+        # Set lock, the echo transcript is printed as it is exchanged so it is held while probing
         lock.acquire()
         try:
             # Header
@@ -312,4 +301,99 @@ def local_tcp_service_check(server_dict, server, lock, event):
             lock.release()
 
         # Sleep the loop for the given interval
-        event.wait(interval)
\ No newline at end of file
+        event.wait(interval)
+
+
+def probe_service(server, service, params):
+    """
+    Runs a single check of one service and returns the result as a record instead of printing it.
+    Used by the headless monitoring engine, where results are written to sinks rather than the terminal.
+    :param server: server the service belongs to
+    :param service: protocol of the service (ICMP, HTTP, HTTPS, TLS, NTP, DNS, TCP, UDP, LOCAL TCP)
+    :param params: parameters of the service from the server dict
+    :return: dict with timestamp, server, service, status, latency_ms and detail, plus hops and traceroute_ms for ICMP,
+             tls for TLS and resolve_ms, the time spent resolving names, which is not part of latency_ms, if the check
+             resolved any
+    """
+    # Time the whole check, and the name resolution within it
+    start = time.perf_counter()
+    resolution.cache.start_timing()
+    hops = tls = end = round_trip_ms = traceroute_ms = None
+
+    try:
+        if service == "ICMP":
+            ping_addr, ping_time = ping(server, params['ttl'], params['timeout'], params['sequence_number'])
+            end = time.perf_counter()
+            status = bool(ping_addr and ping_time)
+            round_trip_ms = ping_time if status else None
+            detail = f"{ping_addr[0]} - {ping_time:.2f} ms" if status else "Request timed out or no reply received"
+
+            # The traceroute is timed on its own, the latency of the check is the ping's round trip
+            hops = traceroute_hops(server, params['max_hops'], params['pings_per_hop'], False)
+            traceroute_ms = (time.perf_counter() - end) * 1000
+            detail += "\n" + format_traceroute(hops)
+
+        elif service == "HTTP":
+            status, code = check_server_http(params['url'])
+            detail = f"HTTP URL: {params['url']}, Status Code: {code if code is not None else 'N/A'}"
+
+        elif service == "HTTPS":
+            status, code, description = check_server_https(params['url'], params['timeout'])
+            detail = f"HTTPS URL: {params['url']}, Status Code: {code if code is not None else 'N/A'}, Description: {description}"
+
+        elif service == "TLS":
+            status, detail, tls = check_tls(server, params['port'], params['timeout'], params['expiry_days'],
+                                            params['resume'])
+
+        elif service == "NTP":
+            status, ntp_time = check_ntp_server(server)
+            detail = f"Time: {ntp_time}" if status else f"{server} is down."
+
+        elif service == "DNS":
+            status, details = True, []
+            for record_type in params['record_types']:
+                record_status, results = check_dns_server_status(params['dns_server'], params['query'], record_type)
+                status = status and record_status
+                details.append(f"{record_type}: {results}")
+            detail = f"DNS Server: {params['dns_server']}, " + ", ".join(details)
+
+        elif service == "TCP":
+            status, detail = check_tcp_port(server, params['port'])
+
+        elif service == "UDP":
+            status, detail = check_udp_port(server, params['port'], params['timeout'])
+
+        elif service == "LOCAL TCP":
+            status, detail = local_tcp_echo(server, params['port'], verbose=False)
+
+        else:
+            status, detail = False, f"Unknown service {service}"
+
+    except Exception as e:
+        # A check that crashes counts as a failed check
+        status, detail = False, f"{service} check of {server} failed due to an error: {e}"
+
+    elapsed_ms = ((end or time.perf_counter()) - start) * 1000
+    resolve_ms = resolution.cache.stop_timing()
+    result = {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'server': server,
+        'service': service,
+        'status': status,
+        'latency_ms': round(round_trip_ms if round_trip_ms is not None else elapsed_ms - (resolve_ms or 0), 2),
+        'detail': detail
+    }
+
+    # Resolution is reported on its own, a cache miss would otherwise look like a slow target
+    if resolve_ms is not None:
+        result['resolve_ms'] = round(resolve_ms, 2)
+
+    # Structured hops for the path history
+    if hops is not None:
+        result['hops'] = hops
+        result['traceroute_ms'] = round(traceroute_ms, 2)
+
+    # Handshake times and certificate details of a completed TLS handshake
+    if tls:
+        result['tls'] = tls
+    return result
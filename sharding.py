@@ -0,0 +1,317 @@
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from config_schema import get_services
+from monitor_engine import MonitorEngine, diff_server_dicts
+from server_selector import select_server_dict
+
+
+def dependency_groups(server_dict):
+    """
+    Group the servers connected through depends_on, directly or further up or downstream, so that a server
+    and its parents can be placed in the same shard and suppression can see the parents' state
+    :param server_dict: dictionary with server and service information
+    :return: dictionary of server to the key of its group, the smallest server name in the group
+    """
+    groups = {server: server for server in server_dict}
+
+    def find(server):
+        while groups[server] != server:
+            groups[server] = groups[groups[server]]
+            server = groups[server]
+        return server
+
+    for server, config in server_dict.items():
+        for parent in config.get('depends_on', []):
+            if parent in groups:
+                first, second = sorted((find(server), find(parent)))
+                groups[second] = first
+    return {server: find(server) for server in server_dict}
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping servers to nodes. Adding or removing a node only moves the servers
+    that hashed to it, so shards stay stable as workers or agents come and go. Servers connected through
+    depends_on are hashed together, so every node has the parents of the servers it checks.
+    """
+    def __init__(self, nodes=(), replicas=64):
+        """
+        :param nodes: initial node names
+        :param replicas: virtual points per node, more points give a more even split
+        """
+        self.replicas = replicas
+        self.points = []
+        self.owners = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        """
+        Stable hash of a key, unlike hash() it is the same in every process
+        :param key: string to hash
+        :return: int
+        """
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def add(self, node):
+        """
+        Add a node to the ring
+        :param node: node name
+        :return: None
+        """
+        for replica in range(self.replicas):
+            point = self.hash(f"{node}#{replica}")
+            bisect.insort(self.points, point)
+            self.owners[point] = node
+
+    def remove(self, node):
+        """
+        Remove a node from the ring
+        :param node: node name
+        :return: None
+        """
+        for replica in range(self.replicas):
+            point = self.hash(f"{node}#{replica}")
+            self.points.remove(point)
+            del self.owners[point]
+
+    @property
+    def nodes(self):
+        """
+        Names of the nodes on the ring
+        """
+        return set(self.owners.values())
+
+    def node_for(self, key):
+        """
+        Find the node owning a key: the first point clockwise from the key's hash
+        :param key: server name
+        :return: node name
+        """
+        if not self.points:
+            raise ValueError("Hash ring has no nodes")
+        position = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.owners[self.points[position]]
+
+    def nodes_for(self, key, count):
+        """
+        Find the distinct nodes owning a key when it is replicated to several nodes,
+        walking clockwise from the key's hash
+        :param key: server name
+        :param count: number of nodes wanted
+        :return: list of node names, shorter than count if the ring has fewer nodes
+        """
+        if not self.points:
+            raise ValueError("Hash ring has no nodes")
+        count = min(count, len(self.nodes))
+        position = bisect.bisect(self.points, self.hash(key))
+        nodes = []
+        while len(nodes) < count:
+            node = self.owners[self.points[position % len(self.points)]]
+            if node not in nodes:
+                nodes.append(node)
+            position += 1
+        return nodes
+
+    def partition(self, server_dict, replication=1):
+        """
+        Split a server dict into one shard per node
+        :param server_dict: dictionary with server and service information
+        :param replication: number of nodes each server is assigned to
+        :return: dictionary of node name to its shard of the server dict
+        """
+        shards = {node: {} for node in self.nodes}
+        for server, group in dependency_groups(server_dict).items():
+            for node in self.nodes_for(group, replication) if replication > 1 else [self.node_for(group)]:
+                shards[node][server] = server_dict[server]
+        return shards
+
+
+class QueueSink:
+    """
+    Sink that forwards results from a worker process to the supervisor
+    """
+    def __init__(self, results):
+        """
+        :param results: multiprocessing queue read by the supervisor
+        """
+        self.results = results
+
+    def emit(self, result):
+        """
+        Send a single check result to the supervisor
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        self.results.put(result)
+
+    def reopen(self):
+        """
+        Nothing to reopen, the supervisor owns the real sinks
+        :return: None
+        """
+        pass
+
+    def close(self):
+        """
+        Nothing to close, the supervisor owns the real sinks
+        :return: None
+        """
+        pass
+
+
+def run_worker(shard, results, control, adaptive=False, coalesce=True):
+    """
+    Worker process: run a MonitorEngine over one shard until told to stop
+    :param shard: this worker's part of the server dict
+    :param results: queue the results are sent back over
+    :param control: pipe receiving ('reload', shard) and ('stop',) messages
+    :param adaptive: use adaptive intervals by default
+    :param coalesce: share the results of equivalent probes within the shard
+    :return: None
+    """
+    # CTRL + C reaches the whole process group, let the supervisor decide when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    engine = MonitorEngine(shard, [QueueSink(results)], adaptive=adaptive, coalesce=coalesce)
+    engine.start()
+    try:
+        while True:
+            message = control.recv()
+            if message[0] == 'reload':
+                engine.reload(message[1])
+            else:
+                break
+    except EOFError:
+        # Supervisor went away
+        pass
+    finally:
+        engine.stop(timeout=5)
+
+
+class Supervisor:
+    """
+    Partitions the servers across worker processes by consistent hashing, each running its own engine,
+    and streams every result back to the parent's sinks. Offers the same start/stop/reload interface as
+    MonitorEngine so it can be used in its place.
+    """
+    def __init__(self, server_dict, sinks, workers, selector=None, adaptive=False, coalesce=True):
+        """
+        :param server_dict: dictionary with server and service information
+        :param sinks: list of sinks that receive every check result
+        :param workers: number of worker processes
+        :param selector: parsed selector limiting the checks, or None for all
+        :param adaptive: use adaptive intervals for services that do not set 'adaptive' themselves
+        :param coalesce: share the results of equivalent probes within each worker
+        """
+        self.selector = selector
+        self.adaptive = adaptive
+        self.coalesce = coalesce
+        self.server_dict = select_server_dict(server_dict, selector)
+        self.sinks = sinks
+        self.ring = HashRing([f"worker-{number}" for number in range(workers)])
+        self.results = multiprocessing.Queue()
+        self.processes = {}
+        self.pipes = {}
+        self.shards = {}
+        self.collector = threading.Thread(target=self.collect, name="result-collector", daemon=True)
+        self.event = threading.Event()
+        self.started_at = None
+        self.first_result_at = None
+
+    @property
+    def check_count(self):
+        """
+        Number of configured checks across every worker
+        """
+        return sum(len(get_services(services)) for services in self.server_dict.values())
+
+    def start(self):
+        """
+        Start a worker process per shard and the thread collecting their results
+        :return: None
+        """
+        self.started_at = time.perf_counter()
+        self.shards = self.ring.partition(self.server_dict)
+        for node, shard in self.shards.items():
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker,
+                                              args=(shard, self.results, child_end, self.adaptive, self.coalesce),
+                                              name=node, daemon=True)
+            process.start()
+            self.processes[node] = process
+            self.pipes[node] = parent_end
+        self.collector.start()
+
+    def collect(self):
+        """
+        Forward results from the workers to the sinks
+        :return: None
+        """
+        while not self.event.is_set():
+            try:
+                result = self.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self.first_result_at is None:
+                self.first_result_at = time.perf_counter()
+            for sink in self.sinks:
+                sink.emit(result)
+
+    def reload(self, server_dict):
+        """
+        Send the workers whose shard changed their new shard; each worker only touches the checks that changed
+        :param server_dict: new dictionary with server and service information
+        :return: tuple of (started, stopped, retuned) check counts
+        """
+        server_dict = select_server_dict(server_dict, self.selector)
+        changes = diff_server_dicts(self.server_dict, server_dict)
+
+        # Compare whole shards: metadata such as dependencies changes without changing any check, and a
+        # changed dependency can move a server to the worker that checks its new parent
+        shards = self.ring.partition(server_dict)
+        self.server_dict = server_dict
+        for node, shard in shards.items():
+            if shard != self.shards.get(node):
+                self.pipes[node].send(('reload', shard))
+        self.shards = shards
+        return tuple(sum(1 for change in changes if change[0] == action) for action in ('start', 'stop', 'retune'))
+
+    def update_servers(self, changes):
+        """
+        Apply changes to single servers. Shards are cut from the whole server dict, so this reloads it.
+        :param changes: dictionary of changed server to its new config, None for a deleted server
+        :return: tuple of (started, stopped, retuned) check counts, as from reload
+        """
+        server_dict = dict(self.server_dict)
+        for server, config in changes.items():
+            if config is None:
+                server_dict.pop(server, None)
+            else:
+                server_dict[server] = config
+        return self.reload(server_dict)
+
+    def stop(self, timeout=None):
+        """
+        Stop every worker, then the collector
+        :param timeout: seconds to wait for each worker
+        :return: None
+        """
+        for pipe in self.pipes.values():
+            try:
+                pipe.send(('stop',))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.event.set()
+        if self.collector.is_alive():
+            self.collector.join()
@@ -0,0 +1,331 @@
+import gzip
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+
+
+class StdoutSink:
+    """
+    Writes check results to standard output as one line of text per result
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def emit(self, result):
+        """
+        Write a single check result
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        line = format_result(result)
+        with self.lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    def reopen(self):
+        """
+        Nothing to reopen for standard output
+        :return: None
+        """
+        pass
+
+    def close(self):
+        """
+        Flush any pending output
+        :return: None
+        """
+        sys.stdout.flush()
+
+
+class FileSink:
+    """
+    Appends check results to a file as text lines or JSON lines. The file can be reopened
+    on SIGHUP so that external log rotation works.
+    """
+    def __init__(self, path, fmt="text"):
+        self.path = path
+        self.fmt = fmt
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1)
+
+    def emit(self, result):
+        """
+        Write a single check result
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        line = json.dumps(result) if self.fmt == "jsonl" else format_result(result)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def reopen(self):
+        """
+        Close and reopen the file, picking up a new file if it was rotated away
+        :return: None
+        """
+        with self.lock:
+            self.file.close()
+            self.file = open(self.path, "a", buffering=1)
+
+    def close(self):
+        """
+        Close the file
+        :return: None
+        """
+        with self.lock:
+            self.file.close()
+
+
+class AsyncFileSink:
+    """
+    Non-blocking file sink: emit only puts the result on a bounded queue, and a background writer formats
+    and writes whole batches at once. When the queue is full the result is dropped and counted rather than
+    slowing the check down. A batch that cannot be written (e.g. disk full) is dropped and counted as well,
+    and the file is reopened for the next one. The file is rotated by size and/or age, keeping a number of
+    numbered backups that can be gzip compressed.
+    """
+    def __init__(self, path, fmt="text", max_bytes=0, rotate_interval=0, backups=5, compress=False,
+                 queue_size=10000, batch_size=500, close_timeout=10):
+        """
+        :param path: file to append to
+        :param fmt: "text" or "jsonl"
+        :param max_bytes: rotate once the file reaches this size, 0 disables
+        :param rotate_interval: rotate once the file is this many seconds old, 0 disables
+        :param backups: rotated files to keep as path.1 (newest) to path.N
+        :param compress: gzip rotated files
+        :param queue_size: results waiting to be written before new ones are dropped
+        :param batch_size: most results written at once
+        :param close_timeout: seconds close waits for the writer to finish the queue
+        """
+        self.path = path
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.compress = compress
+        self.batch_size = batch_size
+        self.close_timeout = close_timeout
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.error = None
+        self.written = 0
+        self.reopen_requested = threading.Event()
+        self.file = open(path, "a")
+        self.opened_at = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name="async-file-sink", daemon=True)
+        self.thread.start()
+
+    def emit(self, result):
+        """
+        Queue a single check result without blocking
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        try:
+            self.queue.put_nowait(result)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def run(self):
+        """
+        Write batches until the None sentinel is received
+        :return: None
+        """
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=1)]
+            except queue.Empty:
+                batch = []
+
+            # Take whatever else is waiting, up to a batch
+            while batch and len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch and batch[-1] is None:
+                stopping = True
+                batch.pop()
+
+            try:
+                if batch:
+                    lines = [json.dumps(result) if self.fmt == "jsonl" else format_result(result) for result in batch]
+                    self.file.write("\n".join(lines) + "\n")
+                    self.file.flush()
+                    self.written += len(batch)
+
+                if self.reopen_requested.is_set():
+                    self.reopen_requested.clear()
+                    self.file.close()
+                    self.file = open(self.path, "a")
+                    self.opened_at = time.monotonic()
+                elif self.should_rotate():
+                    self.rotate()
+            except (OSError, ValueError) as e:
+                # Keep the writer alive so the queue keeps draining, and start over with a fresh file
+                with self.lock:
+                    self.dropped += len(batch)
+                    self.error = e
+                self.reopen_requested.set()
+
+        try:
+            self.file.close()
+        except OSError:
+            pass
+
+    def should_rotate(self):
+        """
+        Whether the current file is due for rotation, an empty file never is
+        :return: bool
+        """
+        size = self.file.tell()
+        if not size:
+            return False
+        return (self.max_bytes and size >= self.max_bytes) or \
+            (self.rotate_interval and time.monotonic() - self.opened_at >= self.rotate_interval)
+
+    def rotate(self):
+        """
+        Shift path.N-1 to path.N, move the current file to path.1 and start a new file. Runs on the writer thread.
+        :return: None
+        """
+        self.file.close()
+        suffix = ".gz" if self.compress else ""
+        for number in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{number}{suffix}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number + 1}{suffix}")
+
+        if self.backups > 0:
+            if self.compress:
+                with open(self.path, "rb") as source, gzip.open(f"{self.path}.1.gz", "wb") as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+        self.file = open(self.path, "a")
+        self.opened_at = time.monotonic()
+
+    def reopen(self):
+        """
+        Ask the writer to reopen the file, e.g. after external log rotation
+        :return: None
+        """
+        self.reopen_requested.set()
+
+    def close(self):
+        """
+        Write everything still queued, then stop the writer, waiting at most close_timeout for each
+        :return: None
+        """
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=self.close_timeout)
+            except queue.Full:
+                pass
+            self.thread.join(self.close_timeout)
+        if self.thread.is_alive():
+            print(f"{self.path}: writer did not finish within {self.close_timeout} s, "
+                  f"{self.queue.qsize()} results not written", file=sys.stderr)
+        with self.lock:
+            if self.dropped:
+                print(f"{self.path}: dropped {self.dropped} results because the queue was full"
+                      f"{f' or writing failed ({self.error})' if self.error else ''}", file=sys.stderr)
+
+
+class RateSink:
+    """
+    Counts results per check to report the effective probe rate of every target
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.started = time.monotonic()
+
+    def emit(self, result):
+        """
+        Count a single check result
+        :param result: result record returned by probe_service
+        :return: None
+        """
+        key = (result['server'], result['service'])
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def rates(self):
+        """
+        Effective probe rate of every check seen so far
+        :return: dictionary of (server, service) to probes per minute
+        """
+        minutes = (time.monotonic() - self.started) / 60
+        with self.lock:
+            return {key: count / minutes for key, count in self.counts.items()}
+
+    def reopen(self):
+        """
+        Nothing to reopen
+        :return: None
+        """
+        pass
+
+    def close(self):
+        """
+        Nothing to close
+        :return: None
+        """
+        pass
+
+
+def format_result(result):
+    """
+    Format a check result as a single line of text
+    :param result: result record returned by probe_service
+    :return: formatted string
+    """
+    status = "UP" if result['status'] else "DOWN"
+    detail = result['detail'].replace("\n", " | ")
+    vantage = f" from {result['vantage']}" if 'vantage' in result else ""
+    if 'suppressed_by' in result:
+        status += f" (suppressed, {result['suppressed_by']} is down)"
+    resolve = f" (+{result['resolve_ms']:.2f} ms resolve)" if 'resolve_ms' in result else ""
+    return (f"[{result['timestamp']}] {result['service']} {result['server']}{vantage} {status} "
+            f"{result['latency_ms']:.2f} ms{resolve} - {detail}")
+
+
+def create_sink(spec):
+    """
+    Create a sink from a command line spec: "stdout", "text:<path>", "jsonl:<path>", or "async-text:<path>"
+    and "async-jsonl:<path>" optionally followed by rotation options such as "?max_mb=10&every=3600&keep=5&gzip=1"
+    :param spec: sink specification string
+    :return: sink object
+    """
+    if spec == "stdout":
+        return StdoutSink()
+
+    fmt, _, path = spec.partition(":")
+    if fmt in ("text", "jsonl") and path:
+        return FileSink(path, fmt)
+
+    if fmt in ("async-text", "async-jsonl") and path:
+        path, _, query = path.partition("?")
+        options = {key: values[-1] for key, values in parse_qs(query).items()}
+        return AsyncFileSink(path, fmt[len("async-"):],
+                             max_bytes=int(float(options.get('max_mb', 0)) * 1024 * 1024),
+                             rotate_interval=float(options.get('every', 0)),
+                             backups=int(options.get('keep', 5)),
+                             compress=options.get('gzip', '0') not in ('0', 'false', 'no'),
+                             queue_size=int(options.get('queue', 10000)))
+
+    raise ValueError(f"Invalid sink: {spec} (expected stdout, text:<path>, jsonl:<path>, async-text:<path> "
+                     f"or async-jsonl:<path>)")
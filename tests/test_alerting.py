@@ -0,0 +1,119 @@
+import threading
+import time
+
+from alerting import AlertDispatcher, CheckState, DEGRADED, DOWN, StateTracker, UP
+
+
+def feed(state, observations):
+    return [state.update(observation) for observation in observations]
+
+
+def test_state_changes_only_once_n_of_m_observations_agree():
+    state = CheckState(confirm=2, window=3)
+    assert feed(state, [UP, UP]) == [[], ['state']]
+    assert state.state == UP
+
+    # A single failure is not enough
+    assert feed(state, [DOWN, UP]) == [[], []]
+    assert state.state == UP
+
+    # Two failures in the last three observations are, even with a success between them
+    assert feed(state, [DOWN]) == [['state']]
+    assert state.state == DOWN
+
+
+def test_observations_outside_the_window_do_not_count():
+    state = CheckState(confirm=2, window=3)
+    feed(state, [UP, UP, DOWN, UP, UP, DOWN])
+    assert state.state == UP
+
+
+def test_observe_classifies_results():
+    params = {'degraded_ms': 100}
+    assert CheckState.observe({'status': False, 'latency_ms': None}, params) == DOWN
+    assert CheckState.observe({'status': True, 'latency_ms': 250}, params) == DEGRADED
+    assert CheckState.observe({'status': True, 'latency_ms': 50}, params) == UP
+    assert CheckState.observe({'status': True, 'latency_ms': 250}, {}) == UP
+
+
+def test_flapping_starts_and_stops_with_hysteresis():
+    state = CheckState(confirm=2, window=3, flap_window=20, flap_start=0.5, flap_stop=0.25)
+    events = [event for events in feed(state, [UP, DOWN] * 10) for event in events]
+    assert events.count('flap_start') == 1
+    assert state.flapping
+
+    # Still flapping once the share of changes fell under flap_start, until it falls under flap_stop
+    feed(state, [UP] * 11)
+    history = list(state.history)
+    share = sum(1 for previous, current in zip(history, history[1:]) if previous != current) / (len(history) - 1)
+    assert 0.25 <= share < 0.5
+    assert state.flapping
+
+    events = [event for events in feed(state, [UP] * 9) for event in events]
+    assert events.count('flap_stop') == 1
+    assert not state.flapping
+
+
+def test_steady_check_does_not_flap():
+    state = CheckState()
+    events = [event for events in feed(state, [UP] * 15 + [DOWN] * 15) for event in events]
+    assert 'flap_start' not in events
+    assert events.count('state') == 2
+
+
+class Dispatcher:
+    def __init__(self):
+        self.alerts = []
+
+    def submit(self, alert):
+        self.alerts.append(alert)
+
+
+def result(server, status, **fields):
+    return dict({'timestamp': 0, 'server': server, 'service': "ICMP", 'status': status,
+                 'latency_ms': 10 if status else None, 'detail': ""}, **fields)
+
+
+def test_child_still_down_after_its_parent_recovers_alerts():
+    dispatcher = Dispatcher()
+    tracker = StateTracker(dispatcher, lambda: {'child': {'ICMP': {}}})
+    for _ in range(3):
+        tracker.emit(result("child", True))
+
+    # Down behind a failed parent: suppressed, no alert
+    for _ in range(5):
+        tracker.emit(result("child", False, suppressed_by="parent"))
+    assert dispatcher.alerts == []
+
+    # The parent recovered, the child is still down
+    for _ in range(2):
+        tracker.emit(result("child", False))
+    assert [(alert['event'], alert['state']) for alert in dispatcher.alerts] == [('state', DOWN)]
+
+
+def test_dispatcher_close_does_not_hang_on_a_stuck_channel():
+    delivering, release = threading.Event(), threading.Event()
+
+    class StuckChannel:
+        def deliver(self, alerts):
+            delivering.set()
+            release.wait()
+
+        def close(self):
+            pass
+
+    def alert(number):
+        return {'server': f"server{number}", 'service': "ICMP", 'event': 'state', 'state': DOWN}
+
+    dispatcher = AlertDispatcher([StuckChannel()], batch_interval=0, max_queue=1)
+    dispatcher.submit(alert(0))
+    assert delivering.wait(5)
+    # The channel is stuck delivering the first alert, its queue fills up
+    for number in range(1, 5):
+        dispatcher.submit(alert(number))
+
+    start = time.monotonic()
+    dispatcher.close(timeout=0.2)
+    assert time.monotonic() - start < 2
+    assert dispatcher.dropped > 0
+    release.set()
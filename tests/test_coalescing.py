@@ -0,0 +1,64 @@
+import coalescing
+from coalescing import ProbeCoalescer
+
+PARAMS = {'dns_server': "8.8.8.8", 'query': "example.com", 'record_types': ["A"], 'interval': 60}
+
+
+def test_shared_results_are_isolated(monkeypatch):
+    probes = []
+
+    def probe_service(server, service, params):
+        probes.append(server)
+        return {'server': server, 'service': service, 'status': True, 'latency_ms': 10}
+
+    monkeypatch.setattr(coalescing, "probe_service", probe_service)
+    coalescer = ProbeCoalescer()
+
+    first = coalescer.probe("a.example.com", "DNS", PARAMS)
+    # The caller annotates its own result, e.g. with suppressed_by
+    first['suppressed_by'] = "gateway"
+    first['status'] = False
+
+    second = coalescer.probe("b.example.com", "DNS", PARAMS)
+    assert probes == ["a.example.com"]
+    assert second['server'] == "b.example.com"
+    assert second['status'] is True
+    assert 'suppressed_by' not in second
+
+    second['latency_ms'] = 99
+    third = coalescer.probe("c.example.com", "DNS", dict(PARAMS, query="EXAMPLE.com."))
+    assert probes == ["a.example.com"]
+    assert third['latency_ms'] == 10
+    assert coalescer.stats()['coalesced'] == 2
+
+
+def test_nested_fields_are_not_shared(monkeypatch):
+    def probe_service(server, service, params):
+        return {'server': server, 'service': service, 'status': True, 'latency_ms': 10,
+                'hops': [{'address': "192.0.2.1"}]}
+
+    monkeypatch.setattr(coalescing, "probe_service", probe_service)
+    coalescer = ProbeCoalescer()
+
+    first = coalescer.probe("a.example.com", "DNS", PARAMS)
+    first['hops'][0]['address'] = "*"
+    second = coalescer.probe("b.example.com", "DNS", PARAMS)
+    second['hops'].append({'address': "192.0.2.2"})
+    third = coalescer.probe("c.example.com", "DNS", PARAMS)
+    assert third['hops'] == [{'address': "192.0.2.1"}]
+
+
+def test_retuned_check_stops_sharing_its_previous_probe(monkeypatch):
+    monkeypatch.setattr(coalescing, "probe_service",
+                        lambda server, service, params: {'server': server, 'service': service, 'status': True})
+    coalescer = ProbeCoalescer()
+
+    coalescer.probe("a.example.com", "DNS", PARAMS)
+    coalescer.probe("b.example.com", "DNS", PARAMS)
+    assert coalescer.stats()['shared_keys'] == 1
+
+    coalescer.probe("b.example.com", "DNS", dict(PARAMS, query="example.org"))
+    assert coalescer.stats()['shared_keys'] == 0
+
+    coalescer.forget("a.example.com", "DNS")
+    assert len(coalescer.latest) == 1
@@ -0,0 +1,87 @@
+import json
+import os
+
+import pytest
+
+from config_store import ConfigStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ConfigStore(str(tmp_path / "server_dict.json"))
+
+
+def test_journal_is_replayed_on_top_of_the_snapshot(store):
+    store.save({'a': {'ICMP': {}}})
+    store.set_server('b', {'DNS': {'port': 53}})
+    store.delete_server('a')
+
+    assert ConfigStore(store.path).load() == {'b': {'DNS': {'port': 53}}}
+
+
+def test_torn_last_line_is_ignored_and_repaired(store):
+    store.set_server('a', {'ICMP': {}})
+    with open(store.journal_path, "a") as journal:
+        journal.write('{"op": "set", "server": "b", "serv')
+
+    assert store.load() == {'a': {'ICMP': {}}}
+
+    store.set_server('c', {'ICMP': {}})
+    assert store.load() == {'a': {'ICMP': {}}, 'c': {'ICMP': {}}}
+
+
+def test_torn_line_longer_than_a_read_is_repaired(store):
+    store.set_server('a', {'ICMP': {}})
+    with open(store.journal_path, "a") as journal:
+        journal.write('{"op": "set", "server": "b", "services": {"HTTP": {"url": "http://' + "x" * 10000)
+
+    store.set_server('c', {'ICMP': {}})
+    assert store.load() == {'a': {'ICMP': {}}, 'c': {'ICMP': {}}}
+
+
+def test_journal_without_base_line_is_ignored(store):
+    store.save({'a': {'ICMP': {}}})
+    with open(store.journal_path, "w") as journal:
+        journal.write(json.dumps({'op': 'delete', 'server': 'a'}) + "\n")
+    assert store.load() == {'a': {'ICMP': {}}}
+
+    store.set_server('b', {'ICMP': {}})
+    assert ConfigStore(store.path).load() == {'a': {'ICMP': {}}, 'b': {'ICMP': {}}}
+
+
+def test_stale_journal_left_by_a_crash_during_compaction_is_ignored(store, monkeypatch):
+    store.save({'a': {'ICMP': {}}})
+    store.set_server('b', {'ICMP': {}})
+
+    # Crash after the new snapshot is renamed into place but before the old journal is removed
+    def crash(path):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(os, "remove", crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.compact()
+    monkeypatch.undo()
+    assert os.path.exists(store.journal_path)
+    assert ConfigStore(store.path).load() == {'a': {'ICMP': {}}, 'b': {'ICMP': {}}}
+
+    # The snapshot is edited by hand after the crash, the old journal must not be replayed over it
+    with open(store.path, "w") as file:
+        json.dump({'c': {'ICMP': {}}}, file)
+    assert ConfigStore(store.path).load() == {'c': {'ICMP': {}}}
+
+    # The next append starts a new journal for the current snapshot
+    store.set_server('d', {'ICMP': {}})
+    assert ConfigStore(store.path).load() == {'c': {'ICMP': {}}, 'd': {'ICMP': {}}}
+
+
+def test_read_journal_returns_only_new_entries(store):
+    store.save({'a': {'ICMP': {}}})
+    store.load()
+    offset = store.journal_offset
+
+    store.set_server('b', {'ICMP': {}})
+    entries, offset, _ = store.read_journal(offset)
+    assert [entry['server'] for entry in entries] == ['b']
+
+    entries, _, _ = store.read_journal(offset)
+    assert entries == []
@@ -0,0 +1,40 @@
+import socket
+import threading
+
+import pytest
+
+from distributed import Coordinator, recv_message, send_message
+
+SERVER_DICT = {f"server{number}.example.com": {'ICMP': {}} for number in range(10)}
+
+
+@pytest.fixture
+def coordinator():
+    coordinator = Coordinator(SERVER_DICT, [], ("127.0.0.1", 0))
+    coordinator.start()
+    yield coordinator
+    coordinator.stop()
+
+
+def connect(coordinator, name):
+    sock = socket.create_connection(coordinator.listener.getsockname(), timeout=5)
+    send_message(sock, {'type': 'hello', 'agent': name}, threading.Lock())
+    return sock
+
+
+def test_agent_is_assigned_every_server(coordinator):
+    with connect(coordinator, "agent1") as sock:
+        message = recv_message(sock)
+    assert message['type'] == 'assign'
+    assert set(message['shard']) == set(SERVER_DICT)
+
+
+def test_agent_reconnecting_under_the_same_name_is_assigned_its_shard_again(coordinator):
+    # The new connection arrives before the old one is noticed as gone
+    with connect(coordinator, "agent1") as old:
+        assert set(recv_message(old)['shard']) == set(SERVER_DICT)
+        with connect(coordinator, "agent1") as new:
+            message = recv_message(new)
+    assert message['type'] == 'assign'
+    assert set(message['shard']) == set(SERVER_DICT)
+    assert coordinator.agent_count == 1
@@ -0,0 +1,56 @@
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+
+import pytest
+
+import network_tests
+
+
+@pytest.fixture
+def tls_server(tmp_path):
+    if not shutil.which("openssl"):
+        pytest.skip("openssl is needed to create a certificate")
+    certificate, key = str(tmp_path / "certificate.pem"), str(tmp_path / "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", certificate,
+                    "-days", "30", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"],
+                   check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certificate, key)
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        while True:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                return
+            try:
+                with context.wrap_socket(client, server_side=True) as sock:
+                    sock.recv(1)
+            except (ssl.SSLError, OSError):
+                pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield listener.getsockname()[1], certificate
+    listener.close()
+
+
+def test_unchanged_certificate_is_decoded_once_without_resumption(tls_server, monkeypatch):
+    port, certificate = tls_server
+    client_context = ssl.create_default_context(cafile=certificate)
+    client_context.check_hostname = False
+    monkeypatch.setattr(network_tests, "get_tls_context", lambda: client_context)
+    monkeypatch.setattr(network_tests, "certificate_cache", {})
+
+    decoded = []
+    parse_certificate = network_tests.parse_certificate
+    monkeypatch.setattr(network_tests, "parse_certificate", lambda info: decoded.append(info) or parse_certificate(info))
+
+    for _ in range(3):
+        status, description, info = network_tests.check_tls("localhost", port, expiry_days=0, resume=False)
+        assert status, description
+        assert not info['resumed']
+    assert len(decoded) == 1
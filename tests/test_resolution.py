@@ -0,0 +1,33 @@
+import socket
+import threading
+
+from resolution import ResolutionCache
+
+ADDRESSES = [(socket.AF_INET, ("192.0.2.1", 0))]
+
+
+def test_lookups_waiting_for_a_running_resolution_are_not_hits(monkeypatch):
+    cache = ResolutionCache()
+    started, release = threading.Event(), threading.Event()
+
+    def lookup(host, family):
+        started.set()
+        release.wait(5)
+        return ADDRESSES
+
+    monkeypatch.setattr(cache, "lookup", lookup)
+    leader = threading.Thread(target=cache.resolve, args=("example.com",))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=cache.resolve, args=("example.com",))
+    follower.start()
+    while cache.stats()['coalesced'] < 1:
+        pass
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert cache.resolve("example.com", 80) == [(socket.AF_INET, ("192.0.2.1", 80))]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['coalesced']) == (1, 1, 1)
+    assert stats['hit_rate'] == 1 / 3
@@ -0,0 +1,35 @@
+import time
+
+import service_checks
+
+PARAMS = {'ttl': 64, 'timeout': 1, 'sequence_number': 1, 'max_hops': 30, 'pings_per_hop': 1}
+
+
+def test_icmp_latency_is_the_ping_round_trip(monkeypatch):
+    def traceroute_hops(server, max_hops, pings_per_hop, verbose):
+        time.sleep(0.2)
+        return [{'ttl': 1, 'address': "192.0.2.1", 'rtt_ms': [4.0]}]
+
+    monkeypatch.setattr(service_checks, "ping", lambda *args: (("192.0.2.1", 0), 12.5))
+    monkeypatch.setattr(service_checks, "traceroute_hops", traceroute_hops)
+    monkeypatch.setattr(service_checks, "format_traceroute", lambda hops: "")
+
+    result = service_checks.probe_service("192.0.2.1", "ICMP", PARAMS)
+    assert result['status']
+    assert result['latency_ms'] == 12.5
+    assert result['traceroute_ms'] >= 200
+    assert len(result['hops']) == 1
+
+
+def test_icmp_latency_without_reply_leaves_out_the_traceroute(monkeypatch):
+    def traceroute_hops(server, max_hops, pings_per_hop, verbose):
+        time.sleep(0.2)
+        return []
+
+    monkeypatch.setattr(service_checks, "ping", lambda *args: (None, None))
+    monkeypatch.setattr(service_checks, "traceroute_hops", traceroute_hops)
+    monkeypatch.setattr(service_checks, "format_traceroute", lambda hops: "")
+
+    result = service_checks.probe_service("192.0.2.1", "ICMP", PARAMS)
+    assert not result['status']
+    assert result['latency_ms'] < 200
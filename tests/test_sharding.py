@@ -0,0 +1,54 @@
+from sharding import HashRing
+
+SERVERS = [f"server{number}.example.com" for number in range(1000)]
+
+
+def owners(ring):
+    return {server: ring.node_for(server) for server in SERVERS}
+
+
+def test_adding_a_node_only_moves_servers_to_it():
+    ring = HashRing(["a", "b", "c"])
+    before = owners(ring)
+    ring.add("d")
+    after = owners(ring)
+
+    moved = [server for server in SERVERS if before[server] != after[server]]
+    assert moved
+    assert all(after[server] == "d" for server in moved)
+    # About a quarter of the servers move to the new node
+    assert len(moved) < len(SERVERS) / 2
+
+
+def test_removing_a_node_only_moves_its_servers():
+    ring = HashRing(["a", "b", "c", "d"])
+    before = owners(ring)
+    ring.remove("d")
+    after = owners(ring)
+
+    for server in SERVERS:
+        if before[server] != "d":
+            assert after[server] == before[server]
+        else:
+            assert after[server] != "d"
+
+
+def test_add_then_remove_restores_the_assignment():
+    ring = HashRing(["a", "b"])
+    before = owners(ring)
+    ring.add("c")
+    ring.remove("c")
+    assert owners(ring) == before
+
+
+def test_partition_keeps_dependent_servers_together():
+    server_dict = {
+        'gateway': {'ICMP': {}},
+        'web': {'depends_on': ['gateway'], 'HTTP': {}},
+        **{server: {'ICMP': {}} for server in SERVERS[:50]}
+    }
+    shards = HashRing(["a", "b", "c"]).partition(server_dict)
+
+    assert sum(len(shard) for shard in shards.values()) == len(server_dict)
+    assert [node for node, shard in shards.items() if 'web' in shard] == \
+           [node for node, shard in shards.items() if 'gateway' in shard]